@@ -40,6 +40,13 @@ from google.appengine.datastore import entity_pb
 # Datastore Plus imports
 from ndb import model
 
+# The most keys in each get_multi or put_multi request.
+MAX_MULTI = 500
+
+def _is_name(x):
+    """Returns True if x is a non-empty string, as keys and values must be."""
+    return isinstance(x, basestring) and len(x) > 0
+
 try:
     appid = os.environ['APPLICATION_ID']
     appver = os.environ['CURRENT_VERSION_ID'].split('.')[0]
@@ -62,6 +69,17 @@ class CacheEntry(model.Model): # id=key
     def putit(cls, keyname, value):
         cls(key=cls.get_key(keyname), value=value).put()
 
+    @classmethod
+    def getit_multi(cls, keynames):
+        """Returns a dictionary of the values of the CacheEntry entities named keynames."""
+        entries = model.get_multi([cls.get_key(x) for x in keynames])
+        return dict((x, e.value) for x, e in zip(keynames, entries) if e)
+
+    @classmethod
+    def putit_multi(cls, values):
+        """Puts a CacheEntry for each keyname and value of the dictionary values."""
+        model.put_multi([cls(key=cls.get_key(x), value=v) for x, v in values.iteritems()])
+
 class GetHandler(webapp.RequestHandler):
     def get(self):
         self.post()
@@ -89,10 +107,45 @@ class PutHandler(webapp.RequestHandler):
             return
         logging.info('Putting %s=%s' % (key, value))
         CacheEntry.putit(key, value)
+
+class GetMultiHandler(webapp.RequestHandler):
+    def post(self):
+        # TODO: required login
+        try:
+            keys = simplejson.loads(self.request.get('keys', '[]'))
+        except ValueError:
+            keys = None
+        if not isinstance(keys, list) or len(keys) > MAX_MULTI or \
+                not all(_is_name(x) for x in keys):
+            logging.error('The keys parameter must be a JSON list of at most %s non-empty '
+                          'string keys' % MAX_MULTI)
+            self.error(400)
+            return
+        values = CacheEntry.getit_multi(keys)
+        self.response.headers["Content-Type"] = "application/json"
+        self.response.out.write(simplejson.dumps(values))
+
+class PutMultiHandler(webapp.RequestHandler):
+    def post(self):
+        # TODO: require login
+        try:
+            values = simplejson.loads(self.request.get('values', '{}'))
+        except ValueError:
+            values = None
+        if not isinstance(values, dict) or len(values) > MAX_MULTI or \
+                not all(_is_name(k) and _is_name(v) for k, v in values.iteritems()):
+            logging.error('The values parameter must be a JSON object of at most %s non-empty '
+                          'string keys and values' % MAX_MULTI)
+            self.error(400)
+            return
+        logging.info('Putting %s keys' % len(values))
+        CacheEntry.putit_multi(values)
             
 application = webapp.WSGIApplication(
     [('/cache/get', GetHandler),
-     ('/cache/put', PutHandler),], debug=True)
+     ('/cache/put', PutHandler),
+     ('/cache/get_multi', GetMultiHandler),
+     ('/cache/put_multi', PutMultiHandler),], debug=True)
          
 def main():
     run_wsgi_app(application)
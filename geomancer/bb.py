@@ -17,12 +17,14 @@
 __author__ = "Aaron Steele and John Wieczorek"
 
 import logging
+import geohash
 from point import *
 from optparse import OptionParser
 import math
 
 class BoundingBox(object):
     """A degree-based geographic bounding box independent of a coordinate reference system."""
+    __slots__ = ('_nw', '_se')
 
     def __init__(self, nw, se):
         self._nw = nw
@@ -55,20 +57,14 @@ class BoundingBox(object):
         return False
 
     def to_kml(self):
-        polygon = '<Polygon><outerBoundaryIs><coordinates>%s</coordinates></outerBoundaryIs></Polygon>'
-        n = self.get_n()
-        s = self.get_s()
-        e = self.get_e()
-        w = self.get_w()
-        coords = '%s,%s %s,%s %s,%s %s,%s %s,%s' % (w,n,w,s,e,s,e,n,w,n)
-        return polygon % coords
+        return kml_polygon(self.get_w(), self.get_n(), self.get_e(), self.get_s())
 
     @classmethod
     def create(cls, xmin, ymax, xmax, ymin):
         return cls(Point(xmin, ymax), Point(xmax, ymin))
     
     def __repr__(self):
-        return str(self.__dict__)
+        return str({'_nw': self._nw, '_se': self._se})
 
     def __eq__(self, other):
         if not isinstance(other, BoundingBox):
@@ -86,7 +82,7 @@ class BoundingBox(object):
         return not result
 
     def __hash__(self):
-        return hash('%s,%s %s,%s' % (self.get_w(), self.get_n(), self.get_e(), self.get_s()))
+        return hash((self.get_w(), self.get_n(), self.get_e(), self.get_s()))
 
     def __cmp__(self, other):
         if self.__eq__(other):
@@ -96,23 +92,93 @@ class BoundingBox(object):
         return -1
 
     @classmethod
-    def get_intersecting(cls, bb_list):
-        pass # TODO
+    def get_intersecting(cls, bb_list, bb):
+        """Returns the BoundingBoxes in bb_list that intersect bb, in list order. bb_list is 
+        a list of BoundingBoxes or a BoundingBoxIndex built from one. Build a BoundingBoxIndex
+        once to query the same list repeatedly."""
+        if not isinstance(bb_list, BoundingBoxIndex):
+            bb_list = BoundingBoxIndex(bb_list)
+        return bb_list.get_intersecting(bb)
 
     @classmethod
     def intersect_all(cls, bb_list):
-        n = len(bb_list)
-        if n == 1:
-            return bb_list[0]
-        if n == 0:
+        """Returns the BoundingBox common to all of the BoundingBoxes in bb_list, or None.
+
+        The result is the same as intersecting the boxes pairwise in order, antimeridian 
+        included, but the reduction runs in one pass over the edges of the boxes and only 
+        the final BoundingBox is created. bb_list is not modified."""
+        bbs = iter(bb_list)
+        first = next(bbs, None)
+        if first is None:
             return None
-        result = bb_list.pop(0)
-        for bb in bb_list:
-            result = bb.intersection(result)
-            if result is None:
+        rn, rs, rw, re = first.get_n(), first.get_s(), first.get_w(), first.get_e()
+        rw180, re180 = lng180(rw), lng180(re)
+        result = first
+        for bb in bbs:
+            result = None
+            n, s, w, e = bb.get_n(), bb.get_s(), bb.get_w(), bb.get_e()
+            w180, e180 = lng180(w), lng180(e)
+            if s <= rn and rn <= n:
+                new_n = rn
+            elif rs <= n and n <= rn:
+                new_n = n
+            else:
+                return None
+            if s <= rs and rs <= n:
+                new_s = rs
+            elif rs <= s and s <= rn:
+                new_s = s
+            else:
+                return None
+            span = _lng_span(w180, e180)
+            rspan = _lng_span(rw180, re180)
+            if span >= _lng_span(rw180, e180):
+                new_w, new_w180 = rw, rw180
+            elif rspan >= _lng_span(w180, re180):
+                new_w, new_w180 = w, w180
+            else:
+                return None
+            if span >= _lng_span(re180, e180):
+                new_e, new_e180 = re, re180
+            elif rspan >= _lng_span(e180, re180):
+                new_e, new_e180 = e, e180
+            else:
                 return None
+            rn, rs, rw, re, rw180, re180 = new_n, new_s, new_w, new_e, new_w180, new_e180
+        if result is None:
+            result = BoundingBox(Point(rw, rn), Point(re, rs))
         return result
     
+    @classmethod
+    def intersect_lists(cls, bb_lists):
+        """Returns the intersection of every combination of one BoundingBox from each list
+        in bb_lists in which all of the BoundingBoxes overlap."""
+        if len(bb_lists) == 0:
+            return []
+        results = list(bb_lists[0])
+        for bbs in bb_lists[1:]:
+            if len(results) == 0:
+                break
+            results = cls._intersect_pairs(results, bbs)
+        return results
+
+    @classmethod
+    def _intersect_pairs(cls, bbs0, bbs1):
+        """Returns the intersections of every overlapping pair of BoundingBoxes taking one
+        from bbs0 and one from bbs1, in the order of bbs0 and then of bbs1.
+
+        bbs1 is packed into a BoundingBoxIndex once, and each box of bbs0 is only 
+        intersected with the boxes the index finds near it, in O(log n + k) for k of 
+        them, so boxes overlapping in latitude but far apart in longitude cost nothing."""
+        index = BoundingBoxIndex(bbs1)
+        results = []
+        for bb in bbs0:
+            for other in index.get_intersecting(bb):
+                found = bb.intersection(other)
+                if found is not None:
+                    results.append(found)
+        return results
+
     def intersection(self,bb):
         """Returns a BoundingBox created from an intersection or None."""
         my_n=self.nw.get_lat()
@@ -159,7 +225,98 @@ class BoundingBox(object):
     def calc_radius(self):
         """Returns a radius in meters from the center to the farthest corner of the bounding box."""
         return self.se.haversine_distance(self.nw)/2.0
+
+    @classmethod
+    def from_geohash(cls, code):
+        """Returns the BoundingBox of the cell of a geohash."""
+        return cls.create(*geohash.decode_bb(code))
+
+    def geohash_cover(self, precision=None, max_cells=geohash.MAX_CELLS):
+        """Returns the sorted list of the geohashes of the cells covering the bounding box,
+        across the antimeridian if its west edge is east of its east edge. The geohashes have
+        precision characters, or the most characters that cover it in at most max_cells.
+        Unlike lng_distance, the same west and east edges are a single meridian here; a box 
+        from -180 to 180 covers the whole circle."""
+        return geohash.cover(self.get_w(), self.get_n(), self.get_e(), self.get_s(), 
+                             precision, max_cells)
             
+class BoundingBoxIndex(object):
+    """Static R-tree of BoundingBoxes packed with the Sort-Tile-Recursive algorithm.
+
+    The tree is built in bulk and queried in O(log n + k) for k intersecting boxes. Boxes
+    that cross the antimeridian are indexed as their parts on either side of it. Boxes 
+    intersect if they overlap or share an edge or corner."""
+
+    NODE_SIZE = 16
+
+    def __init__(self, bb_list, node_size=NODE_SIZE):
+        self.bbs = list(bb_list)
+        self.node_size = max(2, node_size)
+        entries = []
+        for i, bb in enumerate(self.bbs):
+            for w, e in _lng_intervals(bb.get_w(), bb.get_e()):
+                entries.append((w, bb.get_s(), e, bb.get_n(), None, i))
+        self.root = None
+        if entries:
+            self.root = self._pack(entries)
+
+    def __len__(self):
+        return len(self.bbs)
+
+    def _pack(self, nodes):
+        """Returns the root node over a list of nodes, each a tuple of (w, s, e, n, children, 
+        index) where children is None for a leaf holding the index of a BoundingBox."""
+        size = self.node_size
+        while len(nodes) > 1:
+            groups = int(math.ceil(len(nodes) / float(size)))
+            slabs = int(math.ceil(math.sqrt(groups)))
+            slab_size = slabs * size
+            nodes.sort(key=lambda x: x[0] + x[2])
+            parents = []
+            for i in range(0, len(nodes), slab_size):
+                slab = sorted(nodes[i:i + slab_size], key=lambda x: x[1] + x[3])
+                for j in range(0, len(slab), size):
+                    children = slab[j:j + size]
+                    parents.append((min([x[0] for x in children]), min([x[1] for x in children]),
+                                    max([x[2] for x in children]), max([x[3] for x in children]),
+                                    children, None))
+            nodes = parents
+        return nodes[0]
+
+    def get_intersecting(self, bb):
+        """Returns the indexed BoundingBoxes that intersect bb, in the order they were given."""
+        if self.root is None:
+            return []
+        s, n = bb.get_s(), bb.get_n()
+        found = set()
+        for w, e in _lng_intervals(bb.get_w(), bb.get_e()):
+            stack = [self.root]
+            while stack:
+                node = stack.pop()
+                if node[0] > e or node[2] < w or node[1] > n or node[3] < s:
+                    continue
+                if node[4] is None:
+                    found.add(node[5])
+                else:
+                    stack.extend(node[4])
+        return [self.bbs[i] for i in sorted(found)]
+
+def _lng_intervals(west_lng, east_lng):
+    """Returns the list of (w, e) longitude intervals with w <= e covering the longitudes 
+    from west_lng eastward to east_lng, split at the antimeridian."""
+    w = lng180(west_lng)
+    e = lng180(east_lng)
+    if w == e:
+        return [(-180, 180)]
+    if w < e:
+        return [(w, e)]
+    return [(w, 180), (-180, e)]
+
+def kml_polygon(w, n, e, s):
+    """Returns the KML Polygon of a bounding box given its edges in degrees."""
+    coords = '%s,%s %s,%s %s,%s %s,%s %s,%s' % (w,n,w,s,e,s,e,n,w,n)
+    return '<Polygon><outerBoundaryIs><coordinates>%s</coordinates></outerBoundaryIs></Polygon>' % coords
+
 def is_lng_between(lng, west_lng, east_lng):
     '''
     Returns true if the given lng is between the longitudes west_lng and east_lng
@@ -171,6 +328,14 @@ def is_lng_between(lng, west_lng, east_lng):
         return True
     return False
 
+def _lng_span(w, e):
+    """lng_distance for longitudes w and e already between {-180, 180]."""
+    if w == e:
+        return 360
+    if e > w:
+        return e - w
+    return 360 + e - w
+
 def lng_distance(west_lng, east_lng):
     '''Returns the number of degrees from west_lng going eastward to east_lng.'''
     w = lng180(west_lng)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+# Copyright 2011 University of California at Berkeley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "Aaron Steele and John Wieczorek"
+
+"""This module provides columnar arrays of Points and BoundingBoxes.
+
+The coordinates are held in contiguous NumPy float64 arrays, one per coordinate, and the
+bulk operations run over whole columns with the vgeo kernels. Indexing an array with an
+integer returns a Point or BoundingBox with the same values, so the scalar API is still
+available for single elements."""
+
+import numpy as np
+
+import geohash
+import vgeo
+from bb import BoundingBox, kml_polygon
+from point import Point
+
+def _column(values):
+    return np.ascontiguousarray(values, dtype=np.float64).reshape(-1)
+
+class PointArray(object):
+    """An array of degree-based geographic coordinates."""
+    __slots__ = ('lng', 'lat')
+
+    def __init__(self, lng, lat):
+        self.lng = _column(lng)
+        self.lat = _column(lat)
+        if len(self.lng) != len(self.lat):
+            raise ValueError('lng and lat must have the same length')
+
+    @classmethod
+    def from_points(cls, points):
+        return cls([p.lng for p in points], [p.lat for p in points])
+
+    def __len__(self):
+        return len(self.lng)
+
+    def __getitem__(self, i):
+        """Returns a Point for an integer index, or a PointArray for a slice, mask or
+        array of indexes."""
+        if isinstance(i, (int, long, np.integer)):
+            return Point(float(self.lng[i]), float(self.lat[i]))
+        return PointArray(self.lng[i], self.lat[i])
+
+    def __iter__(self):
+        for lng, lat in zip(self.lng.tolist(), self.lat.tolist()):
+            yield Point(lng, lat)
+
+    def to_list(self):
+        return list(self)
+
+    def point_from_distance_at_bearing(self, distance, bearing):
+        """Returns the PointArray of the destinations of going distance meters at bearing
+        degrees from each Point. distance and bearing are scalars or arrays."""
+        return PointArray(*vgeo.point_from_distance_at_bearing(
+                self.lng, self.lat, distance, bearing))
+
+    def haversine_distance(self, end_points):
+        """Returns an array of the great circle distances in meters to end_points, a Point
+        or a PointArray of the same length."""
+        return vgeo.haversine_distance(self.lng, self.lat, end_points.lng, end_points.lat)
+
+    def point2wgs84(self, datum):
+        """Returns the PointArray in WGS84 of the Points in the given Datum."""
+        return PointArray(*vgeo.point2wgs84(self.lng, self.lat, datum))
+
+    def to_geohash(self, precision=geohash.PRECISION):
+        """Returns an array of the geohashes of precision characters of the Points."""
+        return vgeo.geohash_encode(self.lng, self.lat, precision)
+
+    @classmethod
+    def from_geohash(cls, hashes):
+        """Returns the PointArray of the centers of the cells of the geohashes."""
+        w, n, e, s = vgeo.geohash_decode_bb(hashes)
+        return cls((w + e) / 2, (n + s) / 2)
+
+class BoundingBoxArray(object):
+    """An array of degree-based geographic bounding boxes held as columns of their
+    west, north, east and south edges."""
+    __slots__ = ('w', 'n', 'e', 's')
+
+    def __init__(self, w, n, e, s):
+        self.w = _column(w)
+        self.n = _column(n)
+        self.e = _column(e)
+        self.s = _column(s)
+        if not len(self.w) == len(self.n) == len(self.e) == len(self.s):
+            raise ValueError('w, n, e and s must have the same length')
+
+    @classmethod
+    def from_bbs(cls, bbs):
+        return cls([bb.get_w() for bb in bbs], [bb.get_n() for bb in bbs],
+                   [bb.get_e() for bb in bbs], [bb.get_s() for bb in bbs])
+
+    @classmethod
+    def from_pr(cls, points, radius):
+        """Returns the boxes around the PointArray points reaching radius meters, a scalar
+        or an array, north, east, south and west of each. See bb.bb_from_pr."""
+        return cls(*vgeo.bbs_from_pr(points.lng, points.lat, radius))
+
+    @classmethod
+    def from_geohash(cls, hashes):
+        """Returns the BoundingBoxArray of the cells of the geohashes."""
+        return cls(*vgeo.geohash_decode_bb(hashes))
+
+    def __len__(self):
+        return len(self.w)
+
+    def __getitem__(self, i):
+        """Returns a BoundingBox for an integer index, or a BoundingBoxArray for a slice,
+        mask or array of indexes."""
+        if isinstance(i, (int, long, np.integer)):
+            return BoundingBox.create(float(self.w[i]), float(self.n[i]),
+                                      float(self.e[i]), float(self.s[i]))
+        return BoundingBoxArray(self.w[i], self.n[i], self.e[i], self.s[i])
+
+    def __iter__(self):
+        for w, n, e, s in self._rows():
+            yield BoundingBox.create(w, n, e, s)
+
+    def _rows(self):
+        return zip(self.w.tolist(), self.n.tolist(), self.e.tolist(), self.s.tolist())
+
+    def to_list(self):
+        return list(self)
+
+    def get_nw(self):
+        return PointArray(self.w, self.n)
+    nw = property(get_nw)
+
+    def get_se(self):
+        return PointArray(self.e, self.s)
+    se = property(get_se)
+
+    def to_kml(self):
+        """Returns the list of the KML Polygons of the boxes."""
+        return [kml_polygon(w, n, e, s) for w, n, e, s in self._rows()]
+
+    def center(self):
+        """Returns the PointArray of the great circle midpoints of the boxes."""
+        return PointArray(*vgeo.great_circle_midpoint(self.w, self.n, self.e, self.s))
+
+    def calc_radius(self):
+        """Returns an array of the radii in meters from the centers to the farthest corners
+        of the boxes."""
+        return vgeo.haversine_distance(self.e, self.s, self.w, self.n) / 2.0
+
+    def intersects(self, bb):
+        """Returns a boolean array that is True for the boxes that intersect the BoundingBox
+        bb, as BoundingBox.intersection does."""
+        return self._intersection(bb)[0]
+
+    def intersection(self, bb):
+        """Returns the BoundingBoxArray of the intersections with the BoundingBox bb of the
+        boxes that intersect it, in order."""
+        found, w, n, e, s = self._intersection(bb)
+        return BoundingBoxArray(w[found], n[found], e[found], s[found])
+
+    def _intersection(self, bb):
+        bb_n, bb_s, bb_w, bb_e = bb.get_n(), bb.get_s(), bb.get_w(), bb.get_e()
+        n_in = (self.s <= bb_n) & (bb_n <= self.n)
+        n_out = (bb_s <= self.n) & (self.n <= bb_n)
+        s_in = (self.s <= bb_s) & (bb_s <= self.n)
+        s_out = (bb_s <= self.s) & (self.s <= bb_n)
+        w_in = vgeo.is_lng_between(bb_w, self.w, self.e)
+        w_out = vgeo.is_lng_between(self.w, bb_w, bb_e)
+        e_in = vgeo.is_lng_between(bb_e, self.w, self.e)
+        e_out = vgeo.is_lng_between(self.e, bb_w, bb_e)
+        found = (n_in | n_out) & (s_in | s_out) & (w_in | w_out) & (e_in | e_out)
+        return (found, np.where(w_in, bb_w, self.w), np.where(n_in, bb_n, self.n),
+                np.where(e_in, bb_e, self.e), np.where(s_in, bb_s, self.s))
@@ -21,13 +21,20 @@ __contributors__ = ["John Wieczorek (gtuco.btuco@gmail.com)"]
 """This module provides a cache for locality types and geocodes."""
 
 # Geomancer modules
+from metrics import METRICS
+from tracing import TRACE
 from utils import AppEngine, CredentialsPrompt
 
 # Standard Python modules
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import atexit
 import logging
 import simplejson
 import sqlite3
 import sys
+import threading
+import time
 import urllib
     
 # Credentials
@@ -37,18 +44,63 @@ PASSWD = None
 # Setup local cache
 CREATE_SQL = 'create table if not exists cache (key text primary key, value text)'
 GET_SQL = 'select value from cache where key = ?'
-PUT_SQL = 'insert into cache (key, value) values (?, ?)'
-CONN = sqlite3.connect('gm.cache.sqlite3.db', check_same_thread=False)
-CONN.cursor().execute(CREATE_SQL)
+PUT_SQL = 'insert or replace into cache (key, value) values (?, ?)'
+GET_MANY_SQL = 'select key, value from cache where key in (%s)'
+# The most keys in each GET_MANY_SQL query, below the SQLite limit of 999 variables.
+GET_MANY_CHUNK = 500
+# The local cache file, shared by every thread and process through its own connection.
+FILENAME = 'gm.cache.sqlite3.db'
+# Seconds a connection waits on a lock held by another connection before failing.
+BUSY_TIMEOUT = 30.0
+_LOCAL = threading.local()
 
 # Setup remote cache
 SERVER = None
 HOST = 'localhost:8080'
+# The most keys in each /cache/get_multi or /cache/put_multi request, as on the server.
+REMOTE_BATCH = 500
+# The most batch requests to the remote cache in flight at once.
+REMOTE_IN_FLIGHT = 4
+# The most keys waiting to be written behind to the remote cache before puts block.
+REMOTE_QUEUE_SIZE = 10000
+# Seconds the write behind worker waits for more keys before flushing a partial batch.
+REMOTE_FLUSH_INTERVAL = 1.0
+# Seconds the write behind worker waits before retrying a failed flush, doubled on each
+# failure up to REMOTE_MAX_RETRY_DELAY.
+REMOTE_RETRY_DELAY = 1.0
+REMOTE_MAX_RETRY_DELAY = 60.0
+# Failed flushes in a row after which closing gives up on the pending keys.
+REMOTE_CLOSE_RETRIES = 5
+
+# Setup memory cache
+MEMORY_ENTRIES = 10000
+MEMORY_BYTES = None
+MEMORY_TTL = None
 
 def _setup_local(filename):
-    global CONN
-    CONN = sqlite3.connect(filename, check_same_thread=False)
-    CONN.cursor().execute(CREATE_SQL)
+    global FILENAME
+    FILENAME = filename
+    _connection()
+
+def _connection():
+    """Returns the connection of the current thread to the local cache file, opening it in
+    write-ahead log mode so readers and a writer in other threads or processes do not block
+    each other."""
+    conn = getattr(_LOCAL, 'conn', None)
+    if conn is not None and _LOCAL.filename == FILENAME:
+        return conn
+    if conn is not None:
+        conn.close()
+    conn = sqlite3.connect(FILENAME, timeout=BUSY_TIMEOUT)
+    conn.execute('pragma journal_mode=wal')
+    # Commits don't wait for an fsync of the log, so on a power failure the commits since
+    # the last checkpoint can be lost. A process crash loses none of them.
+    conn.execute('pragma synchronous=normal')
+    conn.execute(CREATE_SQL)
+    conn.commit()
+    _LOCAL.conn = conn
+    _LOCAL.filename = FILENAME
+    return conn
 
 def _setup_remote(host=HOST):
     global HOST
@@ -67,13 +119,91 @@ def _assert_key(key):
 def _assert_value(value):
     assert value is not None
 
+class MemoryCache(object):
+    """In-process LRU cache of decoded values in front of the local and remote caches.
+
+    Holds at most max_entries values and, if max_bytes is not None, values whose JSON
+    takes at most max_bytes in all. The least recently used values are evicted first.
+    Values older than ttl seconds are dropped if ttl is not None. A copy of each value is
+    stored on put, so callers may go on changing theirs, but the values get returns are 
+    shared and must not be modified."""
+
+    def __init__(self, max_entries=MEMORY_ENTRIES, max_bytes=MEMORY_BYTES, ttl=MEMORY_TTL):
+        self._lock = threading.Lock()
+        self.configure(max_entries, max_bytes, ttl)
+
+    def configure(self, max_entries=MEMORY_ENTRIES, max_bytes=MEMORY_BYTES, ttl=MEMORY_TTL):
+        """Sets the limits and empties the cache."""
+        self._lock.acquire()
+        try:
+            self.max_entries = max(0, max_entries)
+            self.max_bytes = max_bytes
+            self.ttl = ttl
+            # key -> (value, size, expires)
+            self._entries = OrderedDict()
+            self.bytes = 0
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if entry[2] is not None and entry[2] <= time.time():
+                self.bytes -= entry[1]
+                METRICS.incr('cache.memory.expired')
+                return None
+            # Reinsert the entry as the most recently used.
+            self._entries[key] = entry
+            return entry[0]
+        finally:
+            self._lock.release()
+
+    def put(self, key, value):
+        if self.max_entries == 0:
+            return
+        data = simplejson.dumps(value)
+        size = 0
+        if self.max_bytes is not None:
+            size = len(data)
+            if size > self.max_bytes:
+                return
+        value = simplejson.loads(data)
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+        self._lock.acquire()
+        try:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size, expires)
+            self.bytes += size
+            evicted = 0
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self.bytes > self.max_bytes):
+                self.bytes -= self._entries.popitem(last=False)[1][1]
+                evicted += 1
+        finally:
+            self._lock.release()
+        if evicted:
+            METRICS.incr('cache.memory.eviction', evicted)
+
+# The MemoryCache in front of the local and remote caches:
+MEMORY = MemoryCache()
+
 class LocalCache(object):
     """Local key/value cache where values are stored as JSON."""
 
     @classmethod
     def get(cls, key):
         _assert_key(key)
-        hit = CONN.cursor().execute(GET_SQL, (key,)).fetchone()
+        hit = _connection().execute(GET_SQL, (key,)).fetchone()
         if hit:
             return simplejson.loads(hit[0])
                 
@@ -81,8 +211,46 @@ class LocalCache(object):
     def put(cls, key, value):
         _assert_key(key)
         _assert_value(value)
-        CONN.cursor().execute(PUT_SQL, (key, simplejson.dumps(value)))
-        CONN.commit()
+        conn = _connection()
+        try:
+            conn.execute(PUT_SQL, (key, simplejson.dumps(value)))
+        except:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    @classmethod
+    def get_many(cls, keys):
+        """Returns a dictionary of the cached values of keys, without the keys not cached."""
+        keys = list(set(keys))
+        for key in keys:
+            _assert_key(key)
+        hits = {}
+        conn = _connection()
+        for i in range(0, len(keys), GET_MANY_CHUNK):
+            chunk = keys[i:i + GET_MANY_CHUNK]
+            sql = GET_MANY_SQL % ','.join('?' * len(chunk))
+            for key, value in conn.execute(sql, chunk):
+                hits[key] = simplejson.loads(value)
+        return hits
+
+    @classmethod
+    def put_many(cls, items):
+        """Caches the (key, value) pairs of items in one transaction."""
+        rows = []
+        for key, value in items:
+            _assert_key(key)
+            _assert_value(value)
+            rows.append((key, simplejson.dumps(value)))
+        if not rows:
+            return
+        conn = _connection()
+        try:
+            conn.executemany(PUT_SQL, rows)
+        except:
+            conn.rollback()
+            raise
+        conn.commit()
 
 class RemoteCache(object):
     """Remote cache based on App Engine for locality types and geocodes."""
@@ -116,6 +284,35 @@ class RemoteCache(object):
         def kwargs(self):  
             return {}
         
+    class GetMulti(AppEngine.RPC):
+        def __init__(self, keys):
+            self._payload = urllib.urlencode(dict(keys=simplejson.dumps(keys)))
+        def request_path(self):
+            return '/cache/get_multi'
+        def payload(self):
+            return self._payload        
+        def content_type(self):
+            return 'application/x-www-form-urlencoded'    
+        def timeout(self):
+            return None  
+        def kwargs(self):  
+            return {}
+
+    class PutMulti(AppEngine.RPC):
+        def __init__(self, items):
+            values = dict((key, simplejson.dumps(value)) for key, value in items)
+            self._payload = urllib.urlencode(dict(values=simplejson.dumps(values)))
+        def request_path(self):
+            return '/cache/put_multi'
+        def payload(self):
+            return self._payload        
+        def content_type(self):
+            return 'application/x-www-form-urlencoded'    
+        def timeout(self):
+            return None  
+        def kwargs(self):  
+            return {}
+
     @classmethod
     def get(cls, key):
         _assert_key(key)
@@ -135,11 +332,234 @@ class RemoteCache(object):
             _setup_remote()
         SERVER.send(RemoteCache.Put(key, value))
 
+    @classmethod
+    def get_many(cls, keys):
+        """Returns a dictionary of the cached values of keys, without the keys not cached.
+        Keys are sent REMOTE_BATCH at a time in up to REMOTE_IN_FLIGHT concurrent requests."""
+        keys = list(set(keys))
+        for key in keys:
+            _assert_key(key)
+        hits = {}
+        for content in cls._send_batches(RemoteCache.GetMulti, keys):
+            if content:
+                for key, value in simplejson.loads(content).iteritems():
+                    hits[key] = simplejson.loads(value)
+        return hits
+
+    @classmethod
+    def put_many(cls, items):
+        """Caches the (key, value) pairs of items, REMOTE_BATCH at a time in up to 
+        REMOTE_IN_FLIGHT concurrent requests."""
+        items = dict(items).items()
+        for key, value in items:
+            _assert_key(key)
+            _assert_value(value)
+        cls._send_batches(RemoteCache.PutMulti, items)
+
+    @classmethod
+    def _send_batches(cls, rpc, values):
+        """Returns the list of the responses to rpc(batch) for the batches of values."""
+        if not values:
+            return []
+        if not SERVER:
+            _setup_remote()
+        batches = [values[i:i + REMOTE_BATCH] for i in range(0, len(values), REMOTE_BATCH)]
+        if len(batches) == 1:
+            return [SERVER.send(rpc(batches[0]))]
+        pool = ThreadPool(min(REMOTE_IN_FLIGHT, len(batches)))
+        try:
+            return pool.map(lambda batch: SERVER.send(rpc(batch)), batches)
+        finally:
+            pool.close()
+
+class RemoteWriter(object):
+    """Write behind queue of remote cache puts flushed in batches by a background thread.
+
+    Puts of a key still waiting are coalesced into one put of its last value. A copy of
+    each value is queued, so callers may change theirs after put. Puts block while 
+    max_pending keys are waiting. Failed flushes are retried with a growing delay. close()
+    flushes the waiting keys before returning, and runs when the interpreter exits."""
+
+    def __init__(self, max_pending=REMOTE_QUEUE_SIZE, interval=REMOTE_FLUSH_INTERVAL):
+        self.max_pending = max(1, max_pending)
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()
+        self._flushing = 0
+        self._flush_waiters = 0
+        self._failures = 0
+        self._closed = False
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending) + self._flushing
+
+    def put(self, key, value):
+        value = simplejson.loads(simplejson.dumps(value))
+        self._cond.acquire()
+        try:
+            if self._closed:
+                raise ValueError('Remote cache writer is closed')
+            if len(self._pending) >= self.max_pending and not self._pending.has_key(key):
+                METRICS.incr('cache.remote.queue.full')
+                while len(self._pending) >= self.max_pending and not self._pending.has_key(key):
+                    self._cond.wait()
+            if self._pending.has_key(key):
+                METRICS.incr('cache.remote.queue.coalesced')
+            self._pending[key] = value
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='RemoteWriter')
+                self._thread.daemon = True
+                self._thread.start()
+            if len(self._pending) == 1 or len(self._pending) >= self._batch_size():
+                # Wake the worker to start its interval or write a full batch.
+                self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    def put_many(self, items):
+        for key, value in items:
+            self.put(key, value)
+
+    def _batch_size(self):
+        """Returns the most keys written at a time, enough for REMOTE_IN_FLIGHT requests."""
+        return min(REMOTE_BATCH * REMOTE_IN_FLIGHT, self.max_pending)
+
+    def flush(self):
+        """Blocks until every key put so far has been written, or dropped after 
+        REMOTE_CLOSE_RETRIES failed writes in a row."""
+        self._cond.acquire()
+        try:
+            self._flush_waiters += 1
+            self._cond.notify_all()
+            while self._pending or self._flushing:
+                self._cond.wait()
+        finally:
+            self._flush_waiters -= 1
+            self._cond.release()
+
+    def close(self):
+        """Flushes the waiting keys and stops the background thread. Keys still waiting 
+        after REMOTE_CLOSE_RETRIES failed flushes in a row are dropped and logged."""
+        self._cond.acquire()
+        try:
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        finally:
+            self._cond.release()
+        if thread is not None:
+            thread.join()
+
+    def _take(self):
+        """Returns the next batch of (key, value) items to write, or None to stop.
+
+        Waits for a full batch, for interval seconds after the first key, for a flush() or 
+        for close()."""
+        full = self._batch_size()
+        self._cond.acquire()
+        try:
+            deadline = None
+            while not (self._closed or self._flush_waiters) and len(self._pending) < full:
+                if not self._pending:
+                    deadline = None
+                    self._cond.wait()
+                    continue
+                if deadline is None:
+                    deadline = time.time() + self.interval
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if not self._pending:
+                return None
+            if (self._closed or self._flush_waiters) and self._failures >= REMOTE_CLOSE_RETRIES:
+                logging.error('Dropped %s remote cache updates after %s failed writes', 
+                              len(self._pending), self._failures)
+                self._pending.clear()
+                # Later keys get a fresh set of retries.
+                self._failures = 0
+                self._cond.notify_all()
+                return None
+            items = []
+            while self._pending and len(items) < full:
+                items.append(self._pending.popitem(last=False))
+            self._flushing = len(items)
+            # Wake puts blocked on a full queue.
+            self._cond.notify_all()
+            return items
+        finally:
+            self._cond.release()
+
+    def _run(self):
+        while True:
+            items = self._take()
+            if items is None:
+                # _take only returns None when closed or with nothing waiting.
+                self._cond.acquire()
+                try:
+                    if self._closed and not self._pending:
+                        self._thread = None
+                        self._cond.notify_all()
+                        return
+                finally:
+                    self._cond.release()
+                continue
+            error = None
+            try:
+                with METRICS.timer('cache.remote.put'):
+                    RemoteCache.put_many(items)
+            except Exception, e:
+                error = e
+            self._cond.acquire()
+            try:
+                self._flushing = 0
+                if error is None:
+                    self._failures = 0
+                else:
+                    # Requeue the keys not put again since, ahead of the newer keys.
+                    self._failures += 1
+                    requeued = OrderedDict((k, v) for k, v in items if not self._pending.has_key(k))
+                    requeued.update(self._pending)
+                    self._pending = requeued
+                    delay = min(REMOTE_MAX_RETRY_DELAY, REMOTE_RETRY_DELAY * 2 ** (self._failures - 1))
+                self._cond.notify_all()
+            finally:
+                self._cond.release()
+            if error is not None:
+                METRICS.incr('cache.remote.put.error')
+                logging.error('Unable to write %s keys to the remote cache: %s', len(items), error)
+                time.sleep(delay)
+
+# The RemoteWriter of the write behind mode, None if puts are written through:
+WRITER = None
+
+def _setup_writer(write_behind):
+    global WRITER
+    if write_behind and WRITER is None:
+        WRITER = RemoteWriter()
+    elif not write_behind and WRITER is not None:
+        WRITER.close()
+        WRITER = None
+
+def _close_writer():
+    if WRITER is not None:
+        WRITER.close()
+
+atexit.register(_close_writer)
+
 class Cache(object):
     """Cache for locality types and geocodes from local and remote storage."""
 
     @classmethod
-    def config(cls, creds=None, remote_host=None, local_filename=None):
+    def config(cls, creds=None, remote_host=None, local_filename=None, memory_entries=None,
+               memory_bytes=None, memory_ttl=None, write_behind=None):
+        """Arguments:
+            memory_entries - the most values in the memory cache, 0 to turn it off
+            memory_bytes - the most bytes of JSON values in the memory cache
+            memory_ttl - seconds values stay in the memory cache
+            write_behind - True to queue puts to the remote cache for a background thread,
+                           False to write them before put returns"""
         global EMAIL
         global PASSWD
         if creds:
@@ -148,28 +568,139 @@ class Cache(object):
             _setup_remote(remote_host)
         if local_filename:
             _setup_local(local_filename)
+            MEMORY.configure(MEMORY.max_entries, MEMORY.max_bytes, MEMORY.ttl)
+        if memory_entries is not None or memory_bytes is not None or memory_ttl is not None:
+            MEMORY.configure(
+                MEMORY.max_entries if memory_entries is None else memory_entries,
+                MEMORY.max_bytes if memory_bytes is None else memory_bytes,
+                MEMORY.ttl if memory_ttl is None else memory_ttl)
+        if write_behind is not None:
+            _setup_writer(write_behind)
 
     @classmethod
-    def get(cls, key):
+    def flush(cls):
+        """Blocks until the puts queued for the remote cache have been written."""
+        if WRITER is not None:
+            WRITER.flush()
+
+    @classmethod
+    def get(cls, key, remote=True):
+        """Returns the cached value of key, or None. remote - False to skip the remote cache."""
         key = cls._clean_key(key)
-        value = LocalCache.get(key)
+        value = MEMORY.get(key)
         if value:
-            logging.info('CACHE-LOCAL-HIT: "%s"' % key)
+            METRICS.incr('cache.memory.hit')
+            TRACE.event('CACHE-MEMORY-HIT', '"%s"', key)
             return value
-        logging.info('CACHE-LOCAL-MISS: "%s"' % key)
-        value = RemoteCache.get(key)
+        METRICS.incr('cache.memory.miss')
+        with METRICS.timer('cache.local.get'):
+            value = LocalCache.get(key)
         if value:
-            logging.info('CACHE-REMOTE-HIT: "%s"' % key)
-            LocalCache.put(key, value)
+            METRICS.incr('cache.local.hit')
+            TRACE.event('CACHE-LOCAL-HIT', '"%s"', key)
+            MEMORY.put(key, value)
             return value
-        logging.info('CACHE-REMOTE-MISS: "%s"' % key)
+        METRICS.incr('cache.local.miss')
+        TRACE.event('CACHE-LOCAL-MISS', '"%s"', key)
+        if not remote:
+            return None
+        with METRICS.timer('cache.remote.get'):
+            value = RemoteCache.get(key)
+        if value:
+            METRICS.incr('cache.remote.hit')
+            TRACE.event('CACHE-REMOTE-HIT', '"%s"', key)
+            with METRICS.timer('cache.local.put'):
+                LocalCache.put(key, value)
+            MEMORY.put(key, value)
+            return value
+        METRICS.incr('cache.remote.miss')
+        TRACE.event('CACHE-REMOTE-MISS', '"%s"', key)
     
     @classmethod
-    def put(cls, key, value):
+    def put(cls, key, value, remote=True):
+        """Caches value under key. remote - False to keep it out of the remote cache."""
         key = cls._clean_key(key)
-        logging.info('CACHE-UPDATE: %s' % key)
-        LocalCache.put(key, value)
-        RemoteCache.put(key, value)
+        TRACE.event('CACHE-UPDATE', '%s', key)
+        MEMORY.put(key, value)
+        with METRICS.timer('cache.local.put'):
+            LocalCache.put(key, value)
+        if not remote:
+            return
+        if WRITER is not None:
+            WRITER.put(key, value)
+            return
+        with METRICS.timer('cache.remote.put'):
+            RemoteCache.put(key, value)
+
+    @classmethod
+    def get_many(cls, keys, remote=True):
+        """Returns a dictionary of the cached values of keys, without the keys not cached.
+
+        The keys missing from memory are looked up in the local cache in one batch, and 
+        the keys missing from both in the remote cache in batches of REMOTE_BATCH unless
+        remote is False."""
+        clean_keys = dict((key, cls._clean_key(key)) for key in keys)
+        values = {}
+        for key in set(clean_keys.values()):
+            value = MEMORY.get(key)
+            if value:
+                values[key] = value
+        METRICS.incr('cache.memory.hit', len(values))
+        misses = [key for key in set(clean_keys.values()) if not values.has_key(key)]
+        METRICS.incr('cache.memory.miss', len(misses))
+        if misses:
+            with METRICS.timer('cache.local.get'):
+                hits = LocalCache.get_many(misses)
+            local = [key for key in misses if hits.get(key)]
+            METRICS.incr('cache.local.hit', len(local))
+            METRICS.incr('cache.local.miss', len(misses) - len(local))
+            for key in local:
+                TRACE.event('CACHE-LOCAL-HIT', '"%s"', key)
+                MEMORY.put(key, hits[key])
+                values[key] = hits[key]
+            misses = [key for key in misses if not values.has_key(key)]
+            for key in misses:
+                TRACE.event('CACHE-LOCAL-MISS', '"%s"', key)
+            fetched = []
+            if misses and remote:
+                with METRICS.timer('cache.remote.get'):
+                    hits = RemoteCache.get_many(misses)
+                for key in misses:
+                    value = hits.get(key)
+                    if value:
+                        METRICS.incr('cache.remote.hit')
+                        TRACE.event('CACHE-REMOTE-HIT', '"%s"', key)
+                        MEMORY.put(key, value)
+                        values[key] = value
+                        fetched.append((key, value))
+                    else:
+                        METRICS.incr('cache.remote.miss')
+                        TRACE.event('CACHE-REMOTE-MISS', '"%s"', key)
+            if fetched:
+                with METRICS.timer('cache.local.put'):
+                    LocalCache.put_many(fetched)
+        return dict((key, values[clean]) for key, clean in clean_keys.iteritems() 
+                    if values.has_key(clean))
+
+    @classmethod
+    def put_many(cls, items, remote=True):
+        """Caches the (key, value) pairs of items, in one transaction in the local cache.
+        remote - False to keep them out of the remote cache."""
+        clean = {}
+        for key, value in items:
+            clean[cls._clean_key(key)] = value
+        for key, value in clean.iteritems():
+            TRACE.event('CACHE-UPDATE', '%s', key)
+            MEMORY.put(key, value)
+        with METRICS.timer('cache.local.put'):
+            LocalCache.put_many(clean.items())
+        if not remote:
+            return
+        if WRITER is not None:
+            WRITER.put_many(clean.items())
+            return
+        with METRICS.timer('cache.remote.put'):
+            RemoteCache.put_many(clean.items())
 
     @classmethod
     def _clean_key(cls, key):
@@ -3,6 +3,7 @@ import copy
 import csv
 import logging
 import os
+import re
 import sys
 
 def constant(f):
@@ -360,6 +361,37 @@ def _build_datums_class():
     def all(cls):
         return iter(datums.values())
     props['all'] = all
+
+    def key(value):
+        """Returns value upper cased without spaces or punctuation, so that 'WGS 84', 
+        'wgs-84' and 'WGS84' match."""
+        return re.sub(r'[^0-9A-Z]', '', (value or '').upper())
+
+    aliases = {'NAD27': 'NAD27_CONUS_MEAN', 'NAD83': 'NAD83_MEAN',
+               'EPSG:4326': 'WGS84', 'EPSG:4267': 'NAD27_CONUS_MEAN', 'EPSG:4269': 'NAD83_MEAN',
+               'North American Datum 1927': 'NAD27_CONUS_MEAN', 
+               'North American Datum 1983': 'NAD83_MEAN'}
+    aliases = dict((key(alias), datums[code]) for alias, code in aliases.items())
+    keys = dict((key(d.name), d) for d in datums.values())
+    keys.update((key(code), d) for code, d in datums.items())
+    keys.update(aliases)
+
+    @classmethod
+    def find(cls, value):
+        """Returns the Datum for a code, alias, 'EPSG:<code>' or name as written in the 
+        geodeticDatum of a record, ignoring case, spaces and punctuation, or None. Datums
+        without ellipsoid parameters can't be transformed, so they are None too, as is
+        NOT_RECORDED, whose coordinates are in an unknown datum."""
+        value = key(value)
+        datum = keys.get(value)
+        if datum is None and value.startswith('EPSG') and value[4:].isdigit():
+            datum = epsgmap.get(int(value[4:]))
+        if datum is None or datum.code == 'NOT_RECORDED':
+            return None
+        if datum.axis <= 0 or datum.flattening <= 0:
+            return None
+        return datum
+    props['find'] = find
     
     return type('Datum', (), props)
 
@@ -20,29 +20,56 @@ __contributors__ = ["Aaron Steele (eightysteele@gmail.com)"]
 
 """This module provides core functions and classes for georeferencing"""
 
+import hashlib
 import math
 import logging
+import os
+import re
 import simplejson
 
 from constants import DistanceUnits
 #from constants import Datums
 from constants import Headings
 from bb import *
+from lexer import CONNECTIVES, HEADINGS, UNITS, lex_offset, lex_offsets, match_number, tokenize
 from point import *
 
 # Geomancer modules
 from cache import Cache
-from utils import UnicodeDictReader, UnicodeDictWriter, CredentialsPrompt
+from metrics import METRICS
+from tracing import TRACE, Lazy
+from utils import UnicodeDictReader, UnicodeDictWriter, CredentialsPrompt, Future
 
 # Standard Python modules
 import httplib2
 import logging
+from multiprocessing.pool import ThreadPool
 import optparse
 import simplejson
 import sys
+import threading
+import time
 import urllib
 import yaml
 
+"""CALCULATOR_VERSION is the version of the locality parsers and georef calculations. Bump
+it whenever they change so that cached georef results are recomputed."""
+CALCULATOR_VERSION = 2
+
+def _constants_digest():
+    """Returns a short hash of the constants tables, the CSV files of the constants package."""
+    path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'constants')
+    digest = hashlib.md5()
+    for name in sorted(os.listdir(path)):
+        if name.endswith('.csv'):
+            digest.update(name)
+            digest.update(open(os.path.join(path, name), 'rb').read())
+    return digest.hexdigest()[:8]
+
+"""GEOREF_VERSION is part of the key of each cached georef result. It changes with 
+CALCULATOR_VERSION and with the constants tables."""
+GEOREF_VERSION = '%s.%s' % (CALCULATOR_VERSION, _constants_digest())
+
 class Locality(object):
     """Class representing a sub-locality."""
     
@@ -60,65 +87,368 @@ class Locality(object):
         self.parts = {}
         self.georefs = []
     
+    @classmethod
+    def from_dict(cls, d):
+        """Returns a Locality from a dictionary made by to_dict."""
+        loc = cls(d['name'])
+        loc.type = d['type']
+        loc.type_scores = d['type_scores']
+        # The dictionary may be a value shared by the memory cache.
+        loc.parts = dict(d['parts'])
+        loc.georefs = [BoundingBox.create(*x) for x in d['georefs']]
+        return loc
+
+    def to_dict(self):
+        """Returns a dictionary of the locality that can be stored as JSON."""
+        return dict(name=self.name, type=self.type, type_scores=self.type_scores, 
+                    parts=self.parts, georefs=_bbs_to_list(self.georefs))
+
     def __repr__(self):
-        return str(self.__dict__)
+        return 'Locality(%r, type=%r)' % (self.name, self.type)
     
-class Geomancer(object):
-    def __init__(self, predictor, geocoder, creds=None, cache_remote_host=None):
+class AsyncGeomancer(object):
+    """Georeferences locations without blocking the caller.
+
+    Each *_async method returns a Future right away. Cache lookups, predictions and 
+    geocodes run on a shared pool of max_in_flight worker threads, and the parse and 
+    calculate stages run as callbacks once their inputs arrive, so any number of 
+    locations can be in progress at once without a thread per location. Concurrent 
+    requests for the same prediction or geocode share a single lookup."""
+
+    def __init__(self, predictor, geocoder, creds=None, cache_remote_host=None, 
+                 max_in_flight=10, geocode_timeout=None):
+        """Arguments:
+            max_in_flight - the most cache lookups, predictions and geocodes to run concurrently
+            geocode_timeout - seconds to wait on each geocode request, or None to wait forever"""
         self.predictor = predictor
         self.geocoder = geocoder
+        self.max_in_flight = max(1, max_in_flight)
+        self.geocode_timeout = geocode_timeout
+        self._pool = None
+        self._lock = threading.Lock()
+        self._lookups = {}
         Cache.config(creds=creds, remote_host=cache_remote_host)        
 
+    def georef_async(self, location):
+        """Returns a Future for the (localities, georefs) tuple of a location.
+
+        The result is cached locally under the normalized sub-localities of the location, 
+        so a location seen before is returned without predicting, parsing or geocoding. 
+        Results are not written to the remote cache, which already holds the locality types
+        and geocodes they are calculated from."""
+        localities = Locality.create_muti(location)
+        key = result_key(localities)
+        TRACE.event('GEOREF', '"%s" with sub-localities %s', location, 
+                    Lazy(lambda: [x.name for x in localities]))
+        result = Future()
+        start = time.time()
+
+        def cached(value):
+            if value:
+                METRICS.incr('records')
+                result.set_result(result_from_dict(value))
+                return
+            predictions = Future.gather([self.predict_async(loc.name) for loc in localities])
+            _then(predictions, result, predicted)
+
+        def predicted(predictions):
+            METRICS.record('stage.predict', time.time() - start)
+            for loc, prediction in zip(localities, predictions):
+                loc.type = prediction['loctype']
+                loc.type_scores = prediction['scores']
+            self.parse(localities)
+            features = []
+            for loc in localities:
+                features.extend([x for x in geocoded_features(loc) if x not in features])
+            geocoding = time.time()
+            geocodes = Future.gather([self.geocode_async(x) for x in features])
+            _then(geocodes, result, lambda geocodes: geocoded(dict(zip(features, geocodes)), geocoding))
+
+        def geocoded(geocodes, geocoding):
+            METRICS.record('stage.geocode', time.time() - geocoding)
+            for loc in localities:
+                loc.parts['feature_geocodes'] = dict(
+                    (x, geocodes[x]) for x in geocoded_features(loc) if geocodes[x])
+            localities_calculated, georefs = self.calculate(localities)
+            if is_complete(localities):
+                Cache.put(key, result_to_dict(localities, georefs), remote=False)
+            METRICS.incr('records')
+            result.set_result((localities, georefs))
+
+        _then(self.cached_async(key), result, cached)
+        return result
+
+    def cached_async(self, key):
+        """Returns a Future for the value of key in the local cache, or for None if it is 
+        not cached there."""
+        return self._submit(key, lambda: Cache.get(key, remote=False))
+
+    def predict_async(self, name):
+        """Returns a Future for the cached or freshly predicted locality type dictionary of a name."""
+        return self._lookup_async('loctype-%s' % name, self._request_prediction, name)
+
+    def geocode_async(self, feature):
+        """Returns a Future for the cached or freshly requested geocode of a feature, or for 
+        None if the request fails or times out."""
+        return self._lookup_async('geocode-%s' % feature, self._request_geocode, feature)
+
+    def parse(self, localities):
+        with METRICS.timer('stage.parse'):
+            for loc in localities:
+                loc.parts = parse_loc(loc.name, loc.type)
+                TRACE.event('PARSE', '"%s" as "%s" with features %s', loc.name, loc.type, 
+                            Lazy(lambda parts: list(parts.get('features', [])), loc.parts))
+        return localities
+
+    def calculate(self, localities):
+        with METRICS.timer('stage.calculate'):
+            georefs = loc_georefs(localities)
+        return (localities, georefs)
+
+    def _lookup_async(self, key, request, arg):
+        """Returns a Future for the cached value of key, calling request(arg) on the worker 
+        pool and caching its result on a miss."""
+        def lookup():
+            value = Cache.get(key)
+            if not value:
+                value = request(arg)
+                if value:
+                    Cache.put(key, value)
+            return value
+        return self._submit(key, lookup)
+
+    def _lookup_many(self, keys, request, args):
+        """Returns the list of the values of keys, looked up in the cache in one batch. 
+        request(arg) is called concurrently on the worker pool for the keys not cached, with
+        the arg at the same index of args, and its results are cached in one batch."""
+        values = Cache.get_many(keys)
+        misses = {}
+        for key, arg in zip(keys, args):
+            if not values.get(key):
+                misses.setdefault(key, arg)
+        misses = misses.items()
+        requested = Future.gather(
+            [self._submit(key, lambda arg=arg: request(arg)) for key, arg in misses]).get_result()
+        fresh = [(key, value) for (key, arg), value in zip(misses, requested) if value]
+        if fresh:
+            Cache.put_many(fresh)
+        values.update(fresh)
+        return [values.get(key) for key in keys]
+
+    def _submit(self, key, fn):
+        """Returns a Future for the result of calling fn() on the worker pool. Calls for a
+        key already in flight share its Future."""
+        self._lock.acquire()
+        try:
+            future = self._lookups.get(key)
+            if future:
+                return future
+            future = Future()
+            self._lookups[key] = future
+            if not self._pool:
+                self._pool = ThreadPool(self.max_in_flight)
+        finally:
+            self._lock.release()
+
+        def run():
+            try:
+                value = fn()
+            except Exception:
+                self._forget(key)
+                future.set_exc_info(sys.exc_info())
+                return
+            self._forget(key)
+            future.set_result(value)
+
+        self._pool.apply_async(run)
+        return future
+
+    def _forget(self, key):
+        self._lock.acquire()
+        try:
+            del self._lookups[key]
+        finally:
+            self._lock.release()
+
+    def _request_prediction(self, name):
+        with METRICS.timer('api.prediction'):
+            loctype, scores = self.predictor.get_type(name)
+        return dict(locname=name, loctype=loctype, scores=scores)
+
+    def _request_geocode(self, feature):
+        """Returns a geocode for a feature from the geocoder or None if the request fails."""
+        try:
+            with METRICS.timer('api.geocoding'):
+                if self.geocode_timeout is None:
+                    return self.geocoder.geocode(feature)
+                return self.geocoder.geocode(feature, timeout=self.geocode_timeout)
+        except (IOError, ValueError) as e:
+            # ValueError is raised for a response that is not valid JSON.
+            METRICS.incr('api.geocoding.error')
+            logging.error('Unable to geocode "%s": %s', feature, e)
+
+class Geomancer(AsyncGeomancer):
+    """Synchronous interface to AsyncGeomancer that blocks until each stage is done."""
+
+    def __init__(self, predictor, geocoder, creds=None, cache_remote_host=None, 
+                 max_in_flight=1, geocode_timeout=None):
+        AsyncGeomancer.__init__(self, predictor, geocoder, creds=creds, 
+                                cache_remote_host=cache_remote_host, 
+                                max_in_flight=max_in_flight, 
+                                geocode_timeout=geocode_timeout)
+
     def georef(self, location):
         """Georeferences a location."""
-        localities = Locality.create_muti(location)
-        logging.info('Georeferencing "%s" with sub-localities %s' % (location, [x.name for x in localities]))
-        localities_predicted = self.predict(localities)
-        localities_parsed = self.parse(localities_predicted)
-        localities_geocoded = self.geocode(localities_parsed)
-        localities_calculated, georefs = self.calculate(localities_geocoded)
-        return (localities_geocoded, georefs)
+        return self.georef_async(location).get_result()
+
+    def georef_many(self, locations):
+        """Georeferences a batch of locations and returns a list of (localities, georefs)
+        tuples in the same order as locations.
+
+        Locations with a cached result are not georeferenced again. Sub-localities and 
+        features of the rest are normalized and deduplicated across the whole batch first, 
+        so prediction, parsing and geocoding run once per distinct string rather than once 
+        per record."""
+        records = [Locality.create_muti(location) for location in locations]
+        keys = [result_key(localities) for localities in records]
+        results = {}
+        for key, value in Cache.get_many(keys, remote=False).iteritems():
+            if value:
+                results[key] = result_from_dict(value)
+        pending = {}
+        for key, localities in zip(keys, records):
+            if not results.has_key(key):
+                pending.setdefault(key, localities)
+        unique = {}
+        for localities in pending.itervalues():
+            for loc in localities:
+                key = normalize_name(loc.name)
+                if not unique.has_key(key):
+                    unique[key] = Locality(loc.name)
+        TRACE.event('GEOREF-MANY', '%s records with %s cached and %s distinct sub-localities', 
+                    len(records), len(results), len(unique))
+        self.parse(self.predict(unique.values()))
+        features = {}
+        for loc in unique.itervalues():
+            for feature in geocoded_features(loc):
+                features.setdefault(normalize_name(feature), feature)
+        geocodes = self.geocode_features(features.values())
+        for loc in unique.itervalues():
+            loc.parts['feature_geocodes'] = {}
+            for feature in geocoded_features(loc):
+                geocode = geocodes.get(features[normalize_name(feature)])
+                if geocode:
+                    loc.parts['feature_geocodes'][feature] = geocode
+        complete = []
+        for key, localities in pending.iteritems():
+            for loc in localities:
+                shared = unique[normalize_name(loc.name)]
+                loc.type = shared.type
+                loc.type_scores = shared.type_scores
+                loc.parts = dict(shared.parts)
+            localities_calculated, georefs = self.calculate(localities)
+            if is_complete(localities):
+                complete.append((key, result_to_dict(localities, georefs)))
+            results[key] = (localities, georefs)
+        if complete:
+            Cache.put_many(complete, remote=False)
+        METRICS.incr('records', len(records))
+        return [results[key] for key in keys]
 
     def predict(self, localities):
         """Predict locality type for each locality in a list."""
-        for loc in localities:
-            logging.info('Predicting locality type for "%s"' % loc.name)
-            key = 'loctype-%s' % loc.name
-            prediction = Cache.get(key)
-            if not prediction:
-                loctype, scores = self.predictor.get_type(loc.name)
-                prediction = dict(locname=loc.name, loctype=loctype, scores=scores)
-                Cache.put(key, prediction)
+        with METRICS.timer('stage.predict'):
+            names = [loc.name for loc in localities]
+            predictions = self._lookup_many(
+                ['loctype-%s' % name for name in names], self._request_prediction, names)
+        for loc, prediction in zip(localities, predictions):
             loc.type = prediction['loctype']
             loc.type_scores = prediction['scores']
-            logging.info('Predicted "%s" for "%s"' % (loc.type, loc.name))
-        return localities
-
-    def parse(self, localities):
-        for loc in localities:
-            logging.info('Parsing "%s" based on locality type "%s"' % (loc.name, loc.type))
-            loc.parts = parse_loc(loc.name, loc.type)
-            logging.info('Parsed features "%s"' % list(loc.parts['features']))
+            TRACE.event('PREDICT', '"%s" for "%s"', loc.type, loc.name)
         return localities
 
     def geocode(self, localities):
+        features = []
+        for loc in localities:
+            features.extend(geocoded_features(loc))
+        geocodes = self.geocode_features(features)
         for loc in localities:
             loc.feature_geocodes = {}
             loc.parts['feature_geocodes'] = {}
-            for feature in loc.parts['features']:              
-                logging.info('Geocoding feature "%s"' % feature)  
-                key = 'geocode-%s' % feature
-                geocode = Cache.get(key)
-                if not geocode:
-                    geocode = self.geocoder.geocode(feature)
-                    Cache.put(key, geocode)
-                loc.parts['feature_geocodes'][feature] = geocode 
-                logging.info('Geocoded feature "%s"' % feature)
+            for feature in geocoded_features(loc):              
+                if geocodes.has_key(feature):
+                    loc.parts['feature_geocodes'][feature] = geocodes[feature]
+                    TRACE.event('GEOCODE', '"%s"', feature)
         return localities
 
-    def calculate(self, localities):
-        georefs = loc_georefs(localities)
-        return (localities, georefs)
+    def geocode_features(self, features):
+        """Returns a dictionary of geocodes keyed by feature for a list of features.
+
+        Features are looked up concurrently, at most max_in_flight at a time. Features
+        whose request fails or times out are left out of the dictionary."""
+        features = list(set(features))
+        with METRICS.timer('stage.geocode'):
+            geocodes = self._lookup_many(
+                ['geocode-%s' % x for x in features], self._request_geocode, features)
+        return dict((x, geocode) for x, geocode in zip(features, geocodes) if geocode)
+
+def _then(future, result, stage):
+    """Calls stage with the value of future once it is done, passing any error on to result."""
+    def callback(future):
+        try:
+            stage(future.get_result())
+        except Exception:
+            result.set_exc_info(sys.exc_info())
+    future.add_callback(callback)
+
+def normalize_name(name):
+    """Returns a name lower cased with surrounding and repeated white space removed."""
+    return ' '.join(name.lower().split())
+
+def result_key(localities):
+    """Returns the cache key of the georef result for a list of sub-localities."""
+    names = sorted(set([normalize_name(loc.name) for loc in localities]))
+    return 'georef-%s-%s' % (GEOREF_VERSION, ';'.join(names))
+
+def is_complete(localities):
+    """Returns True if every sub-locality has a georef calculator and every feature of every
+    sub-locality has a geocode, so that a result left incomplete by a failed geocode request
+    or by a locality type without a calculator is not cached."""
+    for loc in localities:
+        if not has_calculator(loc.type):
+            return False
+        geocodes = loc.parts.get('feature_geocodes') or {}
+        for feature in loc.parts.get('features', []):
+            if not geocodes.has_key(feature):
+                return False
+    return True
+
+def result_to_dict(localities, georefs):
+    """Returns a dictionary of a (localities, georefs) result that can be stored as JSON.
+    The feature geocodes are left out of the parts, they are cached under their own keys."""
+    localities = [loc.to_dict() for loc in localities]
+    for d in localities:
+        d['parts'] = dict((k, v) for k, v in d['parts'].iteritems() if k != 'feature_geocodes')
+    return dict(localities=localities, georefs=_bbs_to_list(georefs))
+
+def result_from_dict(d):
+    """Returns the (localities, georefs) result of a dictionary made by result_to_dict, with
+    the feature geocodes of each locality put back from their own cache entries."""
+    localities = [Locality.from_dict(x) for x in d['localities']]
+    features = set()
+    for loc in localities:
+        features.update(geocoded_features(loc))
+    geocodes = {}
+    if features:
+        geocodes = Cache.get_many(['geocode-%s' % x for x in features])
+    for loc in localities:
+        loc.parts = dict(loc.parts, feature_geocodes=dict(
+                (x, geocodes['geocode-%s' % x]) for x in geocoded_features(loc) 
+                if geocodes.has_key('geocode-%s' % x)))
+    return (localities, [BoundingBox.create(*x) for x in d['georefs']])
+
+def _bbs_to_list(bbs):
+    return [[bb.get_w(), bb.get_n(), bb.get_e(), bb.get_s()] for bb in bbs or []]
 
 def loc_georefs(localities):
     """localities is a list of Locality."""
@@ -127,141 +457,395 @@ def loc_georefs(localities):
         georefs =  subloc_georefs(loc)
         # TODO: Decide what to do if any sublocality returns no georefs. For now, ignore that locality.
         # Minimally, if we do this, we have to change the interpreted locality.
-        if len(georefs) > 0:
+        if georefs:
             loc.georefs = georefs
             georef_lists.append(georefs)
     ''' Now we have a list of lists of georefs, and we need to find intersecting combos.'''
-    if len(georef_lists) == 0:
-        return []
-    results=georef_lists.pop()
-    while len(georef_lists) > 0:
-        next_georefs = georef_lists.pop()
-        for result in results:
-            new_results=[]
-            for next_georef in next_georefs:
-                new_result=result.intersection(next_georef)
-                if new_result is not None:
-                    new_results.append(new_result)
-        results = new_results
-    return results
-                
-
+    return BoundingBox.intersect_lists(georef_lists)
 
 def subloc_georefs(loc):
-    if not loc.parts.has_key('feature_geocodes'):
+    """Returns the list of georefs of a sub-locality calculated from the bounding boxes of 
+    the geocodes of its features by the calculator for its type, or None if there is no
+    calculator for the type or no geocodes."""
+    calculate = CALCULATORS.get((loc.type or '').lower())
+    if calculate is None:
         return None
-    geocodes = loc.parts['feature_geocodes']
-    if len(geocodes) == 0:
+    geocodes = loc.parts.get('feature_geocodes')
+    if not geocodes:
         return None
-    loctype = loc.type
-    georefs=[]
+    bbs = []
     for feature, geocode in geocodes.iteritems():
-        geocodes = GeocodeResultParser.get_feature_geoms(feature, geocode)
-        if geocodes is not None:
-            for g in geocodes:
-                if loctype == 'f':
-                    bb = GeometryParser.get_bb(g)
-                    georefs.append(bb)
-                elif loctype == 'foh':
-                    bb = GeometryParser.get_bb(g)
-                    offset = loc.parts['offset_value']
-                    offsetunit = loc.parts['offset_unit']
-                    heading = loc.parts['heading'] 
-                    new_bb = foh_error_bb(bb, offset, offsetunit, heading)
-                    georefs.append(new_bb)
-    return georefs
+        geoms = GeocodeResultParser.get_feature_geoms(feature, geocode)
+        if geoms is not None:
+            bbs.extend([GeometryParser.get_bb(g) for g in geoms])
+    if not bbs:
+        return []
+    return calculate(loc, bbs)
+
+def geocoded_features(loc):
+    """Returns the features of a parsed sub-locality to geocode, none if there is no georef 
+    calculator for its type."""
+    if not has_calculator(loc.type):
+        return []
+    return loc.parts.get('features', [])
+
+# ==============================================================================
+# Georef calculators
+
+"""CALCULATORS maps each locality type to the function that returns the georefs of a
+sub-locality of that type given the bounding boxes of the geocodes of its features."""
+CALCULATORS = {}
+
+def calculator(*loctypes):
+    """Registers the decorated function as the georef calculator for the given locality types."""
+    def register(calculate):
+        for loctype in loctypes:
+            CALCULATORS[loctype] = calculate
+        return calculate
+    return register
+
+def has_calculator(loctype):
+    return CALCULATORS.has_key((loctype or '').lower())
+
+@calculator('f')
+def calculate_feature(loc, bbs):
+    """Returns the bounding boxes of the feature of a Feature locality."""
+    return bbs
+
+@calculator('foh')
+def calculate_foh(loc, bbs):
+    """Returns the boxes containing the uncertainty of a Feature Offset Heading locality 
+    from each bounding box of its feature, all calculated in one foh_error_bbs call."""
+    offset = loc.parts['offset_value']
+    offsetunit = loc.parts['offset_unit']
+    heading = loc.parts['heading']
+    try:
+        import numpy
+    except ImportError:
+        # Skip an offset, unit or heading that is not valid, as foh_error_bbs does.
+        unit = get_unit(offsetunit) if offsetunit else None
+        bearing = get_heading(heading) if heading else None
+        if getDistancePrecision(offset) is None or unit is None or bearing is None:
+            return []
+        return [foh_error_bb(bb, offset, offsetunit, heading) for bb in bbs]
+    n = len(bbs)
+    errorbbs = foh_error_bbs(bbs, [offset] * n, [offsetunit] * n, [heading] * n)
+    # NaN edges mark an offset, unit or heading that is not valid.
+    return [bb for bb in errorbbs if bb.get_w() == bb.get_w()]
  
+# ==============================================================================
+# Locality parsers
+
+"""PARSERS maps each locality type to the function that parses localities of that type."""
+PARSERS = {}
+
+def parser(*loctypes):
+    """Registers the decorated function as the parser for the given locality types."""
+    def register(parse):
+        for loctype in loctypes:
+            PARSERS[loctype] = parse
+        return parse
+    return register
+
 def parse_loc(loc, loctype):
-   parts={}
-   status=''
-   if loctype.lower()=='f':
-       if len(loc)==0:
-           logging.info('No feature found in %s' % loc)
-           status='No feature'
-
-       # Try to construct a Feature from the remainder
-       features=[]
-       feature=loc.strip()
-       features.append(feature)
-       if len(status)==0:
-           status='complete'
-           interpreted_loc=feature
-       parts = {
-           'verbatim_loc': loc,
-           'locality_type': loctype,
-           'features': features,
-           'feature_geocodes': None,
-           'interpreted_loc': interpreted_loc,
-           'status': status
-           }                
-       
-   if loctype.lower()=='foh':
-       offsetval=None
-       offsetindex=0
-       offsetunit=None
-       offsetunitindex=0
-       heading=None
-       interpreted_loc=None
-       status=''
-       tokens = [x.strip() for x in loc.split()]
-       i=-1
-       rest=[]
-       for token in tokens:
-           i+=1
-           if offsetval is None and is_number(token):
-               # TODO: fails for tokens that are distances as words (five).
-               #       and tokens that consist of mixed numbers (5 1/2)
-               offsetval=token
-               offsetindex=i
-               continue
-           if offsetval is not None and offsetunit is None and get_unit(token):
-               # TODO: fails for tokens that consist of more than one word (nautical miles).
-               offsetunitinfo = get_unit(token)
-               offsetunit = offsetunitinfo.name
-               offsetunitindex=i
-               continue
-           if heading is None and offsetunitindex==i-1 and get_heading(token):
-               headinginfo = get_heading(token)
-               heading = headinginfo.name
-               continue
-           rest.append([i,token])
-
-       if offsetval is None:
-           logging.info('No offset found in %s' % loc)
-           status='%s, no offset' % status
-       if offsetunit is None:
-           logging.info('No distance unit found in %s' % loc)
-           status='%s, no units' % status
-       if heading is None:
-           logging.info('No heading found in %s' % loc)
-           status='%s, no heading' % status
-       if len(rest)==0:
-           logging.info('No feature found in %s' % loc)
-           status='%s, no feature' % status
-
-       # Try to construct a Feature from the remainder
-       features=[]
-       feature=''
-       for f in rest:
-           feature = ' %s %s' % (feature,f[1])
-       feature=feature.strip()
-       features.append(feature)
-       status=status.lstrip(', ')
-       if len(status)==0:
-           status='complete'
-           interpreted_loc='%s %s %s %s' % (offsetval, offsetunit, heading, feature)
-       parts = {
-           'verbatim_loc': loc,
-           'locality_type': loctype,
-           'offset_value': offsetval,
-           'offset_unit': offsetunit,
-           'heading': heading,
-           'features': features,
-           'feature_geocodes': None,
-           'interpreted_loc': interpreted_loc,
-           'status': status
-           }                
-   return parts
+    """Returns a dictionary of the parts of loc parsed according to its locality type,
+    or an empty dictionary if there is no parser for the type."""
+    parse = PARSERS.get(loctype.lower())
+    if parse is None:
+        TRACE.event('PARSE', 'no parser for locality type %s', loctype)
+        return {}
+    return parse(loc, loctype)
+
+"""Words introducing a junction, as in 'jct Hwy 78 and S-2'."""
+JUNCTION_WORDS = set(['jct', 'jct.', 'jcts', 'jcts.', 'junction', 'intersection', 'intersect'])
+
+"""Words introducing a path, as in '3 mi E Mecca on Cal 195'."""
+PATH_WORDS = set(['on', 'along', 'via'])
+
+"""Words introducing a pair of features, as in 'between Eureka and Arcata'."""
+BETWEEN_WORDS = set(['between', 'btwn', 'btwn.', 'betw', 'betw.'])
+
+"""Words qualifying a feature as nearby, as in 'vic. Pomona Fwy.'."""
+NEAR_WORDS = set(['near', 'nr', 'nr.', 'vic', 'vic.', 'vicinity', 'below', 'above', 'around', 'about'])
+
+"""Words separating the two features of a junction or a between locality."""
+AND_WORDS = set(['and', '&'])
+
+TRS = re.compile(r'^\s*T(?:OWNSHIP)?\.?\s*(\d+)\s*([NS])\.?,?\s*R(?:ANGE)?\.?\s*(\d+)\s*([EW])\.?,?'
+                 r'\s*(?:(?:SECTION|SECT|SEC|S)\.?\s*(\d+))?[\s,]*(.*?)\s*$', re.IGNORECASE)
+
+def _loc_parts(loc, loctype, features, missing, interpreted_loc, **kwargs):
+    """Returns the parts dictionary shared by all locality types. missing is the list of
+    the parts that could not be found."""
+    features = [x for x in features if x]
+    if len(features) == 0 and kwargs.pop('needs_feature', True):
+        missing = missing + ['no feature']
+    status = ', '.join(missing)
+    if len(status) == 0:
+        status = 'complete'
+    else:
+        interpreted_loc = None
+    parts = {
+        'verbatim_loc': loc,
+        'locality_type': loctype,
+        'features': features,
+        'feature_geocodes': None,
+        'interpreted_loc': interpreted_loc,
+        'status': status
+        }
+    parts.update(kwargs)
+    return parts
+
+def _split_on(tokens, words):
+    """Returns the tokens before and after the first token in words, dropping a following
+    'of', or (tokens, None) if there is none."""
+    for i, token in enumerate(tokens):
+        if token.lower() in words:
+            after = tokens[i+1:]
+            if after and after[0].lower() == 'of':
+                after = after[1:]
+            return (tokens[:i], after)
+    return (tokens, None)
+
+def _junction(tokens):
+    """Returns the two features of a junction, as in 'jct of Hwy 33 and Hwy 46'."""
+    before, after = _split_on(tokens, JUNCTION_WORDS)
+    if after is None:
+        after = before
+    elif len(before) > 0:
+        after = before + after
+    first, second = _split_on(after, AND_WORDS)
+    return [' '.join(first), ' '.join(second or [])]
+
+def _lex_heading(tokens):
+    """Returns (heading, before, after) for the first heading in tokens followed by one of
+    the lexer CONNECTIVES, as in 'San Gabriel wash south of Azusa', or for a heading at the 
+    start of tokens. heading is None if there is neither."""
+    for i in range(1, len(tokens)):
+        heading, h = HEADINGS.match(tokens, i)
+        if heading and i + h < len(tokens) and tokens[i+h].lower() in CONNECTIVES:
+            return (heading, tokens[:i], tokens[i+h+1:])
+    heading, h = HEADINGS.match(tokens, 0)
+    if heading:
+        after = tokens[h:]
+        if after and after[0].lower() in CONNECTIVES:
+            after = after[1:]
+        return (heading, [], after)
+    return (None, [], tokens)
+
+def _offset_missing(offset, unit, heading=True):
+    missing = []
+    if offset is None:
+        missing.append('no offset')
+    if unit is None:
+        missing.append('no units')
+    if heading is None:
+        missing.append('no heading')
+    return missing
+
+def _name(item):
+    if item is None:
+        return None
+    return item.name
+
+@parser('f')
+def parse_feature(loc, loctype):
+    """Parses a Feature locality, as in 'Berkeley'."""
+    feature = loc.strip()
+    return _loc_parts(loc, loctype, [feature], [], feature)
+
+@parser('foh')
+def parse_foh(loc, loctype):
+    """Parses a Feature Offset Heading locality, as in '5 mi N Berkeley'."""
+    offsetval, unit, heading, rest = lex_offset(loc)
+    feature = ' '.join(rest)
+    interpreted_loc = '%s %s %s %s' % (offsetval, _name(unit), _name(heading), feature)
+    return _loc_parts(loc, loctype, [feature], _offset_missing(offsetval, unit, heading), 
+                      interpreted_loc, offset_value=offsetval, offset_unit=_name(unit), 
+                      heading=_name(heading))
+
+@parser('fo')
+def parse_fo(loc, loctype):
+    """Parses a Feature Offset locality without a heading, as in '2 mi from Bradbury Dam'."""
+    offsetval, unit, heading, rest = lex_offset(loc)
+    rest = [x for x in rest if x.lower() not in CONNECTIVES]
+    feature = ' '.join(rest)
+    interpreted_loc = '%s %s %s' % (offsetval, _name(unit), feature)
+    return _loc_parts(loc, loctype, [feature], _offset_missing(offsetval, unit), 
+                      interpreted_loc, offset_value=offsetval, offset_unit=_name(unit), 
+                      heading=_name(heading))
+
+@parser('foo')
+def parse_foo(loc, loctype):
+    """Parses a Feature with Orthogonal Offsets locality, as in '1 mi S 2 mi W Long Beach'."""
+    offsets, rest = lex_offsets(loc)
+    feature = ' '.join(rest)
+    missing = []
+    if len(offsets) < 2:
+        missing.append('no orthogonal offsets')
+    offsets = [dict(offset_value=o, offset_unit=u.name, heading=h.name) for o, u, h in offsets]
+    interpreted_loc = '%s %s' % (' '.join(
+            ['%(offset_value)s %(offset_unit)s %(heading)s' % x for x in offsets]), feature)
+    return _loc_parts(loc, loctype, [feature], missing, interpreted_loc, offsets=offsets)
+
+@parser('fpoh')
+def parse_fpoh(loc, loctype):
+    """Parses a Feature Path Offset Heading locality, as in '3 mi E Mecca on Cal 195'."""
+    offsetval, unit, heading, rest = lex_offset(loc)
+    feature, path = _split_on(rest, PATH_WORDS)
+    feature = ' '.join(feature)
+    path = ' '.join(path or [])
+    missing = _offset_missing(offsetval, unit, heading)
+    if not path:
+        missing.append('no path')
+    interpreted_loc = '%s %s %s %s on %s' % (offsetval, _name(unit), _name(heading), feature, path)
+    return _loc_parts(loc, loctype, [feature], missing, interpreted_loc, 
+                      offset_value=offsetval, offset_unit=_name(unit), 
+                      heading=_name(heading), path=path)
+
+@parser('fs', 'fph')
+def parse_fph(loc, loctype):
+    """Parses a Feature Heading locality, optionally along a path, as in 'S of Horse Camp'
+    or 'San Gabriel wash south of Azusa'."""
+    heading, path, rest = _lex_heading(loc.split())
+    path = [x for x in path if x.lower() not in PATH_WORDS and x.lower() != 'just']
+    feature = ' '.join(rest)
+    missing = _offset_missing(True, True, heading)
+    interpreted_loc = '%s %s' % (_name(heading), feature)
+    return _loc_parts(loc, loctype, [feature], missing, interpreted_loc, 
+                      heading=_name(heading), path=' '.join(path))
+
+@parser('nf', 'npom')
+def parse_near_feature(loc, loctype):
+    """Parses a Near Feature locality, as in 'near Wiley Wells'."""
+    tokens = loc.split()
+    qualifier = []
+    while tokens and tokens[0].lower() in NEAR_WORDS | set(['of']):
+        qualifier.append(tokens.pop(0))
+    if tokens and tokens[-1].lower() == 'area':
+        qualifier.append(tokens.pop())
+    feature = ' '.join(tokens)
+    return _loc_parts(loc, loctype, [feature], [], 'near %s' % feature, 
+                      qualifier=' '.join(qualifier))
+
+@parser('bf', 'pbf')
+def parse_between(loc, loctype):
+    """Parses a Between Features locality, optionally along a path, as in 
+    'between Eureka and Arcata' or 'Highway 101 between Eureka and Arcata'."""
+    path, between = _split_on(loc.split(), BETWEEN_WORDS)
+    missing = []
+    if between is None:
+        between, path = path, []
+        missing.append('no between')
+    first, second = _split_on(between, AND_WORDS)
+    features = [' '.join(first), ' '.join(second or [])]
+    path = ' '.join([x for x in path if x.lower() not in PATH_WORDS])
+    interpreted_loc = 'between %s and %s' % tuple(features)
+    return _loc_parts(loc, loctype, features, missing, interpreted_loc, path=path)
+
+@parser('j', 'nj')
+def parse_junction(loc, loctype):
+    """Parses a Junction locality, as in 'jct Hwy 58 and US Hwy 101'."""
+    tokens = loc.split()
+    qualifier = []
+    while tokens and tokens[0].lower() in NEAR_WORDS | set(['of']):
+        qualifier.append(tokens.pop(0))
+    features = _junction(tokens)
+    return _loc_parts(loc, loctype, features, [], 'jct %s and %s' % tuple(features), 
+                      qualifier=' '.join(qualifier))
+
+@parser('jh')
+def parse_jh(loc, loctype):
+    """Parses a Junction Heading locality, as in 'W jct Arburua and Langdon Rds'."""
+    heading, path, rest = _lex_heading(loc.split())
+    features = _junction(path + rest)
+    interpreted_loc = '%s jct %s and %s' % ((_name(heading),) + tuple(features))
+    return _loc_parts(loc, loctype, features, _offset_missing(True, True, heading), 
+                      interpreted_loc, heading=_name(heading))
+
+@parser('joh', 'jo', 'jpoh')
+def parse_joh(loc, loctype):
+    """Parses a Junction Offset locality, with an optional heading and path, as in 
+    '7 mi N jct Hwy 78 and S-2' or '1/2 mi SE jct Dillon Rd and Indian Ave on Dillon Rd'."""
+    offsetval, unit, heading, rest = lex_offset(loc)
+    junction, path = _split_on(rest, PATH_WORDS)
+    features = _junction(junction)
+    path = ' '.join(path or [])
+    missing = _offset_missing(offsetval, unit)
+    if loctype.lower() != 'jo':
+        missing += _offset_missing(True, True, heading)
+    interpreted_loc = '%s %s %s jct %s and %s' % ((offsetval, _name(unit), _name(heading)) + tuple(features))
+    return _loc_parts(loc, loctype, features, missing, interpreted_loc, 
+                      offset_value=offsetval, offset_unit=_name(unit), 
+                      heading=_name(heading), path=path)
+
+@parser('joo')
+def parse_joo(loc, loctype):
+    """Parses a Junction with Orthogonal Offsets locality, as in '0.5 mi N 1 mi E jct 
+    Beverly and Painter'."""
+    offsets, rest = lex_offsets(loc)
+    features = _junction(rest)
+    missing = []
+    if len(offsets) < 2:
+        missing.append('no orthogonal offsets')
+    offsets = [dict(offset_value=o, offset_unit=u.name, heading=h.name) for o, u, h in offsets]
+    interpreted_loc = '%s jct %s and %s' % ((' '.join(
+            ['%(offset_value)s %(offset_unit)s %(heading)s' % x for x in offsets]),) + tuple(features))
+    return _loc_parts(loc, loctype, features, missing, interpreted_loc, offsets=offsets)
+
+@parser('trs', 'trss')
+def parse_trs(loc, loctype):
+    """Parses a Township Range Section locality, with an optional subsection, as in 
+    'T 17 S R 9 E S 36 NW 1/4'."""
+    trs = TRS.match(loc)
+    if not trs:
+        return _loc_parts(loc, loctype, [], ['no township', 'no range'], None, needs_feature=False)
+    township, ns, rng, ew, section, subsection = trs.groups()
+    subsection = subsection.strip('()').strip()
+    missing = []
+    if section is None:
+        missing.append('no section')
+    if loctype.lower() == 'trss' and not subsection:
+        missing.append('no subsection')
+    interpreted_loc = 'T%s%s R%s%s S%s %s' % (township, ns.upper(), rng, ew.upper(), section, subsection)
+    return _loc_parts(loc, loctype, [], missing, interpreted_loc.strip(), needs_feature=False,
+                      township='%s %s' % (township, ns.upper()), range='%s %s' % (rng, ew.upper()), 
+                      section=section, subsection=subsection or None)
+
+@parser('e')
+def parse_elevation(loc, loctype):
+    """Parses an Elevation locality, as in 'elev 9350 ft'."""
+    offsetval, unit, heading, rest = lex_offset(loc)
+    interpreted_loc = 'elev %s %s' % (offsetval, _name(unit))
+    missing = []
+    if offsetval is None:
+        missing.append('no elevation')
+    if unit is None:
+        missing.append('no units')
+    return _loc_parts(loc, loctype, [], missing, interpreted_loc, needs_feature=False,
+                      elevation=offsetval, elevation_unit=_name(unit))
+
+@parser('pom')
+def parse_pom(loc, loctype):
+    """Parses a Path Odometer Marker locality, as in 'mi 9.5 S 22'."""
+    tokens = tokenize(loc)
+    marker = None
+    for i in range(len(tokens) - 1):
+        if UNITS.get(tokens[i]) and match_number(tokens, i + 1)[0] is not None:
+            marker, n = match_number(tokens, i + 1)
+            tokens = tokens[:i] + tokens[i+1+n:]
+            break
+    path = ' '.join(tokens)
+    missing = []
+    if marker is None:
+        missing.append('no marker')
+    return _loc_parts(loc, loctype, [path], missing, '%s mi %s' % (path, marker), 
+                      marker=marker, path=path)
+
+@parser('nn')
+def parse_no_locality(loc, loctype):
+    """Parses a locality with no usable information, as in 'Unknown'."""
+    return _loc_parts(loc, loctype, [], ['no locality'], None, needs_feature=False)
 
 def has_num(token):
     i=0
@@ -412,21 +996,11 @@ class Georeference(object):
 
 def get_unit(unitstr):
     """Returns a DistanceUnit from a string."""
-    u = unitstr.replace('.', '').strip().lower()
-    for unit in DistanceUnits.all():
-        for form in unit.forms:
-            if u == form:
-                return unit
-    return None
+    return UNITS.get(unitstr)
 
 def get_heading(headingstr):
     """Returns a Heading from a string."""
-    h = headingstr.replace('-', '').replace(',', '').strip().lower()
-    for heading in Headings.all():
-        for form in heading.forms:
-            if h == form:
-                return heading
-    return None
+    return HEADINGS.get(headingstr)
 
 #def georef_feature(geocode):
 #    """Returns a Georeference from the Geomancer API.
@@ -483,6 +1057,67 @@ def foh_error_bb(bb, offset, offsetunit, heading):
     newbb = bb_from_pr(newpoint,error)
     return newbb
 
+def foh_error_bbs(bbs, offsets, offsetunits, headings):
+    """Returns a BoundingBoxArray of the boxes foh_error_bb returns for each of bbs, a list
+    of BoundingBoxes or a BoundingBoxArray, with the offset, offset unit and heading strings
+    at the same index of offsets, offsetunits and headings. The edges are NaN where the 
+    offset, unit or heading is not valid. Requires NumPy."""
+    import vgeo
+    from bbarray import BoundingBoxArray
+    if not isinstance(bbs, BoundingBoxArray):
+        bbs = BoundingBoxArray.from_bbs(bbs)
+    offsetinmeters, dpm, bearing, headingerror = _foh_columns(offsets, offsetunits, headings)
+    centers = bbs.center()
+    error = _direction_errors(bbs.calc_radius() + dpm, offsetinmeters, headingerror)
+    lng, lat = vgeo.point_from_distance_at_bearing(centers.lng, centers.lat, offsetinmeters, bearing)
+    return BoundingBoxArray(*vgeo.bbs_from_pr(lng, lat, error))
+
+def foh_errors(extents, offsets, offsetunits, headings):
+    """Returns a NumPy array of the foh_error for each of extents, in meters, with the
+    offset, offset unit and heading strings at the same index of offsets, offsetunits and
+    headings. The error is NaN where the offset, unit or heading is not valid. Requires NumPy.
+    
+    Each distinct combination of offset, unit and heading is only interpreted once, so
+    whole columns of a dataset can be scored at a time."""
+    import numpy as np
+    offsetinmeters, dpm, bearing, headingerror = _foh_columns(offsets, offsetunits, headings)
+    extents = np.asarray(extents, dtype=np.float64).reshape(-1)
+    return _direction_errors(extents + dpm, offsetinmeters, headingerror)
+
+def _foh_columns(offsets, offsetunits, headings):
+    """Returns the NumPy arrays (offset in meters, distance precision in meters, bearing, 
+    heading error) for the offset, offset unit and heading strings, with NaN in the rows 
+    where any of them is not valid."""
+    import numpy as np
+    nan = float('nan')
+    invalid = (nan, nan, nan, nan)
+    columns = {}
+    rows = []
+    for key in zip(offsets, offsetunits, headings):
+        row = columns.get(key)
+        if row is None:
+            offset, unit, heading = key
+            precision = getDistancePrecision(offset)
+            unit = get_unit(unit) if unit else None
+            heading = get_heading(heading) if heading else None
+            if precision is None or unit is None or heading is None:
+                row = invalid
+            else:
+                tometers = float(unit.tometers)
+                row = (float(offset) * tometers, precision * tometers, 
+                       float(heading.bearing), float(heading.error))
+            columns[key] = row
+        rows.append(row)
+    return np.array(rows, dtype=np.float64).reshape(-1, 4).T
+
+def _direction_errors(starterror, offset, headingerror):
+    """Returns getDirectionError over NumPy arrays, with headingerror in degrees."""
+    import numpy as np
+    angle = np.radians(headingerror)
+    x = offset * np.cos(angle)
+    y = offset * np.sin(angle)
+    return np.sqrt((offset + starterror - x) ** 2 + y ** 2)
+
 def foh_error(point, extent, offsetstr, offsetunits, headingstr):
     """Returns the radius in meters from a Point containing all of the uncertainties
     for a Locality of type Feature Offset Heading.
@@ -533,6 +1168,11 @@ def getDirectionError(starterror, offset, headingstr):
     neterror = math.sqrt(math.pow(xp - x, 2) + math.pow(y, 2))
     return neterror
 
+"""DISTANCE_PRECISIONS memoizes getDistancePrecision by distance string. It is cleared
+when it holds MAX_DISTANCE_PRECISIONS strings."""
+DISTANCE_PRECISIONS = {}
+MAX_DISTANCE_PRECISIONS = 10000
+
 def getDistancePrecision(distance):
     """Returns the precision of the string representation of the distance as a value in the same units.
     
@@ -546,6 +1186,16 @@ def getDistancePrecision(distance):
     which we now believe to be unreasonably conservative."""
     if type(distance) != str and type(distance) != unicode:
         return None
+    try:
+        return DISTANCE_PRECISIONS[distance]
+    except KeyError:
+        pass
+    if len(DISTANCE_PRECISIONS) >= MAX_DISTANCE_PRECISIONS:
+        DISTANCE_PRECISIONS.clear()
+    precision = DISTANCE_PRECISIONS[distance] = _distance_precision(distance)
+    return precision
+
+def _distance_precision(distance):
     try:
         float(distance)
     except:
@@ -21,10 +21,15 @@ __contributors__ = ["John Wieczorek (gtuco.btuco@gmail.com)"]
 # Standard Python modules
 import simplejson
 import urllib
+import urllib2
 
 class GoogleGeocodingApi(object):
     @classmethod
-    def geocode(cls, address):
+    def geocode(cls, address, timeout=None):
+        """Returns the Geocoding API JSON response for an address, raising an IOError
+        if the request takes longer than timeout seconds."""
         params = urllib.urlencode(dict(address=address, sensor='true'))
         url = 'http://maps.googleapis.com/maps/api/geocode/json?%s' % params
-        return simplejson.loads(urllib.urlopen(url).read())
+        if timeout is None:
+            return simplejson.loads(urllib.urlopen(url).read())
+        return simplejson.loads(urllib2.urlopen(url, timeout=timeout).read())
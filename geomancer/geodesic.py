@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+# Copyright 2011 University of California at Berkeley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "Aaron Steele and John Wieczorek"
+
+"""This module provides distances and destinations on the ellipsoid of a Datum.
+
+The inverse (distance and bearings between two points) and direct (destination from a
+point, distance and bearing) problems are solved with Vincenty's formulae, which are
+accurate to within a millimeter on the ellipsoid. Nearly antipodal points, for which the
+inverse formula does not converge, fall back to the great circle on a sphere of the mean
+radius of the ellipsoid.
+
+Reference: Vincenty, T. 1975. Direct and Inverse Solutions of Geodesics on the Ellipsoid
+with Application of Nested Equations. Survey Review 23(176):88-93.
+http://www.ngs.noaa.gov/PUBS_LIB/inverse.pdf"""
+
+import math
+from constants import Datums
+
+"""MAX_ITERATIONS is the most iterations of the inverse and direct formulae."""
+MAX_ITERATIONS = 200
+
+"""CONVERGENCE is the change in radians below which the iterations stop, about 0.006 mm."""
+CONVERGENCE = 1e-12
+
+class Ellipsoid(object):
+    """The constants of an ellipsoid derived from its semi-major axis and inverse flattening."""
+    __slots__ = ('axis', 'flattening', 'f', 'b', 'ep2', 'mean_radius')
+
+    def __init__(self, axis, flattening):
+        """Arguments:
+            axis - the semi-major axis in meters
+            flattening - the inverse flattening, as in the Datum tables"""
+        self.axis = axis
+        self.flattening = flattening
+        self.f = 1.0 / flattening
+        self.b = axis * (1 - self.f)
+        # ep2 is the square of the second eccentricity.
+        self.ep2 = (axis * axis - self.b * self.b) / (self.b * self.b)
+        self.mean_radius = (2 * axis + self.b) / 3.0
+
+"""ELLIPSOIDS caches an Ellipsoid per (axis, flattening) so each is only derived once."""
+ELLIPSOIDS = {}
+
+def get_ellipsoid(datum=None):
+    """Returns the Ellipsoid of a Datum, WGS84 if datum is None."""
+    if datum is None:
+        datum = Datums.WGS84
+    key = (datum.axis, datum.flattening)
+    ellipsoid = ELLIPSOIDS.get(key)
+    if ellipsoid is None:
+        if datum.axis <= 0 or datum.flattening <= 0:
+            raise ValueError('Datum %s has no ellipsoid parameters' % datum.code)
+        ellipsoid = ELLIPSOIDS[key] = Ellipsoid(datum.axis, datum.flattening)
+    return ellipsoid
+
+def _bearing(radians):
+    return math.degrees(radians) % 360
+
+def delta_sigma(B, sin_sigma, cos_sigma, cos_2sigma_m):
+    """Returns Vincenty's delta sigma. The arguments may be floats or NumPy arrays."""
+    c2 = cos_2sigma_m * cos_2sigma_m
+    return B * sin_sigma * (cos_2sigma_m + B / 4 * (cos_sigma * (-1 + 2 * c2) -
+        B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma * sin_sigma) * (-3 + 4 * c2)))
+
+def series(u2):
+    """Returns Vincenty's A and B for u2, the square of the reduced second eccentricity.
+    u2 may be a float or a NumPy array."""
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    return (A, B)
+
+def inverse(lng0, lat0, lng1, lat1, datum=None):
+    """Returns (distance, bearing0, bearing1) for the geodesic from lng0, lat0 to lng1, lat1
+    in degrees on the ellipsoid of datum (WGS84 if None), where distance is in meters and
+    bearing0 and bearing1 are the initial and final bearings in degrees from North."""
+    el = get_ellipsoid(datum)
+    f = el.f
+    L = math.radians(lng1 - lng0)
+    U1 = math.atan((1 - f) * math.tan(math.radians(lat0)))
+    U2 = math.atan((1 - f) * math.tan(math.radians(lat1)))
+    sinU1, cosU1 = math.sin(U1), math.cos(U1)
+    sinU2, cosU2 = math.sin(U2), math.cos(U2)
+    lam = L
+    for i in range(MAX_ITERATIONS):
+        sin_lam, cos_lam = math.sin(lam), math.cos(lam)
+        sin_sigma = math.hypot(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)
+        if sin_sigma == 0:
+            # The points coincide.
+            return (0.0, 0.0, 0.0)
+        cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+        sigma = math.atan2(sin_sigma, cos_sigma)
+        sin_alpha = cosU1 * cosU2 * sin_lam / sin_sigma
+        cos2_alpha = 1 - sin_alpha * sin_alpha
+        cos_2sigma_m = 0.0
+        if cos2_alpha != 0:
+            # Points on the equator have cos2_alpha 0.
+            cos_2sigma_m = cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha
+        C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        last = lam
+        lam = L + (1 - C) * f * sin_alpha * (sigma + C * sin_sigma *
+            (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m * cos_2sigma_m)))
+        if math.fabs(lam - last) < CONVERGENCE:
+            break
+    else:
+        return _spherical_inverse(lng0, lat0, lng1, lat1, el.mean_radius)
+    A, B = series(cos2_alpha * el.ep2)
+    distance = el.b * A * (sigma - delta_sigma(B, sin_sigma, cos_sigma, cos_2sigma_m))
+    bearing0 = math.atan2(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)
+    bearing1 = math.atan2(cosU1 * sin_lam, -sinU1 * cosU2 + cosU1 * sinU2 * cos_lam)
+    return (distance, _bearing(bearing0), _bearing(bearing1))
+
+def _spherical_inverse(lng0, lat0, lng1, lat1, radius):
+    lat0, lat1 = math.radians(lat0), math.radians(lat1)
+    dlng = math.radians(lng1 - lng0)
+    a = math.sin((lat1 - lat0) / 2) ** 2 + math.cos(lat0) * math.cos(lat1) * math.sin(dlng / 2) ** 2
+    distance = 2 * radius * math.atan2(math.sqrt(a), math.sqrt(max(0.0, 1 - a)))
+    bearing0 = math.atan2(math.sin(dlng) * math.cos(lat1),
+        math.cos(lat0) * math.sin(lat1) - math.sin(lat0) * math.cos(lat1) * math.cos(dlng))
+    bearing1 = math.atan2(math.sin(dlng) * math.cos(lat0),
+        -math.cos(lat1) * math.sin(lat0) + math.sin(lat1) * math.cos(lat0) * math.cos(dlng))
+    return (distance, _bearing(bearing0), _bearing(bearing1))
+
+def direct(lng, lat, distance, bearing, datum=None):
+    """Returns (lng, lat, bearing) in degrees of the destination of the geodesic that starts
+    at lng, lat in degrees and goes distance meters at bearing degrees from North on the
+    ellipsoid of datum (WGS84 if None), where bearing is the final bearing."""
+    el = get_ellipsoid(datum)
+    f = el.f
+    alpha1 = math.radians(bearing)
+    sin_alpha1, cos_alpha1 = math.sin(alpha1), math.cos(alpha1)
+    tanU1 = (1 - f) * math.tan(math.radians(lat))
+    cosU1 = 1 / math.sqrt(1 + tanU1 * tanU1)
+    sinU1 = tanU1 * cosU1
+    sigma1 = math.atan2(tanU1, cos_alpha1)
+    sin_alpha = cosU1 * sin_alpha1
+    cos2_alpha = 1 - sin_alpha * sin_alpha
+    A, B = series(cos2_alpha * el.ep2)
+    sigma = distance / (el.b * A)
+    for i in range(MAX_ITERATIONS):
+        cos_2sigma_m = math.cos(2 * sigma1 + sigma)
+        sin_sigma, cos_sigma = math.sin(sigma), math.cos(sigma)
+        last = sigma
+        sigma = distance / (el.b * A) + delta_sigma(B, sin_sigma, cos_sigma, cos_2sigma_m)
+        if math.fabs(sigma - last) < CONVERGENCE:
+            break
+    cos_2sigma_m = math.cos(2 * sigma1 + sigma)
+    sin_sigma, cos_sigma = math.sin(sigma), math.cos(sigma)
+    tmp = sinU1 * sin_sigma - cosU1 * cos_sigma * cos_alpha1
+    lat2 = math.atan2(sinU1 * cos_sigma + cosU1 * sin_sigma * cos_alpha1,
+                      (1 - f) * math.hypot(sin_alpha, tmp))
+    lam = math.atan2(sin_sigma * sin_alpha1, cosU1 * cos_sigma - sinU1 * sin_sigma * cos_alpha1)
+    C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+    L = lam - (1 - C) * f * sin_alpha * (sigma + C * sin_sigma *
+        (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m * cos_2sigma_m)))
+    lng2 = (lng + math.degrees(L) + 540) % 360 - 180
+    return (lng2, math.degrees(lat2), _bearing(math.atan2(sin_alpha, -tmp)))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+# Copyright 2011 University of California at Berkeley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "Aaron Steele and John Wieczorek"
+
+"""This module provides geohashes of coordinates and geohash cover sets of bounding boxes.
+
+A geohash of n characters names a cell of a grid over longitude and latitude, and the
+geohash of every cell inside it starts with those n characters, so geohashes can be
+compared by prefix to find nearby coordinates. Each character holds 5 bits, alternately
+bits of the longitude and of the latitude, starting with the longitude.
+
+Reference: http://en.wikipedia.org/wiki/Geohash"""
+
+import math
+
+"""BASE32 is the geohash alphabet, the character for each 5 bit value."""
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+DECODE = dict((c, i) for i, c in enumerate(BASE32))
+
+"""MAX_PRECISION is the most characters in a geohash, 30 bits each of lng and lat."""
+MAX_PRECISION = 12
+
+"""PRECISION is the default number of characters in a geohash, cells of about 5 m."""
+PRECISION = 9
+
+"""MAX_CELLS is the default largest number of cells in a cover set."""
+MAX_CELLS = 32
+
+def bits(precision):
+    """Returns the number of (lng, lat) bits in a geohash of precision characters."""
+    if precision < 1 or precision > MAX_PRECISION:
+        raise ValueError('Geohash precision must be from 1 to %s' % MAX_PRECISION)
+    return ((5 * precision + 1) / 2, 5 * precision / 2)
+
+def cell_size(precision):
+    """Returns (width, height) in degrees of the cells of geohashes of precision characters."""
+    lng_bits, lat_bits = bits(precision)
+    return (360.0 / (1 << lng_bits), 180.0 / (1 << lat_bits))
+
+def _index(x, lower, size, n):
+    """Returns the index of the cell of size degrees holding x in the n cells from lower."""
+    return max(0, min(n - 1, int(math.floor((x - lower) / size))))
+
+def from_indexes(i, j, precision):
+    """Returns the geohash of the cell in column i and row j, counted from -180 and -90, of
+    the grid of geohashes of precision characters."""
+    lng_bits, lat_bits = bits(precision)
+    chars = []
+    value = 0
+    n = 0
+    # Interleave the bits from the most significant, starting with the longitude.
+    for k in range(5 * precision):
+        if k % 2 == 0:
+            lng_bits -= 1
+            value = (value << 1) | ((i >> lng_bits) & 1)
+        else:
+            lat_bits -= 1
+            value = (value << 1) | ((j >> lat_bits) & 1)
+        n += 1
+        if n == 5:
+            chars.append(BASE32[value])
+            value = n = 0
+    return ''.join(chars)
+
+def to_indexes(geohash):
+    """Returns (i, j, precision) of a geohash, where i and j are its column and row in the
+    grid of geohashes of the same precision."""
+    precision = len(geohash)
+    bits(precision)
+    i = j = 0
+    k = 0
+    for c in geohash.lower():
+        value = DECODE.get(c)
+        if value is None:
+            raise ValueError('Not a geohash: %r' % geohash)
+        for shift in (4, 3, 2, 1, 0):
+            bit = (value >> shift) & 1
+            if k % 2 == 0:
+                i = (i << 1) | bit
+            else:
+                j = (j << 1) | bit
+            k += 1
+    return (i, j, precision)
+
+def encode(lng, lat, precision=PRECISION):
+    """Returns the geohash of precision characters of the cell holding lng, lat in degrees."""
+    width, height = cell_size(precision)
+    lng_bits, lat_bits = bits(precision)
+    i = _index(lng, -180, width, 1 << lng_bits)
+    j = _index(lat, -90, height, 1 << lat_bits)
+    return from_indexes(i, j, precision)
+
+def decode_bb(geohash):
+    """Returns (w, n, e, s), the edges in degrees of the cell of a geohash."""
+    i, j, precision = to_indexes(geohash)
+    width, height = cell_size(precision)
+    w = -180 + i * width
+    s = -90 + j * height
+    return (w, s + height, w + width, s)
+
+def decode(geohash):
+    """Returns (lng, lat), the center in degrees of the cell of a geohash."""
+    w, n, e, s = decode_bb(geohash)
+    return ((w + e) / 2, (n + s) / 2)
+
+def _lng_intervals(w, e):
+    """Returns the (w, e) longitude intervals with w <= e from w eastward to e, split at the
+    antimeridian. The same w and e mean a single meridian; only an e at least 360 degrees
+    east of w, as in -180 and 180, means the whole circle."""
+    if e - w >= 360:
+        return [(-180.0, 180.0)]
+    w = _lng180(w)
+    e = _lng180(e)
+    if w <= e:
+        return [(w, e)]
+    return [(w, 180.0), (-180.0, e)]
+
+def _lng180(lng):
+    lng = math.fmod(lng, 360)
+    if lng <= -180:
+        return lng + 360
+    if lng > 180:
+        return lng - 360
+    return lng
+
+def _cover_ranges(w, n, e, s, precision):
+    """Returns the ([(i0, i1), ...], (j0, j1)) inclusive column and row ranges of the cells of
+    precision characters that cover the box."""
+    width, height = cell_size(precision)
+    lng_bits, lat_bits = bits(precision)
+    columns = [(_index(west, -180, width, 1 << lng_bits), _index(east, -180, width, 1 << lng_bits))
+               for west, east in _lng_intervals(w, e)]
+    if len(columns) == 2 and columns[1][1] >= columns[0][0]:
+        # The box crosses the antimeridian and its east edge is in the column of its west
+        # edge, so it covers every column.
+        columns = [(0, (1 << lng_bits) - 1)]
+    rows = (_index(min(n, s), -90, height, 1 << lat_bits),
+            _index(max(n, s), -90, height, 1 << lat_bits))
+    return (columns, rows)
+
+def cover_count(w, n, e, s, precision):
+    """Returns the number of cells of precision characters in the cover set of the box."""
+    columns, rows = _cover_ranges(w, n, e, s, precision)
+    return sum(i1 - i0 + 1 for i0, i1 in columns) * (rows[1] - rows[0] + 1)
+
+def cover_precision(w, n, e, s, max_cells=MAX_CELLS):
+    """Returns the most characters of geohashes that cover the box in at most max_cells
+    cells, at least 1."""
+    precision = 1
+    while (precision < MAX_PRECISION and
+           cover_count(w, n, e, s, precision + 1) <= max_cells):
+        precision += 1
+    return precision
+
+def cover(w, n, e, s, precision=None, max_cells=MAX_CELLS):
+    """Returns the sorted list of the geohashes of the cells that together cover the box
+    with edges w, n, e, s in degrees, going east from w to e across the antimeridian if
+    w is east of e. A box with the same w and e is one column wide; give w=-180 and e=180
+    for a box around the whole circle.
+
+    Arguments:
+        precision - the characters in each geohash, or None for the most characters that
+                    cover the box in at most max_cells cells"""
+    if precision is None:
+        precision = cover_precision(w, n, e, s, max_cells)
+    columns, rows = _cover_ranges(w, n, e, s, precision)
+    geohashes = []
+    for i0, i1 in columns:
+        for i in range(i0, i1 + 1):
+            for j in range(rows[0], rows[1] + 1):
+                geohashes.append(from_indexes(i, j, precision))
+    geohashes.sort()
+    return geohashes
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+# Copyright 2011 The Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "John Wieczorek (gtuco.btuco@gmail.com)"
+__copyright__ = "Copyright 2011 The Regents of the University of California"
+__contributors__ = ["Aaron Steele (eightysteele@gmail.com)"]
+
+"""This module provides a lexer for the offsets, distance units and headings in localities."""
+
+import re
+
+from constants import DistanceUnits
+from constants import Headings
+from point import truncate
+
+"""Words dropped between the heading and the feature, as in '5 mi N of Berkeley'."""
+CONNECTIVES = set(['of', 'from', 'up', 'to'])
+
+NUMBER = re.compile(r'^(\d+(\.\d*)?|\.\d+)$')
+FRACTION = re.compile(r'^(\d+)/(\d+)$')
+GLUED = re.compile(r'^(\d+(?:\.\d+)?)([^\d./-].*)$')
+
+class FormTable(object):
+    """Hashed table of the written forms of DistanceUnits or Headings, including forms of
+    more than one word such as 'nautical miles' and 'east by north'."""
+
+    def __init__(self, items, normalize):
+        self.normalize = normalize
+        self.forms = {}
+        self.max_words = 1
+        for item in items:
+            for form in item.forms:
+                key = normalize(form)
+                if not key:
+                    continue
+                self.forms.setdefault(key, item)
+                self.max_words = max(self.max_words, len(form.split()))
+
+    def get(self, s):
+        """Returns the item with a form matching the string s, or None."""
+        return self.forms.get(self.normalize(s))
+
+    def match(self, tokens, i):
+        """Returns (item, n) for the longest form made of the n tokens starting at tokens[i],
+        or (None, 0) if no form starts there."""
+        for n in range(min(self.max_words, len(tokens) - i), 0, -1):
+            item = self.get(' '.join(tokens[i:i+n]))
+            if item:
+                return (item, n)
+        return (None, 0)
+
+def _normalize_unit(s):
+    return s.replace('.', '').strip().lower()
+
+def _normalize_heading(s):
+    return s.replace('-', '').replace(',', '').strip().lower()
+
+UNITS = FormTable(DistanceUnits.all(), _normalize_unit)
+HEADINGS = FormTable(Headings.all(), _normalize_heading)
+
+def tokenize(loc):
+    """Returns the white space separated tokens of loc with numbers glued to distance units,
+    as in '6km', split in two."""
+    tokens = []
+    for token in loc.split():
+        glued = GLUED.match(token)
+        if glued and UNITS.get(glued.group(2)):
+            tokens.extend(glued.groups())
+        else:
+            tokens.append(token)
+    return tokens
+
+def match_number(tokens, i):
+    """Returns (value, n) for the number made of the n tokens starting at tokens[i], or
+    (None, 0). Fractions and mixed numbers such as '5 1/2' are returned as decimals."""
+    token = tokens[i]
+    if NUMBER.match(token):
+        if i + 1 < len(tokens):
+            fraction = _fraction(tokens[i+1])
+            if fraction is not None:
+                return (truncate(float(token) + fraction, 4), 2)
+        return (token, 1)
+    fraction = _fraction(token)
+    if fraction is not None:
+        return (truncate(fraction, 4), 1)
+    return (None, 0)
+
+def _fraction(token):
+    fraction = FRACTION.match(token)
+    if not fraction or float(fraction.group(2)) == 0:
+        return None
+    return float(fraction.group(1)) / float(fraction.group(2))
+
+def lex_offset(loc):
+    """Returns (offset, unit, heading, rest) for the offset of a locality such as
+    '5 mi N of Berkeley', where offset is the distance as a string, unit is a DistanceUnit,
+    heading is a Heading and rest is the list of the remaining tokens. Parts that are not
+    found are None.
+
+    The tokens are scanned once. A number is only taken as the offset if it is followed by
+    a distance unit and a heading, so that the first complete offset wins over numbers that
+    are part of the feature name, as in '6 Mile Creek 7 mi W'. Failing that, the first number
+    followed by a unit, then the first number, is used."""
+    tokens = tokenize(loc)
+    best = None
+    for i in range(len(tokens)):
+        offset, n = match_number(tokens, i)
+        if offset is None:
+            continue
+        unit, u = UNITS.match(tokens, i + n)
+        heading, h = (None, 0)
+        if unit:
+            heading, h = HEADINGS.match(tokens, i + n + u)
+        found = (len([x for x in (unit, heading) if x]), offset, unit, heading, i, i + n + u + h)
+        if best is None or found[0] > best[0]:
+            best = found
+        if heading:
+            break
+    if best is None:
+        return (None, None, None, tokens)
+    score, offset, unit, heading, start, end = best
+    if heading and end < len(tokens) and tokens[end].lower() in CONNECTIVES:
+        end += 1
+    return (offset, unit, heading, tokens[:start] + tokens[end:])
+
+def lex_offsets(loc):
+    """Returns (offsets, rest) for a locality with more than one offset, such as 
+    '1 mi S and 2 mi W of Long Beach', where offsets is the list of complete 
+    (offset, unit, heading) tuples in the order found and rest is the list of the 
+    remaining tokens."""
+    tokens = tokenize(loc)
+    offsets = []
+    rest = []
+    i = 0
+    while i < len(tokens):
+        offset, n = match_number(tokens, i)
+        unit, u = (None, 0)
+        heading, h = (None, 0)
+        if offset is not None:
+            unit, u = UNITS.match(tokens, i + n)
+        if unit:
+            heading, h = HEADINGS.match(tokens, i + n + u)
+        if not heading:
+            rest.append(tokens[i])
+            i += 1
+            continue
+        if offsets and rest and rest[-1].lower() in ('and', '&'):
+            rest.pop()
+        offsets.append((offset, unit, heading))
+        i += n + u + h
+        if i < len(tokens) and tokens[i].lower() in CONNECTIVES:
+            i += 1
+    return (offsets, rest)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+# Copyright 2011 The Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "Aaron Steele (eightysteele@gmail.com)"
+__copyright__ = "Copyright 2011 The Regents of the University of California"
+__contributors__ = ["John Wieczorek (gtuco.btuco@gmail.com)"]
+
+"""This module provides counters and timing histograms for the georeferencing pipeline."""
+
+# Standard Python modules
+import threading
+import time
+
+"""BUCKETS are the upper bounds in seconds of the timing histogram buckets."""
+BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60]
+
+class Histogram(object):
+    """Distribution of timings in seconds over the fixed BUCKETS."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def percentile(self, p):
+        """Returns the upper bound of the bucket holding the p-th percentile timing."""
+        if self.count == 0:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n > 0:
+                if i < len(BUCKETS):
+                    return min(BUCKETS[i], self.max)
+                return self.max
+        return self.max
+
+    def copy(self):
+        h = Histogram()
+        h.count, h.total, h.min, h.max = self.count, self.total, self.min, self.max
+        h.buckets = list(self.buckets)
+        return h
+
+class Snapshot(object):
+    """Point in time copy of the counters and timings of a Metrics object."""
+
+    def __init__(self, counters, timings, elapsed):
+        self.counters = counters
+        self.timings = timings
+        self.elapsed = elapsed
+
+    def count(self, name):
+        return self.counters.get(name, 0)
+
+    def rate(self, name):
+        """Returns the number of events of the named counter per second."""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.count(name) / self.elapsed
+
+    def __str__(self):
+        lines = ['%.1f sec, %d records, %.1f records/sec' % (
+                self.elapsed, self.count('records'), self.rate('records'))]
+        for name in sorted(self.counters.keys()):
+            lines.append('  %-24s %d' % (name, self.counters[name]))
+        for name in sorted(self.timings.keys()):
+            h = self.timings[name]
+            lines.append('  %-24s n=%d mean=%.4fs p50<=%.4fs p95<=%.4fs max=%.4fs' % (
+                    name, h.count, h.mean(), h.percentile(50), h.percentile(95), h.max))
+        return '\n'.join(lines)
+
+class Timer(object):
+    """Context manager recording the time spent in a block under a timing name."""
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(self.name, time.time() - self.start)
+        return False
+
+class Metrics(object):
+    """Thread safe counters and timing histograms.
+
+    Counter names in use:
+        records - localities georeferenced
+        cache.memory.hit, cache.memory.miss, cache.memory.eviction, cache.memory.expired
+        cache.local.hit, cache.local.miss, cache.remote.hit, cache.remote.miss
+        api.geocoding.error - geocoding requests that failed
+        cache.remote.queue.full - write behind puts that waited for room in the queue
+        cache.remote.queue.coalesced - write behind puts of a key already waiting
+        cache.remote.put.error - write behind batches that failed and were requeued
+    Timing names in use:
+        stage.predict, stage.parse, stage.geocode, stage.calculate
+        cache.local.get, cache.local.put, cache.remote.get, cache.remote.put
+        api.prediction, api.geocoding - external API calls"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self._counters = {}
+            self._timings = {}
+            self._started = time.time()
+        finally:
+            self._lock.release()
+
+    def incr(self, name, n=1):
+        self._lock.acquire()
+        try:
+            self._counters[name] = self._counters.get(name, 0) + n
+        finally:
+            self._lock.release()
+
+    def record(self, name, seconds):
+        self._lock.acquire()
+        try:
+            h = self._timings.get(name)
+            if h is None:
+                h = self._timings[name] = Histogram()
+            h.add(seconds)
+        finally:
+            self._lock.release()
+
+    def timer(self, name):
+        """Returns a context manager that records the time spent in its block."""
+        return Timer(self, name)
+
+    def snapshot(self):
+        self._lock.acquire()
+        try:
+            return Snapshot(
+                dict(self._counters),
+                dict((name, h.copy()) for name, h in self._timings.iteritems()),
+                time.time() - self._started)
+        finally:
+            self._lock.release()
+
+# The Metrics shared by the geomancer modules:
+METRICS = Metrics()
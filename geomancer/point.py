@@ -17,6 +17,8 @@
 __author__ = "Aaron Steele and John Wieczorek"
 
 import math
+import geodesic
+import geohash
 from constants import Datums
 
 """A_WGS84 is the radius of the sphere at the equator for the WGS84 datum."""
@@ -30,6 +32,7 @@ DEGREE_DIGITS = 7
 
 class Point(object):
     """A degree-based geographic coordinate independent of a coordinate reference system."""
+    __slots__ = ('_lng', '_lat')
 
     def __init__(self, lng, lat):
         self._lng = lng
@@ -50,7 +53,7 @@ class Point(object):
         return False
 
     def __str__(self):
-        return str(self.__dict__)
+        return str({'_lng': self._lng, '_lat': self._lat})
 
     def __eq__(self, other):
         if not isinstance(other, Point):
@@ -83,10 +86,10 @@ class Point(object):
         return 0
 
     def __hash__(self):
-        return hash('%s,%s' % (self._lat, self._lng))
+        return hash((self._lat, self._lng))
 
     def get_point_from_distance_at_bearing(self, distance, bearing):
-        """Returns the destination point in degrees lng, lat truncated to the default number of
+        """Returns the destination point in degrees lng, lat rounded to the default number of
         digits of precision by going the given distance at the bearing from the start_lng_lat.
         
         Arguments:
@@ -117,7 +120,7 @@ class Point(object):
         lng2 = lng1 + math.atan2(y, x)
         lng2d = math.degrees(lng2)
         lat2d = math.degrees(lat2)
-        return Point(float(truncate(lng2d,DEGREE_DIGITS)), float(truncate(lat2d,DEGREE_DIGITS)))
+        return Point(round_degrees(lng2d), round_degrees(lat2d))
     
     def haversine_distance(self, end_point):
         """Returns the distance in meters along a great circle between two Points on the surface of a
@@ -140,6 +143,35 @@ class Point(object):
         c = 2 * math.atan2(y, x)
         return A_WGS84 * c 
     
+    def get_geodesic_point(self, distance, bearing, datum=None):
+        """Returns the destination Point rounded to DEGREE_DIGITS by going the given distance 
+        at the bearing along the geodesic on the ellipsoid of the datum (WGS84 if None).
+
+        Arguments:
+            distance - the distance from the starting Point, in meters
+            bearing - the clockwise angle of the direction from the starting Point, in degrees from North
+            datum - the Datum of the Point"""
+        lng, lat, final_bearing = geodesic.direct(self.lng, self.lat, distance, bearing, datum)
+        return Point(round_degrees(lng), round_degrees(lat))
+
+    def geodesic_distance(self, end_point, datum=None):
+        """Returns the distance in meters along the geodesic between two Points on the ellipsoid
+        of the datum (WGS84 if None) using Vincenty's inverse formula.
+
+        Arguments:
+            end_point - the Point of the end of the geodesic
+            datum - the Datum of the Points"""
+        return geodesic.inverse(self.lng, self.lat, end_point.lng, end_point.lat, datum)[0]
+
+    def to_geohash(self, precision=geohash.PRECISION):
+        """Returns the geohash of precision characters of the cell holding the Point."""
+        return geohash.encode(self.lng, self.lat, precision)
+
+    @classmethod
+    def from_geohash(cls, code):
+        """Returns the Point at the center of the cell of a geohash."""
+        return cls(*geohash.decode(code))
+
     def point2wgs84(self, datum):
         """Returns a Point in WGS84 given a Point in any datum using the Abridged Molodensky Transformation.
         
@@ -177,6 +209,23 @@ class Point(object):
         newlat = math.degrees(latr + dlat)
         return Point(newlng, newlat)
 
+def round_degrees(x, digits=DEGREE_DIGITS):
+    """Returns the float x rounded half to even to a number of places to the right of the
+    decimal equal to digits, as numpy.round does. Use this rather than truncate for 
+    calculations and keep truncate for formatting output.
+
+    Arguments:
+        x - the input float
+        digits - the number of places of precision to the right of the decimal
+    """
+    scale = 10.0 ** digits
+    y = x * scale
+    r = math.floor(y + 0.5)
+    if r - y == 0.5 and r % 2 != 0:
+        # y is halfway between two integers, round to the even one.
+        r -= 1
+    return r / scale
+
 def truncate(x, digits):
     """Returns a string representation of x including a number of places to the right of 
     the decimal equal to digits.
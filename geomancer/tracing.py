@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+# Copyright 2011 The Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "Aaron Steele (eightysteele@gmail.com)"
+__copyright__ = "Copyright 2011 The Regents of the University of California"
+__contributors__ = ["John Wieczorek (gtuco.btuco@gmail.com)"]
+
+"""This module provides trace events for the georeferencing hot path.
+
+Events are formatted only when they are emitted, so a trace event that is off
+costs a method call and an attribute check. Arguments that are expensive to
+compute can be wrapped in Lazy so they are only computed when emitted."""
+
+# Standard Python modules
+import logging
+import random
+
+class Lazy(object):
+    """Argument of a trace event computed by calling fn only when the event is emitted."""
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self):
+        return str(self.fn(*self.args))
+
+class Tracer(object):
+    """Emits trace events to a logger at a level, for a sample of the events.
+
+    Events are emitted when the tracer is enabled and its logger is enabled for its
+    level, as logging.info calls would be. Disabling the tracer turns events off 
+    regardless of the logger. sample_rate is the fraction of events emitted."""
+
+    def __init__(self, name='geomancer', level=logging.INFO):
+        self.logger = logging.getLogger(name)
+        self.level = level
+        self.configure()
+
+    def configure(self, enabled=True, sample_rate=1.0, level=None):
+        if level is not None:
+            self.level = level
+        self.enabled = enabled
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+
+    def on(self):
+        """Returns True if events may be emitted, for guarding costly work at call sites."""
+        return self.enabled and self.sample_rate > 0 and self.logger.isEnabledFor(self.level)
+
+    def event(self, name, msg='', *args):
+        """Emits the event name with msg % args if tracing is on and the event is sampled."""
+        if not self.enabled or not self.logger.isEnabledFor(self.level):
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        self.logger.log(self.level, name + ': ' + msg, *args)
+
+# The Tracer shared by the geomancer modules:
+TRACE = Tracer()
@@ -27,6 +27,8 @@ import cStringIO
 import csv
 import getpass
 import logging
+import sys
+import threading
 
 # Google App Engine modules
 from google.appengine.tools.appengine_rpc import HttpRpcServer
@@ -44,7 +46,8 @@ class UTF8Recoder:
 
 class UnicodeDictReader:
     """A CSV reader which will iterate over lines in the CSV file "f", which is 
-    encoded in the given encoding.
+    encoded in the given encoding. Cells missing from the end of a short line are 
+    read as empty.
     """
     def __init__(self, filename, dialect=csv.excel, encoding="utf-8", **kwds):
         f = UTF8Recoder(codecs.open(filename, encoding='utf-8', mode='r'), encoding)
@@ -54,6 +57,7 @@ class UnicodeDictReader:
     def next(self):
         row = self.reader.next()
         vals = [unicode(s, "utf-8") for s in row]
+        vals.extend([u''] * (len(self.fieldnames) - len(vals)))
         return dict((self.fieldnames[x], vals[x]) for x in range(len(self.fieldnames)))
 
     def __iter__(self):
@@ -144,6 +148,95 @@ class AppEngine(object):
             debug_data=True,
             secure=True)
 
+class Future(object):
+    """A result that becomes available later, modeled on ndb.tasklets.Future."""
+
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._condition = threading.Condition()
+
+    def done(self):
+        return self._done
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exc_info(self, exc_info):
+        self._finish(None, exc_info)
+
+    def add_callback(self, callback):
+        """Calls callback with this Future once it is done."""
+        self._condition.acquire()
+        try:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._condition.release()
+        callback(self)
+
+    def wait(self, timeout=None):
+        """Blocks until the Future is done or timeout seconds have passed."""
+        self._condition.acquire()
+        try:
+            if not self._done:
+                self._condition.wait(timeout)
+        finally:
+            self._condition.release()
+
+    def get_result(self, timeout=None):
+        """Returns the result, raising the exception it failed with if any."""
+        self.wait(timeout)
+        if not self._done:
+            raise RuntimeError('Future not done after %s seconds' % timeout)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def _finish(self, result, exc_info):
+        self._condition.acquire()
+        try:
+            if self._done:
+                return
+            self._done = True
+            self._result = result
+            self._exc_info = exc_info
+            callbacks = self._callbacks
+            self._callbacks = []
+            self._condition.notify_all()
+        finally:
+            self._condition.release()
+        for callback in callbacks:
+            callback(self)
+
+    @classmethod
+    def gather(cls, futures):
+        """Returns a Future for the list of results of futures, in order."""
+        result = cls()
+        futures = list(futures)
+        remaining = [len(futures)]
+        lock = threading.Lock()
+        def callback(future):
+            lock.acquire()
+            try:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            finally:
+                lock.release()
+            try:
+                result.set_result([x.get_result() for x in futures])
+            except Exception:
+                result.set_exc_info(sys.exc_info())
+        if len(futures) == 0:
+            result.set_result([])
+        for future in futures:
+            future.add_callback(callback)
+        return result
+
 def CredentialsPrompt(host, email=None, passin=False, 
                       raw_input_fn=raw_input, 
                       password_input_fn=getpass.getpass):                                  
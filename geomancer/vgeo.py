@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+# Copyright 2011 University of California at Berkeley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "Aaron Steele and John Wieczorek"
+
+"""This module provides array versions of the geodesy of the point and bb modules.
+
+Each function takes NumPy arrays (or anything numpy.asarray accepts, including scalars)
+of longitudes, latitudes, distances and bearings in the units of the scalar version and
+returns arrays, computing each element exactly as the scalar version does."""
+
+import numpy as np
+
+import geodesic
+import geohash
+from constants import Datums
+from point import A_WGS84, DEGREE_DIGITS
+
+def _float_arrays(*args):
+    return [np.asarray(x, dtype=np.float64) for x in args]
+
+def round_degrees(x, digits=DEGREE_DIGITS):
+    """Returns an array of x rounded half to even to digits places. See point.round_degrees."""
+    return np.round(x, digits)
+
+def lng180(lng):
+    """Returns longitudes in degrees between {-180, 180] given longitudes in degrees."""
+    lng, = _float_arrays(lng)
+    return np.where(lng <= -180, lng + 360, np.where(lng > 180, lng - 360, lng))
+
+def lng_distance(west_lng, east_lng):
+    """Returns an array of the number of degrees from west_lng going eastward to east_lng,
+    with 360 where they are the same. See bb.lng_distance."""
+    w = lng180(west_lng)
+    e = lng180(east_lng)
+    d = e - w
+    return np.where(w == e, 360.0, np.where(d < 0, d + 360, d))
+
+def is_lng_between(lng, west_lng, east_lng):
+    """Returns a boolean array that is True where lng is between west_lng and east_lng
+    proceeding east from west_lng. See bb.is_lng_between."""
+    return lng_distance(west_lng, east_lng) >= lng_distance(lng, east_lng)
+
+def point_from_distance_at_bearing(lng, lat, distance, bearing):
+    """Returns (lng, lat) arrays of the destination points in degrees rounded to DEGREE_DIGITS
+    reached by going distance meters at bearing degrees clockwise from North from each of
+    the starting points lng, lat. See Point.get_point_from_distance_at_bearing."""
+    lng, lat, distance, bearing = _float_arrays(lng, lat, distance, bearing)
+    # NaN rows, such as an invalid offset, stay NaN without warnings.
+    with np.errstate(invalid='ignore'):
+        ad = distance / A_WGS84
+        lat1 = np.radians(lat)
+        lng1 = np.radians(lng)
+        b = np.radians(bearing)
+        lat2 = np.arcsin(np.sin(lat1) * np.cos(ad) + np.cos(lat1) * np.sin(ad) * np.cos(b))
+        y = np.sin(b) * np.sin(ad) * np.cos(lat1)
+        x = np.cos(ad) - np.sin(lat1) * np.sin(lat2)
+        # Avoid incorrect hemisphere determination from rounding errors, as the scalar 
+        # version does.
+        x = np.where(np.fabs(x) < 1e-10, 0.0, x)
+        lng2 = lng1 + np.arctan2(y, x)
+        return (round_degrees(np.degrees(lng2)), round_degrees(np.degrees(lat2)))
+
+def bbs_from_pr(lng, lat, radius):
+    """Returns (w, n, e, s) arrays of the edges of the boxes reaching radius meters north,
+    east, south and west of points lng, lat, rounded to DEGREE_DIGITS. See bb.bb_from_pr.
+    The trigonometry of the points and distances is shared by the four bearings."""
+    lng, lat, radius = np.broadcast_arrays(*_float_arrays(lng, lat, radius))
+    # NaN rows, such as an invalid radius, stay NaN without warnings.
+    with np.errstate(invalid='ignore'):
+        ad = radius / A_WGS84
+        lat1 = np.radians(lat)
+        sinlat, coslat = np.sin(lat1), np.cos(lat1)
+        sinad, cosad = np.sin(ad), np.cos(ad)
+        n = np.arcsin(sinlat * cosad + coslat * sinad)
+        s = np.arcsin(sinlat * cosad - coslat * sinad)
+        # Going east and west reaches the same latitude, and longitudes symmetric about lng.
+        x = cosad - sinlat * np.sin(np.arcsin(sinlat * cosad))
+        x = np.where(np.fabs(x) < 1e-10, 0.0, x)
+        dlng = np.arctan2(sinad * coslat, x)
+        lng1 = np.radians(lng)
+        return (round_degrees(np.degrees(lng1 - dlng)), round_degrees(np.degrees(n)),
+                round_degrees(np.degrees(lng1 + dlng)), round_degrees(np.degrees(s)))
+
+def haversine_distance(lng0, lat0, lng1, lat1):
+    """Returns an array of the distances in meters along great circles from points lng0, lat0
+    to points lng1, lat1 on a sphere of radius A_WGS84. See Point.haversine_distance."""
+    lng0, lat0, lng1, lat1 = _float_arrays(lng0, lat0, lng1, lat1)
+    dlng = np.radians(lng1 - lng0)
+    dlat = np.radians(lat1 - lat0)
+    a = np.sin(dlat / 2) ** 2 + np.cos(np.radians(lat0)) * np.cos(np.radians(lat1)) * np.sin(dlng / 2) ** 2
+    a = np.where(np.fabs(1 - a) < 1e-10, 1.0, a)
+    return A_WGS84 * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+def great_circle_midpoint(lng0, lat0, lng1, lat1):
+    """Returns (lng, lat) arrays of the midpoints of the great circle routes from points
+    lng0, lat0 to points lng1, lat1 in degrees. See bb.great_circle_midpoint."""
+    lng0, lat0, lng1, lat1 = _float_arrays(lng0, lat0, lng1, lat1)
+    lat1r = np.radians(lat0)
+    lat2r = np.radians(lat1)
+    lng1r = np.radians(lng0)
+    dlng = np.radians(lng1) - lng1r
+    bx = np.cos(lat2r) * np.cos(dlng)
+    by = np.cos(lat2r) * np.sin(dlng)
+    lat3 = np.arctan2(np.sin(lat1r) + np.sin(lat2r), np.sqrt((np.cos(lat1r) + bx) ** 2 + by * by))
+    lng3 = lng1r + np.arctan2(by, np.cos(lat1r) + bx)
+    return (np.degrees(lng3), np.degrees(lat3))
+
+class DatumTransform(object):
+    """The constants of the Abridged Molodensky Transformation from a Datum to WGS84."""
+    __slots__ = ('datum', 'a', 'f', 'da', 'df', 'e_squared', 'dx', 'dy', 'dz')
+
+    def __init__(self, datum):
+        self.datum = datum
+        self.a = datum.axis
+        self.f = 1.0 / datum.flattening
+        self.da = Datums.WGS84.axis - self.a
+        self.df = 1.0 / Datums.WGS84.flattening - self.f
+        self.e_squared = self.f * (2 - self.f)
+        self.dx, self.dy, self.dz = datum.dx, datum.dy, datum.dz
+
+    def to_wgs84(self, lng, lat):
+        """Returns (lng, lat) arrays in WGS84 of points lng, lat in the Datum."""
+        lng, lat = _float_arrays(lng, lat)
+        a, f = self.a, self.f
+        latr = np.radians(lat)
+        lngr = np.radians(lng)
+        sinlat, coslat = np.sin(latr), np.cos(latr)
+        sinlng, coslng = np.sin(lngr), np.cos(lngr)
+        w = 1 - self.e_squared * sinlat * sinlat
+        rho = a * (1 - self.e_squared) / np.power(w, 1.5)
+        nu = a / np.sqrt(w)
+        dlat = (1 / rho) * (-self.dx * sinlat * coslng - self.dy * sinlat * sinlng
+                            + self.dz * coslat + (f * self.da + a * self.df) * np.sin(2 * latr))
+        dlng = (-self.dx * sinlng + self.dy * coslng) / (nu * coslat)
+        return (lng180(np.degrees(lngr + dlng)), np.degrees(latr + dlat))
+
+"""DATUM_TRANSFORMS caches a DatumTransform per Datum code so each is only derived once."""
+DATUM_TRANSFORMS = {}
+
+def get_datum_transform(datum):
+    """Returns the DatumTransform from a Datum to WGS84."""
+    transform = DATUM_TRANSFORMS.get(datum.code)
+    if transform is None:
+        if datum.axis <= 0 or datum.flattening <= 0:
+            raise ValueError('Datum %s has no ellipsoid parameters' % datum.code)
+        transform = DATUM_TRANSFORMS[datum.code] = DatumTransform(datum)
+    return transform
+
+def point2wgs84(lng, lat, datum):
+    """Returns (lng, lat) arrays in WGS84 of points lng, lat in the given Datum using the
+    Abridged Molodensky Transformation. See Point.point2wgs84."""
+    return get_datum_transform(datum).to_wgs84(lng, lat)
+
+def columns2wgs84(lng, lat, datums):
+    """Returns (lng, lat) arrays in WGS84 of points lng, lat where datums is a sequence of
+    the Datum of each point. Points are transformed in one batch per Datum. Points with
+    a Datum of None or without ellipsoid parameters are NaN in the result."""
+    lng, lat = _float_arrays(lng, lat)
+    wgs84_lng = np.full(lng.shape, np.nan)
+    wgs84_lat = np.full(lat.shape, np.nan)
+    groups = {}
+    for i, datum in enumerate(datums):
+        if datum is not None and datum.axis > 0 and datum.flattening > 0:
+            groups.setdefault(datum.code, (datum, []))[1].append(i)
+    for datum, rows in groups.itervalues():
+        rows = np.array(rows)
+        wgs84_lng[rows], wgs84_lat[rows] = point2wgs84(lng[rows], lat[rows], datum)
+    return (wgs84_lng, wgs84_lat)
+
+def geodesic_inverse(lng0, lat0, lng1, lat1, datum=None):
+    """Returns (distance, bearing0, bearing1) arrays of the geodesics from points lng0, lat0 
+    to points lng1, lat1 on the ellipsoid of datum (WGS84 if None). See geodesic.inverse."""
+    lng0, lat0, lng1, lat1 = np.broadcast_arrays(*_float_arrays(lng0, lat0, lng1, lat1))
+    el = geodesic.get_ellipsoid(datum)
+    f = el.f
+    L = np.radians(lng1 - lng0)
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat0)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+    lam = L.copy()
+    active = np.ones(L.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i in range(geodesic.MAX_ITERATIONS):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cosU1 * cosU2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha * sin_alpha
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, 
+                                    cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            last = lam
+            lam = np.where(active, L + (1 - C) * f * sin_alpha * (sigma + C * sin_sigma *
+                (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m * cos_2sigma_m))), lam)
+            active &= np.fabs(lam - last) >= geodesic.CONVERGENCE
+            if not active.any():
+                break
+        A, B = geodesic.series(cos2_alpha * el.ep2)
+        distance = el.b * A * (sigma - geodesic.delta_sigma(B, sin_sigma, cos_sigma, cos_2sigma_m))
+        bearing0 = np.degrees(np.arctan2(cosU2 * sin_lam, 
+                                         cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)) % 360
+        bearing1 = np.degrees(np.arctan2(cosU1 * sin_lam, 
+                                         -sinU1 * cosU2 + cosU1 * sinU2 * cos_lam)) % 360
+    coincident = sin_sigma == 0
+    distance[coincident] = 0.0
+    bearing0[coincident] = 0.0
+    bearing1[coincident] = 0.0
+    for i in np.flatnonzero(active & ~coincident):
+        # Nearly antipodal points fall back to the sphere, as geodesic.inverse does.
+        distance.flat[i], bearing0.flat[i], bearing1.flat[i] = geodesic.inverse(
+            lng0.flat[i], lat0.flat[i], lng1.flat[i], lat1.flat[i], datum)
+    return (distance, bearing0, bearing1)
+
+def geodesic_direct(lng, lat, distance, bearing, datum=None):
+    """Returns (lng, lat, bearing) arrays of the destinations of the geodesics that start at 
+    points lng, lat and go distance meters at bearing degrees from North on the ellipsoid of
+    datum (WGS84 if None). See geodesic.direct."""
+    lng, lat, distance, bearing = np.broadcast_arrays(
+        *_float_arrays(lng, lat, distance, bearing))
+    el = geodesic.get_ellipsoid(datum)
+    f = el.f
+    alpha1 = np.radians(bearing)
+    sin_alpha1, cos_alpha1 = np.sin(alpha1), np.cos(alpha1)
+    tanU1 = (1 - f) * np.tan(np.radians(lat))
+    cosU1 = 1 / np.sqrt(1 + tanU1 * tanU1)
+    sinU1 = tanU1 * cosU1
+    sigma1 = np.arctan2(tanU1, cos_alpha1)
+    sin_alpha = cosU1 * sin_alpha1
+    cos2_alpha = 1 - sin_alpha * sin_alpha
+    A, B = geodesic.series(cos2_alpha * el.ep2)
+    sigma = distance / (el.b * A)
+    for i in range(geodesic.MAX_ITERATIONS):
+        cos_2sigma_m = np.cos(2 * sigma1 + sigma)
+        last = sigma
+        sigma = distance / (el.b * A) + geodesic.delta_sigma(B, np.sin(sigma), np.cos(sigma), cos_2sigma_m)
+        if not (np.fabs(sigma - last) >= geodesic.CONVERGENCE).any():
+            break
+    cos_2sigma_m = np.cos(2 * sigma1 + sigma)
+    sin_sigma, cos_sigma = np.sin(sigma), np.cos(sigma)
+    tmp = sinU1 * sin_sigma - cosU1 * cos_sigma * cos_alpha1
+    lat2 = np.arctan2(sinU1 * cos_sigma + cosU1 * sin_sigma * cos_alpha1,
+                      (1 - f) * np.hypot(sin_alpha, tmp))
+    lam = np.arctan2(sin_sigma * sin_alpha1, cosU1 * cos_sigma - sinU1 * sin_sigma * cos_alpha1)
+    C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+    L = lam - (1 - C) * f * sin_alpha * (sigma + C * sin_sigma *
+        (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m * cos_2sigma_m)))
+    lng2 = (lng + np.degrees(L) + 540) % 360 - 180
+    return (lng2, np.degrees(lat2), np.degrees(np.arctan2(sin_alpha, -tmp)) % 360)
+
+_GEOHASH_CHARS = np.frombuffer(geohash.BASE32, dtype=np.uint8)
+_GEOHASH_VALUES = np.full(256, -1, dtype=np.int64)
+_GEOHASH_VALUES[_GEOHASH_CHARS] = np.arange(32)
+_GEOHASH_VALUES[np.frombuffer(geohash.BASE32.upper(), dtype=np.uint8)] = np.arange(32)
+
+def geohash_encode(lng, lat, precision=geohash.PRECISION):
+    """Returns an array of the geohashes of precision characters of points lng, lat, as 
+    strings of dtype S<precision>. See geohash.encode."""
+    lng, lat = np.broadcast_arrays(*_float_arrays(lng, lat))
+    width, height = geohash.cell_size(precision)
+    lng_bits, lat_bits = geohash.bits(precision)
+    i = np.clip(np.floor((lng + 180) / width), 0, (1 << lng_bits) - 1).astype(np.int64)
+    j = np.clip(np.floor((lat + 90) / height), 0, (1 << lat_bits) - 1).astype(np.int64)
+    value = np.zeros(i.shape, dtype=np.int64)
+    for k in range(5 * precision):
+        if k % 2 == 0:
+            lng_bits -= 1
+            value = (value << 1) | ((i >> lng_bits) & 1)
+        else:
+            lat_bits -= 1
+            value = (value << 1) | ((j >> lat_bits) & 1)
+    shifts = 5 * np.arange(precision - 1, -1, -1)
+    chars = _GEOHASH_CHARS[(value.reshape(-1, 1) >> shifts) & 31]
+    return np.ascontiguousarray(chars).view('S%d' % precision).reshape(i.shape)
+
+def geohash_decode_bb(geohashes):
+    """Returns (w, n, e, s) arrays of the edges of the cells of geohashes, a sequence of
+    geohash strings. See geohash.decode_bb."""
+    geohashes = np.asarray(geohashes, dtype=np.str_).reshape(-1)
+    w, n, e, s = [np.empty(len(geohashes)) for edge in range(4)]
+    lengths = np.char.str_len(geohashes)
+    for precision in np.unique(lengths).tolist():
+        rows = np.nonzero(lengths == precision)[0]
+        width, height = geohash.cell_size(precision)
+        codes = np.frombuffer(geohashes[rows].astype('S%d' % precision).tobytes(), dtype=np.uint8)
+        values = _GEOHASH_VALUES[codes.reshape(-1, precision)]
+        if (values < 0).any():
+            raise ValueError('Not a geohash: %r' % geohashes[rows][(values < 0).any(axis=1)][0])
+        i = np.zeros(len(rows), dtype=np.int64)
+        j = np.zeros(len(rows), dtype=np.int64)
+        for k in range(5 * precision):
+            bit = (values[:, k // 5] >> (4 - k % 5)) & 1
+            if k % 2 == 0:
+                i = (i << 1) | bit
+            else:
+                j = (j << 1) | bit
+        w[rows] = -180 + i * width
+        s[rows] = -90 + j * height
+        e[rows] = w[rows] + width
+        n[rows] = s[rows] + height
+    return (w, n, e, s)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# Copyright 2011 University of California at Berkeley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "Aaron Steele and John Wieczorek"
+
+"""This module provides unit testing for the PointArray and BoundingBoxArray classes."""
+
+import random
+import sys
+import unittest
+
+sys.path.insert(0, '../')
+
+from geomancer.bb import BoundingBox
+from geomancer.bbarray import BoundingBoxArray, PointArray
+from geomancer.point import *
+
+def _bbs(n, seed=1):
+    """Returns n random boxes, some of which cross the antimeridian."""
+    r = random.Random(seed)
+    bbs = []
+    for i in range(n):
+        w = r.randint(-180, 179)
+        e = lng180(w + r.randint(1, 90))
+        s = r.randint(-89, 80)
+        bbs.append(BoundingBox.create(float(w), float(min(89, s + r.randint(1, 40))), float(e), float(s)))
+    return bbs
+
+class BoundingBoxArrayTest(unittest.TestCase):
+    def test_slots(self):
+        bb = BoundingBox.create(-10, 10, 10, -10)
+        self.assertRaises(AttributeError, setattr, bb, 'x', 1)
+        self.assertRaises(AttributeError, setattr, bb.nw, 'x', 1)
+        self.assertEqual(hash(bb), hash(BoundingBox.create(-10, 10, 10, -10)))
+
+    def test_views(self):
+        bbs = _bbs(50)
+        array = BoundingBoxArray.from_bbs(bbs)
+        self.assertEqual(len(array), 50)
+        self.assertEqual(array[3], bbs[3])
+        self.assertEqual(array.to_list(), bbs)
+        self.assertEqual(array[10:20].to_list(), bbs[10:20])
+        self.assertEqual(array.nw[5], bbs[5].nw)
+        self.assertEqual(array.to_kml(), [bb.to_kml() for bb in bbs])
+        points = PointArray.from_points([bb.se for bb in bbs])
+        self.assertEqual(list(points), [bb.se for bb in bbs])
+
+    def test_center_and_radius(self):
+        bbs = _bbs(200, 2)
+        array = BoundingBoxArray.from_bbs(bbs)
+        centers = array.center()
+        radii = array.calc_radius()
+        for i, bb in enumerate(bbs):
+            self.assertAlmostEqual(centers[i].lng, bb.center().lng, places=DEGREE_DIGITS)
+            self.assertAlmostEqual(centers[i].lat, bb.center().lat, places=DEGREE_DIGITS)
+            self.assertAlmostEqual(radii[i], bb.calc_radius(), places=4)
+
+    def test_intersection(self):
+        bbs = _bbs(500, 3)
+        array = BoundingBoxArray.from_bbs(bbs)
+        queries = _bbs(50, 4) + [BoundingBox.create(170, 10, -170, -10)]
+        for query in queries:
+            expected = [bb.intersection(query) for bb in bbs]
+            self.assertEqual(list(array.intersects(query)), [x is not None for x in expected])
+            self.assertEqual(array.intersection(query).to_list(), 
+                             [x for x in expected if x is not None])
+
+    def test_from_pr(self):
+        from geomancer.bb import bb_from_pr
+        r = random.Random(5)
+        points = [Point(r.uniform(-180, 180), r.uniform(-89, 89)) for i in range(500)]
+        radii = [r.choice([100, 1000, r.uniform(0, 200000)]) for p in points]
+        bbs = BoundingBoxArray.from_pr(PointArray.from_points(points), radii)
+        for bb, p, radius in zip(bbs, points, radii):
+            expected = bb_from_pr(p, radius)
+            for edge in ['get_w', 'get_n', 'get_e', 'get_s']:
+                self.assertAlmostEqual(getattr(bb, edge)(), getattr(expected, edge)(), places=DEGREE_DIGITS - 1)
+
+if __name__ == '__main__':
+    unittest.main()
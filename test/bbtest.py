@@ -80,7 +80,92 @@ class BBTest(unittest.TestCase):
         self.assertEqual(i.se.get_lng(), -170)
         self.assertEqual(i.se.get_lat(), -5)
         print 'nw: %s se: %s' % (i.nw, i.se)
-    
+
+    def test_get_intersecting(self):
+        import random
+        from geomancer.bb import BoundingBoxIndex, lng_distance
+        def overlaps(a, b):
+            if a.get_s() > b.get_n() or b.get_s() > a.get_n():
+                return False
+            def covers(bb, lng):
+                return lng_distance(bb.get_w(), lng) <= lng_distance(bb.get_w(), bb.get_e()) \
+                    or lng180(lng) == lng180(bb.get_w())
+            return covers(a, b.get_w()) or covers(b, a.get_w())
+        r = random.Random(1)
+        bbs = []
+        for i in range(3000):
+            w = r.uniform(-180, 180)
+            s = r.uniform(-90, 85)
+            bbs.append(BoundingBox.create(w, min(90, s + r.uniform(0, 5)), lng180(w + r.uniform(0, 5)), s))
+        index = BoundingBoxIndex(bbs)
+        queries = [BoundingBox.create(r.uniform(-180, 180), 0, 0, 0) for i in range(5)]
+        queries = [BoundingBox.create(x.get_w(), 45, lng180(x.get_w() + 20), 25) for x in queries]
+        queries.append(BoundingBox.create(170, 10, -170, -10))
+        queries.append(BoundingBox.create(0, 90, 0, -90))
+        for query in queries:
+            expected = [bb for bb in bbs if overlaps(bb, query)]
+            self.assertEqual(index.get_intersecting(query), expected)
+        self.assertEqual(len(index.get_intersecting(queries[-1])), len(bbs))
+        bb = BoundingBox.create(0, 10, 10, 0)
+        self.assertEqual(BoundingBox.get_intersecting([bb], BoundingBox.create(10, 20, 20, 10)), [bb])
+        self.assertEqual(BoundingBox.get_intersecting([], bb), [])
+
+    def test_intersect_all(self):
+        import random
+        def pairwise(bb_list):
+            result = bb_list[0]
+            for bb in bb_list[1:]:
+                result = bb.intersection(result)
+                if result is None:
+                    return None
+            return result
+        r = random.Random(2)
+        for i in range(2000):
+            bbs = []
+            for j in range(r.randint(1, 4)):
+                w = r.choice([r.uniform(-180, 180), 170, -175, 180])
+                s = r.uniform(-20, 10)
+                bbs.append(BoundingBox.create(w, s + r.uniform(5, 30), lng180(w + r.uniform(1, 40)), s))
+            copy = list(bbs)
+            expected = pairwise(bbs)
+            self.assertEqual(BoundingBox.intersect_all(bbs), expected)
+            self.assertEqual(bbs, copy)
+        bbs = [BoundingBox.create(170, 10, -170, -10), BoundingBox.create(-175, 5, -165, -5), 
+               BoundingBox.create(175, 20, -172, 0)]
+        self.assertEqual(BoundingBox.intersect_all(bbs), BoundingBox.create(-175, 5, -172, 0))
+        self.assertEqual(BoundingBox.intersect_all(iter(bbs[:1])), bbs[0])
+        self.assertEqual(BoundingBox.intersect_all([]), None)
+
+    def test_intersect_lists(self):
+        import random
+        bbs0 = [BoundingBox.create(0,10,10,0), BoundingBox.create(20,10,30,0), 
+                BoundingBox.create(170,10,-170,0)]
+        bbs1 = [BoundingBox.create(5,5,25,-5), BoundingBox.create(-175,15,-160,5),
+                BoundingBox.create(50,50,60,40)]
+        bbs2 = [BoundingBox.create(-180,90,180,-90)]
+        i = BoundingBox.intersect_lists([bbs0, bbs1])
+        self.assertEqual(len(i), 3)
+        self.assertTrue(BoundingBox.create(5,5,10,0) in i)
+        self.assertTrue(BoundingBox.create(20,5,25,0) in i)
+        self.assertTrue(BoundingBox.create(-175,10,-170,5) in i)
+        self.assertEqual(len(BoundingBox.intersect_lists([bbs0, bbs1, bbs2])), 3)
+        self.assertEqual(BoundingBox.intersect_lists([bbs0, [bbs1[2]]]), [])
+        self.assertEqual(BoundingBox.intersect_lists([]), [])
+        # The sweep finds the same intersections as trying every pair.
+        r = random.Random(5)
+        def box():
+            w, s = r.uniform(-180, 180), r.uniform(-60, 50)
+            return BoundingBox.create(w, s + r.uniform(0, 30), lng180(w + r.uniform(0, 40)), s)
+        bbs0 = [box() for i in range(60)]
+        bbs1 = [box() for i in range(60)]
+        pairs = [x.intersection(y) for x in bbs0 for y in bbs1]
+        self.assertEqual(BoundingBox.intersect_lists([bbs0, bbs1]), [x for x in pairs if x is not None])
+        # Boxes that all overlap in latitude are still only paired with their neighbours.
+        bbs0 = [BoundingBox.create(w, 50, w + 0.5, 20) for w in range(-170, 170)]
+        bbs1 = [BoundingBox.create(w + 0.25, 40, w + 0.75, 30) for w in range(-170, 170)]
+        i = BoundingBox.intersect_lists([bbs0, bbs1])
+        self.assertEqual(i, [BoundingBox.create(w + 0.25, 40, w + 0.5, 30) for w in range(-170, 170)])
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     unittest.main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+# Copyright 2011 The Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "Aaron Steele (eightysteele@gmail.com)"
+__copyright__ = "Copyright 2011 The Regents of the University of California"
+__contributors__ = ["John Wieczorek (gtuco.btuco@gmail.com)"]
+
+import setup_env
+setup_env.fix_sys_path()
+
+from geomancer import cache
+from geomancer.cache import Cache, LocalCache, MemoryCache, RemoteCache
+from geomancer.metrics import METRICS
+
+import cgi
+import os
+import simplejson
+import tempfile
+import threading
+import time
+import unittest
+
+class FakeServer(object):
+    """Stand-in for the remote cache App Engine server that records each request path."""
+    def __init__(self, failures=0):
+        self.entries = {}
+        self.paths = []
+        self.failures = failures
+        self._lock = threading.Lock()
+
+    def send(self, rpc):
+        params = dict((k, v[0]) for k, v in cgi.parse_qs(rpc.payload() or '').iteritems())
+        self._lock.acquire()
+        try:
+            if self.failures:
+                self.failures -= 1
+                raise IOError('Service unavailable')
+            self.paths.append(rpc.request_path())
+            if rpc.request_path() == '/cache/get_multi':
+                keys = simplejson.loads(params['keys'])
+                return simplejson.dumps(dict((k, self.entries[k]) for k in keys if self.entries.has_key(k)))
+            if rpc.request_path() == '/cache/put_multi':
+                self.entries.update(simplejson.loads(params['values']))
+        finally:
+            self._lock.release()
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(suffix='.sqlite3.db')
+        os.close(fd)
+        self.saved_filename = cache.FILENAME
+        Cache.config(local_filename=self.filename)
+        METRICS.reset()
+
+    def tearDown(self):
+        # Restore the previous file without opening it, so no cache file is left behind.
+        cache._connection().close()
+        cache._LOCAL.conn = None
+        cache.FILENAME = self.saved_filename
+        cache.MEMORY.configure(cache.MEMORY.max_entries, cache.MEMORY.max_bytes, cache.MEMORY.ttl)
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.filename + suffix):
+                os.remove(self.filename + suffix)
+
+    def test_memory_lru(self):
+        memory = MemoryCache(max_entries=2)
+        memory.put('a', 1)
+        memory.put('b', 2)
+        self.assertEqual(memory.get('a'), 1)
+        memory.put('c', 3)
+        # b was the least recently used.
+        self.assertEqual(memory.get('b'), None)
+        self.assertEqual(memory.get('a'), 1)
+        self.assertEqual(memory.get('c'), 3)
+        self.assertEqual(METRICS.snapshot().count('cache.memory.eviction'), 1)
+
+    def test_memory_bytes(self):
+        memory = MemoryCache(max_bytes=20)
+        memory.put('a', 'x' * 8)
+        memory.put('b', 'y' * 8)
+        self.assertEqual(memory.bytes, 20)
+        memory.put('c', 'z' * 8)
+        self.assertEqual(len(memory), 2)
+        self.assertEqual(memory.get('a'), None)
+        memory.put('d', 'w' * 100)
+        self.assertEqual(memory.get('d'), None)
+        self.assertEqual(memory.bytes, 20)
+
+    def test_memory_copy(self):
+        value = {'type': 'f', 'parts': {'features': ['Berkeley']}}
+        Cache.put('berkeley', value, remote=False)
+        value['parts']['features'].append('Oakland')
+        self.assertEqual(Cache.get('berkeley'), {'type': 'f', 'parts': {'features': ['Berkeley']}})
+
+    def test_memory_ttl(self):
+        memory = MemoryCache(ttl=0.01)
+        memory.put('a', 1)
+        self.assertEqual(memory.get('a'), 1)
+        time.sleep(0.02)
+        self.assertEqual(memory.get('a'), None)
+        self.assertEqual(len(memory), 0)
+
+    def test_get_memory_tier(self):
+        LocalCache.put('berkeley', {'type': 'f'})
+        self.assertEqual(Cache.get('Berkeley '), {'type': 'f'})
+        # Later gets skip the local cache.
+        cache._connection().execute('delete from cache')
+        cache._connection().commit()
+        self.assertEqual(Cache.get('berkeley'), {'type': 'f'})
+        snapshot = METRICS.snapshot()
+        self.assertEqual(snapshot.count('cache.memory.miss'), 1)
+        self.assertEqual(snapshot.count('cache.memory.hit'), 1)
+        self.assertEqual(snapshot.count('cache.local.hit'), 1)
+        Cache.config(memory_entries=0)
+        try:
+            self.assertEqual(len(cache.MEMORY), 0)
+        finally:
+            Cache.config(memory_entries=cache.MEMORY_ENTRIES)
+
+    def test_local_many(self):
+        items = [('key-%d' % i, {'i': i}) for i in range(25)]
+        LocalCache.put_many(items)
+        chunk = cache.GET_MANY_CHUNK
+        cache.GET_MANY_CHUNK = 10
+        try:
+            hits = LocalCache.get_many(['key-%d' % i for i in range(20, 30)] + ['key-0'])
+        finally:
+            cache.GET_MANY_CHUNK = chunk
+        self.assertEqual(sorted(hits.keys()), ['key-0', 'key-20', 'key-21', 'key-22', 'key-23', 'key-24'])
+        self.assertEqual(hits['key-22'], {'i': 22})
+        self.assertEqual(LocalCache.get_many([]), {})
+
+    def test_get_many(self):
+        LocalCache.put_many([('oakland', ['f']), ('berkeley', ['foh'])])
+        cache.MEMORY.put('albany', ['f'])
+        hits = Cache.get_many(['Berkeley', 'berkeley ', 'albany', 'Oakland'])
+        self.assertEqual(hits, {'Berkeley': ['foh'], 'berkeley ': ['foh'],
+                                'albany': ['f'], 'Oakland': ['f']})
+        snapshot = METRICS.snapshot()
+        self.assertEqual(snapshot.count('cache.memory.hit'), 1)
+        self.assertEqual(snapshot.count('cache.local.hit'), 2)
+        self.assertEqual(cache.MEMORY.get('oakland'), ['f'])
+
+    def test_upsert(self):
+        LocalCache.put('berkeley', ['f'])
+        LocalCache.put('berkeley', ['foh'])
+        LocalCache.put_many([('berkeley', ['nf']), ('oakland', ['f'])])
+        self.assertEqual(LocalCache.get('berkeley'), ['nf'])
+        journal = cache._connection().execute('pragma journal_mode').fetchone()[0]
+        self.assertEqual(journal, 'wal')
+
+    def test_threads(self):
+        errors = []
+        def work(n):
+            try:
+                for i in range(20):
+                    LocalCache.put('key-%d-%d' % (n, i), i)
+                    LocalCache.put_many([('shared-%d' % i, n), ('key-%d-%d' % (n, i), i)])
+                    self.assertEqual(LocalCache.get('key-%d-%d' % (n, i)), i)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(LocalCache.get_many(['shared-%d' % i for i in range(20)])), 20)
+
+    def test_remote_many(self):
+        server, batch = cache.SERVER, cache.REMOTE_BATCH
+        cache.SERVER = FakeServer()
+        cache.REMOTE_BATCH = 10
+        try:
+            RemoteCache.put_many([('key-%d' % i, {'i': i}) for i in range(35)])
+            self.assertEqual(cache.SERVER.paths, ['/cache/put_multi'] * 4)
+            hits = RemoteCache.get_many(['key-%d' % i for i in range(30, 40)])
+            self.assertEqual(hits, dict(('key-%d' % i, {'i': i}) for i in range(30, 35)))
+            # Keys missing locally are fetched from the remote cache in batches and kept locally.
+            hits = Cache.get_many(['Key-%d' % i for i in range(25)])
+            self.assertEqual(len(hits), 25)
+            self.assertEqual(cache.SERVER.paths.count('/cache/get_multi'), 4)
+            self.assertEqual(len(LocalCache.get_many(['key-%d' % i for i in range(25)])), 25)
+        finally:
+            cache.SERVER, cache.REMOTE_BATCH = server, batch
+
+    def test_local_only(self):
+        server = cache.SERVER
+        cache.SERVER = FakeServer()
+        try:
+            Cache.put('georef-berkeley', ['f'], remote=False)
+            Cache.put_many([('georef-oakland', ['f'])], remote=False)
+            self.assertEqual(Cache.get('georef-albany', remote=False), None)
+            self.assertEqual(Cache.get_many(['georef-albany', 'georef-oakland'], remote=False),
+                             {'georef-oakland': ['f']})
+            self.assertEqual(cache.SERVER.paths, [])
+            self.assertEqual(LocalCache.get('georef-berkeley'), ['f'])
+        finally:
+            cache.SERVER = server
+
+    def test_write_behind(self):
+        server = cache.SERVER
+        cache.SERVER = FakeServer()
+        Cache.config(write_behind=True)
+        try:
+            for i in range(50):
+                Cache.put('Key-%d' % (i % 20), i)
+            Cache.put_many([('key-0', 'last')])
+            Cache.flush()
+            self.assertEqual(len(cache.WRITER), 0)
+            self.assertEqual(simplejson.loads(cache.SERVER.entries['key-0']), 'last')
+            self.assertEqual(simplejson.loads(cache.SERVER.entries['key-19']), 39)
+            self.assertEqual(len(cache.SERVER.entries), 20)
+            self.assertEqual(LocalCache.get('key-0'), 'last')
+        finally:
+            Cache.config(write_behind=False)
+            cache.SERVER = server
+        self.assertEqual(cache.WRITER, None)
+
+    def test_write_behind_retry(self):
+        server, delay = cache.SERVER, cache.REMOTE_RETRY_DELAY
+        fake = cache.SERVER = FakeServer(failures=2)
+        cache.REMOTE_RETRY_DELAY = 0.01
+        writer = cache.RemoteWriter(max_pending=5, interval=0.01)
+        try:
+            for i in range(30):
+                writer.put('key-%d' % i, i)
+            writer.close()
+        finally:
+            cache.SERVER, cache.REMOTE_RETRY_DELAY = server, delay
+        self.assertEqual(len(writer), 0)
+        self.assertEqual(len(fake.entries), 30)
+        self.assertRaises(ValueError, writer.put, 'key-0', 0)
+        snapshot = METRICS.snapshot()
+        self.assertEqual(snapshot.count('cache.remote.put.error'), 2)
+        self.assertTrue(snapshot.count('cache.remote.queue.full') > 0)
+
+    def test_write_behind_unreachable(self):
+        server, delay = cache.SERVER, cache.REMOTE_RETRY_DELAY
+        fake = cache.SERVER = FakeServer(failures=1000)
+        cache.REMOTE_RETRY_DELAY = 0.001
+        writer = cache.RemoteWriter(interval=10)
+        try:
+            value = {'type': 'f'}
+            writer.put('key-0', value)
+            value['type'] = 'foh'
+            # flush gives up after REMOTE_CLOSE_RETRIES failed writes instead of hanging.
+            writer.flush()
+            self.assertEqual(len(writer), 0)
+            self.assertEqual(METRICS.snapshot().count('cache.remote.put.error'), 
+                             cache.REMOTE_CLOSE_RETRIES)
+            fake.failures = 0
+            writer.put('key-1', value)
+            writer.close()
+        finally:
+            cache.SERVER, cache.REMOTE_RETRY_DELAY = server, delay
+        self.assertEqual(fake.entries.keys(), ['key-1'])
+        self.assertEqual(simplejson.loads(fake.entries['key-1']), {'type': 'foh'})
+
+    def test_write_behind_copy(self):
+        server = cache.SERVER
+        fake = cache.SERVER = FakeServer()
+        writer = cache.RemoteWriter(interval=10)
+        try:
+            value = {'type': 'f'}
+            writer.put('key-0', value)
+            value['type'] = 'foh'
+            writer.close()
+        finally:
+            cache.SERVER = server
+        self.assertEqual(simplejson.loads(fake.entries['key-0']), {'type': 'f'})
+
+if __name__ == '__main__':
+    unittest.main()
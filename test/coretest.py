@@ -317,7 +317,7 @@ class TestGeomancer(unittest.TestCase):
         self.assertEqual(p['heading'],'W')
         self.assertEqual(p['interpreted_loc'],'7 mi W 10 Mile')
         self.assertEqual(p['status'],'complete')
-        self.assertEqual(p['features'][0],'10 mile')
+        self.assertEqual(p['features'][0],'10 Mile')
 
         p=parse_loc('6 Mile Creek 7 mi W','foh')
         self.assertEqual(p['verbatim_loc'],'6 Mile Creek 7 mi W')
@@ -409,6 +409,75 @@ class TestGeomancer(unittest.TestCase):
         self.assertEqual(p['status'],'complete')
         self.assertEqual(p['features'][0],'Gaastra')
        
+    def test_lex_offset(self):
+        offset, unit, heading, rest = lex_offset('2 nautical miles east by north of Point Reyes')
+        self.assertEqual(offset, '2')
+        self.assertEqual(unit.name, 'nm')
+        self.assertEqual(heading.name, 'EbN')
+        self.assertEqual(rest, ['Point', 'Reyes'])
+        offset, unit, heading, rest = lex_offset('1/2 mi. north-east by east Davis')
+        self.assertEqual(offset, '0.5')
+        self.assertEqual(unit.name, 'mi')
+        self.assertEqual(heading.name, 'NEbE')
+        self.assertEqual(rest, ['Davis'])
+        offset, unit, heading, rest = lex_offset('Davis 12 km')
+        self.assertEqual(offset, '12')
+        self.assertEqual(unit.name, 'km')
+        self.assertEqual(heading, None)
+        self.assertEqual(rest, ['Davis'])
+        self.assertEqual(get_unit('Miles'), get_unit('mi.'))
+        self.assertEqual(get_heading('North-East').name, 'NE')
+        self.assertEqual(get_heading('nowhere'), None)
+
+    def test_parse_loc_types(self):
+        for loctype in ['f', 'foh', 'fs', 'nf', 'fpoh', 'fo', 'foo', 'joh', 'fph', 'e', 'j', 
+                        'bf', 'pbf', 'jpoh', 'jo', 'joo', 'trss', 'trs', 'nj', 'jh', 'pom', 
+                        'npom', 'nn']:
+            self.assertTrue(PARSERS.has_key(loctype))
+        self.assertEqual(parse_loc('Berkeley', 'xyz'), {})
+
+        p=parse_loc('1 mi S  2 mi W Long Beach', 'foo')
+        self.assertEqual(p['features'], ['Long Beach'])
+        self.assertEqual([x['heading'] for x in p['offsets']], ['S', 'W'])
+        self.assertEqual(p['status'], 'complete')
+
+        p=parse_loc('3 mi E Mecca on Cal 195', 'fpoh')
+        self.assertEqual(p['features'], ['Mecca'])
+        self.assertEqual(p['path'], 'Cal 195')
+        self.assertEqual(p['heading'], 'E')
+
+        p=parse_loc('7 mi N Jct Hwy 78 AND S-2', 'joh')
+        self.assertEqual(p['features'], ['Hwy 78', 'S-2'])
+        self.assertEqual(p['offset_value'], '7')
+        self.assertEqual(p['status'], 'complete')
+
+        p=parse_loc('Highway 101 between Eureka AND Arcata', 'pbf')
+        self.assertEqual(p['features'], ['Eureka', 'Arcata'])
+        self.assertEqual(p['path'], 'Highway 101')
+
+        p=parse_loc('near Wiley Wells', 'nf')
+        self.assertEqual(p['features'], ['Wiley Wells'])
+
+        p=parse_loc('San Gabriel wash south of Azusa', 'fph')
+        self.assertEqual(p['features'], ['Azusa'])
+        self.assertEqual(p['heading'], 'S')
+        self.assertEqual(p['path'], 'San Gabriel wash')
+
+        p=parse_loc('T 17 S R 9 E S 36 NW 1/4', 'trss')
+        self.assertEqual(p['township'], '17 S')
+        self.assertEqual(p['range'], '9 E')
+        self.assertEqual(p['section'], '36')
+        self.assertEqual(p['subsection'], 'NW 1/4')
+        self.assertEqual(p['status'], 'complete')
+
+        p=parse_loc('elev 9350 ft', 'e')
+        self.assertEqual(p['elevation'], '9350')
+        self.assertEqual(p['elevation_unit'], 'ft')
+
+        p=parse_loc('Unknown', 'nn')
+        self.assertEqual(p['features'], [])
+        self.assertEqual(p['status'], 'no locality')
+
     def test_final_georef(self):
         localities = []
         loc_b = parse_loc('5 mi SW Berkeley', 'foh')
@@ -433,6 +502,316 @@ class TestGeomancer(unittest.TestCase):
         kml = bb.to_kml()
         pass
 
+    def test_tracing(self):
+        import logging
+        from geomancer.tracing import Lazy, Tracer
+        class Handler(logging.Handler):
+            def __init__(self):
+                logging.Handler.__init__(self)
+                self.messages = []
+            def emit(self, record):
+                self.messages.append(record.getMessage())
+        calls = []
+        def expensive():
+            calls.append(1)
+            return 'features'
+        handler = Handler()
+        tracer = Tracer('geomancer.test.tracing')
+        tracer.logger.addHandler(handler)
+        tracer.logger.propagate = False
+        try:
+            tracer.logger.setLevel(logging.WARNING)
+            tracer.event('PARSE', '%s', Lazy(expensive))
+            self.assertFalse(tracer.on())
+            self.assertEqual(calls, [])
+            tracer.logger.setLevel(logging.INFO)
+            tracer.event('PARSE', '"%s" %s', 'Berkeley', Lazy(expensive))
+            self.assertTrue(tracer.on())
+            self.assertEqual(handler.messages, ['PARSE: "Berkeley" features'])
+            self.assertEqual(calls, [1])
+            tracer.configure(sample_rate=0)
+            tracer.event('PARSE', '%s', Lazy(expensive))
+            tracer.configure(enabled=False)
+            tracer.event('PARSE', '%s', Lazy(expensive))
+            self.assertFalse(tracer.on())
+            self.assertEqual(len(handler.messages), 1)
+            self.assertEqual(calls, [1])
+        finally:
+            tracer.logger.removeHandler(handler)
+
+    def test_foh_error_bbs(self):
+        import random
+        r = random.Random(7)
+        bbs = []
+        for i in range(300):
+            w, s = r.uniform(-180, 170), r.uniform(-80, 70)
+            bbs.append(BoundingBox.create(w, s + r.uniform(0, 1), lng180(w + r.uniform(0, 1)), s))
+        offsets = [r.choice(['5', '1.5', '10', '0.25', '3']) for bb in bbs]
+        units = [r.choice(['mi', 'km', 'ft', 'm']) for bb in bbs]
+        headings = [r.choice(['N', 'SW', 'ENE', 'W']) for bb in bbs]
+        array = foh_error_bbs(bbs, offsets, units, headings)
+        self.assertEqual(len(array), len(bbs))
+        for i, bb in enumerate(bbs):
+            expected = foh_error_bb(bb, offsets[i], units[i], headings[i])
+            for edge in ['get_w', 'get_n', 'get_e', 'get_s']:
+                self.assertAlmostEqual(getattr(array[i], edge)(), getattr(expected, edge)(), places=DEGREE_DIGITS - 1)
+
+    def test_calculate_foh(self):
+        loc = Locality('5 mi N Berkeley')
+        loc.type = 'foh'
+        loc.parts = parse_loc(loc.name, 'foh')
+        bbs = [BoundingBox.create(-122.3, 37.9, -122.2, 37.8), BoundingBox.create(179.9, 1, -179.9, 0)]
+        georefs = calculate_foh(loc, bbs)
+        self.assertEqual(len(georefs), 2)
+        for bb, georef in zip(bbs, georefs):
+            expected = foh_error_bb(bb, '5', 'mi', 'N')
+            for edge in ['get_w', 'get_n', 'get_e', 'get_s']:
+                self.assertAlmostEqual(getattr(georef, edge)(), getattr(expected, edge)(), places=DEGREE_DIGITS - 1)
+        # Without NumPy the boxes are calculated one at a time, skipping invalid parts too.
+        numpy = sys.modules.get('numpy')
+        sys.modules['numpy'] = None
+        try:
+            self.assertEqual(calculate_foh(loc, bbs), georefs)
+            loc.parts = dict(loc.parts, heading=None)
+            self.assertEqual(calculate_foh(loc, bbs), [])
+        finally:
+            sys.modules['numpy'] = numpy
+        self.assertEqual(calculate_foh(loc, bbs), [])
+
+    def test_foh_errors(self):
+        extents = [100.0, 2500.5, 0.0, 10.0, 10.0, 10.0]
+        offsets = ['5', '1.5', '10.0', '3 1/2', '2', '2']
+        units = ['mi', 'km', 'ft', 'mi', 'furlongs', 'km']
+        headings = ['N', 'SW', 'ENE', 'E', 'E', 'up']
+        errors = foh_errors(extents, offsets, units, headings)
+        self.assertEqual(len(errors), len(extents))
+        for i in range(3):
+            expected = foh_error(None, extents[i], offsets[i], units[i], headings[i])
+            self.assertAlmostEqual(errors[i], expected, places=6)
+        # Invalid offsets, units and headings have NaN errors.
+        for i in range(3, 6):
+            self.assertTrue(errors[i] != errors[i])
+        self.assertEqual(getDistancePrecision('1.5'), DISTANCE_PRECISIONS['1.5'])
+
+    def test_georef_many(self):
+        import geomancer.core
+        cache = geomancer.core.Cache
+        geomancer.core.Cache = FakeCache
+        try:
+            predictor = FakePredictor()
+            geocoder = FakeGeocoder()
+            gm = Geomancer(predictor, geocoder)
+            results = gm.georef_many(['Berkeley, CA', 'berkeley;ca ', 'CA'])
+        finally:
+            geomancer.core.Cache = cache
+        self.assertEqual(len(results), 3)
+        self.assertEqual(sorted(predictor.names), ['Berkeley', 'CA'])
+        self.assertEqual(sorted(geocoder.features), ['Berkeley', 'CA'])
+        self.assertEqual(len(results[1][0]), 2)
+        for localities, georefs in results:
+            for loc in localities:
+                self.assertEqual(loc.type, 'f')
+                self.assertEqual(len(loc.parts['feature_geocodes']), 1)
+        self.assertEqual(len(results[2][1]), 1)
+        self.assertEqual(len(results[0][1]), 1)
+        self.assertEqual(results[0][1], results[1][1])
+
+    def test_georef_without_calculator(self):
+        import geomancer.core
+        cache = geomancer.core.Cache
+        geomancer.core.Cache = FakeCache
+        try:
+            FakeCache.config()
+            geocoder = FakeGeocoder()
+            gm = Geomancer(FakePredictor({'nr Berkeley': 'nf'}), geocoder)
+            results = gm.georef_many(['nr Berkeley, CA', 'Berkeley'])
+            localities, georefs = gm.georef('nr Berkeley, CA')
+            # Features of types without a calculator are not geocoded nor their results cached.
+            self.assertEqual(sorted(geocoder.features), ['Berkeley', 'CA'])
+            self.assertEqual(dict((loc.name, loc.type) for loc in localities), 
+                             {'nr Berkeley': 'nf', 'CA': 'f'})
+            self.assertEqual(len(georefs), 1)
+            self.assertEqual(is_complete(results[0][0]), False)
+            self.assertEqual(FakeCache.get(result_key(localities)), None)
+            self.assertNotEqual(FakeCache.get(result_key(results[1][0])), None)
+        finally:
+            geomancer.core.Cache = cache
+
+    def test_metrics(self):
+        import geomancer.core
+        from geomancer.metrics import METRICS, Metrics
+        cache = geomancer.core.Cache
+        geomancer.core.Cache = FakeCache
+        METRICS.reset()
+        try:
+            gm = Geomancer(FakePredictor(), FakeGeocoder())
+            gm.georef_many(['Berkeley, CA', 'Nowhere'])
+        finally:
+            geomancer.core.Cache = cache
+        snapshot = METRICS.snapshot()
+        self.assertEqual(snapshot.count('records'), 2)
+        self.assertEqual(snapshot.count('api.geocoding.error'), 1)
+        self.assertEqual(snapshot.timings['api.geocoding'].count, 3)
+        self.assertEqual(snapshot.timings['api.prediction'].count, 3)
+        for stage in ['predict', 'parse', 'geocode', 'calculate']:
+            self.assertTrue(snapshot.timings.has_key('stage.%s' % stage))
+        self.assertTrue('2 records' in str(snapshot))
+
+        metrics = Metrics()
+        for seconds in [0.0005, 0.003, 0.003, 0.3, 45]:
+            metrics.record('t', seconds)
+        h = metrics.snapshot().timings['t']
+        self.assertEqual(h.count, 5)
+        self.assertEqual(h.min, 0.0005)
+        self.assertEqual(h.max, 45)
+        self.assertEqual(h.percentile(50), 0.005)
+        self.assertEqual(h.percentile(100), 45)
+
+    def test_geocode_concurrent(self):
+        import geomancer.core
+        cache = geomancer.core.Cache
+        geomancer.core.Cache = FakeCache
+        try:
+            geocoder = FakeGeocoder()
+            gm = Geomancer(FakePredictor(), geocoder, max_in_flight=4)
+            localities = gm.parse(gm.predict(Locality.create_muti('Berkeley, CA, Nowhere')))
+            gm.geocode(localities)
+            geocodes = dict((loc.name, loc.parts['feature_geocodes']) for loc in localities)
+            self.assertEqual(geocodes['Berkeley'], {'Berkeley': test_response_berkeley})
+            self.assertEqual(geocodes['CA'], {'CA': test_response_ca})
+            self.assertEqual(geocodes['Nowhere'], {})
+            self.assertEqual(FakeCache.get('geocode-nowhere'), None)
+            gm.geocode(localities)
+            self.assertEqual(len(geocoder.features), 4)
+            # A malformed response counts as a failed geocode.
+            METRICS.reset()
+            garbled = gm.geocode(gm.parse(gm.predict(Locality.create_muti('Garbled'))))
+            self.assertEqual(garbled[0].parts['feature_geocodes'], {})
+            self.assertEqual(METRICS.snapshot().count('api.geocoding.error'), 1)
+        finally:
+            geomancer.core.Cache = cache
+
+    def test_georef_async(self):
+        import geomancer.core
+        cache = geomancer.core.Cache
+        geomancer.core.Cache = FakeCache
+        try:
+            predictor = FakePredictor()
+            geocoder = FakeGeocoder()
+            gm = AsyncGeomancer(predictor, geocoder, max_in_flight=3)
+            futures = [gm.georef_async('CA') for i in range(20)]
+            futures.append(gm.georef_async('Nowhere'))
+            results = [x.get_result(timeout=10) for x in futures]
+            # A cached result has the same geocodes as a fresh one.
+            results.insert(0, gm.georef_async('CA').get_result(timeout=10))
+        finally:
+            geomancer.core.Cache = cache
+        for localities, georefs in results[:-1]:
+            self.assertEqual(localities[0].parts['feature_geocodes'], {'CA': test_response_ca})
+            self.assertEqual(len(georefs), 1)
+        self.assertEqual(results[-1][1], [])
+        self.assertTrue(predictor.names.count('CA') < 20)
+        self.assertTrue(geocoder.features.count('CA') < 20)
+
+    def test_georef_result_cache(self):
+        import geomancer.core
+        import simplejson
+        cache = geomancer.core.Cache
+        geomancer.core.Cache = FakeCache
+        try:
+            predictor = FakePredictor()
+            geocoder = FakeGeocoder()
+            gm = Geomancer(predictor, geocoder)
+            localities, georefs = gm.georef('Berkeley, CA')
+            key = 'georef-%s-berkeley;ca' % geomancer.core.GEOREF_VERSION
+            value = FakeCache.get(key)
+            stored = simplejson.loads(simplejson.dumps(value))
+            self.assertEqual(value, stored)
+            self.assertFalse(value['localities'][0]['parts'].has_key('feature_geocodes'))
+            self.assertFalse(key in FakeCache.remote)
+            self.assertTrue('geocode-berkeley' in FakeCache.remote)
+            requests = (len(predictor.names), len(geocoder.features))
+            cached_localities, cached_georefs = gm.georef('CA;  berkeley')
+            self.assertEqual((len(predictor.names), len(geocoder.features)), requests)
+            self.assertEqual(cached_georefs, georefs)
+            self.assertEqual(sorted([x.name for x in cached_localities]), ['Berkeley', 'CA'])
+            self.assertEqual(cached_localities[0].type, 'f')
+            fresh = dict((x.name, x.parts['feature_geocodes']) for x in localities)
+            self.assertEqual(dict((x.name, x.parts['feature_geocodes']) for x in cached_localities), fresh)
+            # Changing a result from the cache leaves the cached value alone.
+            for loc in cached_localities:
+                loc.parts['locality_type'] = 'nf'
+                loc.parts['feature_geocodes'].clear()
+            self.assertEqual(FakeCache.get(key), stored)
+            self.assertEqual(gm.georef('berkeley,ca')[0][0].parts['locality_type'], 'f')
+            loc = Locality.from_dict(value['localities'][0])
+            loc.parts['features'] = []
+            self.assertEqual(FakeCache.get(key), stored)
+            results = gm.georef_many(['berkeley, ca', 'Nowhere', 'Nowhere'])
+            self.assertEqual(results[0][1], georefs)
+            self.assertEqual((len(predictor.names), geocoder.features.count('Nowhere')), 
+                             (requests[0] + 1, 1))
+            self.assertEqual(FakeCache.get('georef-%s-nowhere' % geomancer.core.GEOREF_VERSION), None)
+            self.assertEqual([x for x in FakeCache.remote if x.startswith('georef-')], [])
+            gm.georef('Nowhere')
+            self.assertEqual(geocoder.features.count('Nowhere'), 2)
+        finally:
+            geomancer.core.Cache = cache
+
+class FakeCache(object):
+    """In-memory stand-in for geomancer.cache.Cache."""
+    entries = {}
+    remote = set()
+
+    @classmethod
+    def config(cls, creds=None, remote_host=None, local_filename=None):
+        cls.entries = {}
+        cls.remote = set()
+
+    @classmethod
+    def get(cls, key, remote=True):
+        return cls.entries.get(key.lower().strip())
+
+    @classmethod
+    def put(cls, key, value, remote=True):
+        cls.entries[key.lower().strip()] = value
+        if remote:
+            cls.remote.add(key.lower().strip())
+
+    @classmethod
+    def get_many(cls, keys, remote=True):
+        return dict((key, cls.get(key)) for key in keys if cls.get(key) is not None)
+
+    @classmethod
+    def put_many(cls, items, remote=True):
+        for key, value in items:
+            cls.put(key, value, remote)
+
+class FakePredictor(object):
+    """Predicts every locality as a feature, or as loctypes[name] if given, and records 
+    each request."""
+    def __init__(self, loctypes=None):
+        self.names = []
+        self.loctypes = loctypes or {}
+
+    def get_type(self, name):
+        self.names.append(name)
+        loctype = self.loctypes.get(name, 'f')
+        return [loctype, {loctype: 1.0}]
+
+class FakeGeocoder(object):
+    """Answers geocodes from the test responses and records each request."""
+    def __init__(self):
+        self.features = []
+
+    def geocode(self, feature):
+        self.features.append(feature)
+        if feature.lower() == 'nowhere':
+            raise IOError('timed out')
+        if feature.lower() == 'garbled':
+            return simplejson.loads('<html>')
+        return {'berkeley': test_response_berkeley, 'ca': test_response_ca}[feature.lower()]
+
 def get_example_geocode():
     """Returns an Google Geocoding JSON response for "Mountain View"."""
     geocode = simplejson.loads("""{
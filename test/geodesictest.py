@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# Copyright 2011 University of California at Berkeley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "Aaron Steele and John Wieczorek"
+
+"""This module provides unit testing for the ellipsoidal geodesics of the geodesic module."""
+
+import random
+import sys
+import unittest
+
+sys.path.insert(0, '../')
+
+from geomancer import geodesic
+from geomancer import vgeo
+from geomancer.constants import Datums
+from geomancer.point import *
+
+def dms(d, m, s):
+    sign = -1 if d < 0 else 1
+    return sign * (abs(d) + m / 60.0 + s / 3600.0)
+
+# Flinders Peak to Buninyong, from Vincenty's worked example.
+FLINDERS_PEAK = Point(dms(144, 25, 29.5244), dms(-37, 57, 3.7203))
+BUNINYONG = Point(dms(143, 55, 35.3839), dms(-37, 39, 10.1561))
+
+class GeodesicTest(unittest.TestCase):
+    def test_inverse(self):
+        distance, bearing0, bearing1 = geodesic.inverse(
+            FLINDERS_PEAK.lng, FLINDERS_PEAK.lat, BUNINYONG.lng, BUNINYONG.lat)
+        self.assertAlmostEqual(distance, 54972.271, places=3)
+        self.assertAlmostEqual(bearing0, dms(306, 52, 5.37), places=5)
+        self.assertAlmostEqual(bearing1, dms(307, 10, 25.07), places=5)
+        self.assertEqual(geodesic.inverse(10, 10, 10, 10), (0.0, 0.0, 0.0))
+        self.assertAlmostEqual(FLINDERS_PEAK.geodesic_distance(BUNINYONG), 54972.271, places=3)
+        # Nearly antipodal points fall back to the sphere.
+        distance = geodesic.inverse(0, 0, 179.7, 0.5)[0]
+        self.assertTrue(abs(distance - Point(0, 0).haversine_distance(Point(179.7, 0.5))) < 50000)
+
+    def test_direct(self):
+        lng, lat, bearing = geodesic.direct(
+            FLINDERS_PEAK.lng, FLINDERS_PEAK.lat, 54972.271, dms(306, 52, 5.37))
+        self.assertAlmostEqual(lng, BUNINYONG.lng, places=7)
+        self.assertAlmostEqual(lat, BUNINYONG.lat, places=7)
+        self.assertAlmostEqual(bearing, dms(307, 10, 25.07), places=5)
+        p = FLINDERS_PEAK.get_geodesic_point(54972.271, dms(306, 52, 5.37))
+        self.assertAlmostEqual(p.lng, BUNINYONG.lng, places=6)
+        lng, lat, bearing = geodesic.direct(179.9, 0, 50000, 90)
+        self.assertTrue(-180 < lng < -179)
+
+    def test_datums(self):
+        clarke = Datums.NAD27_CONUS_MEAN
+        self.assertTrue(geodesic.get_ellipsoid(clarke) is geodesic.get_ellipsoid(clarke))
+        self.assertNotEqual(geodesic.inverse(0, 0, 1, 1, clarke)[0], geodesic.inverse(0, 0, 1, 1)[0])
+
+    def test_batch(self):
+        r = random.Random(1)
+        n = 300
+        lng0 = [r.uniform(-180, 180) for i in range(n)]
+        lat0 = [r.uniform(-89, 89) for i in range(n)]
+        lng1 = [r.uniform(-180, 180) for i in range(n)]
+        lat1 = [r.uniform(-89, 89) for i in range(n)]
+        lng1[0], lat1[0] = lng0[0], lat0[0]
+        lng0[1], lat0[1], lng1[1], lat1[1] = 0, 0, 179.7, 0.5
+        distances, bearings0, bearings1 = vgeo.geodesic_inverse(lng0, lat0, lng1, lat1)
+        for i in range(n):
+            expected = geodesic.inverse(lng0[i], lat0[i], lng1[i], lat1[i])
+            self.assertAlmostEqual(distances[i], expected[0], places=4)
+            self.assertAlmostEqual(bearings0[i], expected[1], places=7)
+            self.assertAlmostEqual(bearings1[i], expected[2], places=7)
+        lngs, lats, bearings = vgeo.geodesic_direct(lng0, lat0, distances, bearings0)
+        for i in range(n):
+            expected = geodesic.direct(lng0[i], lat0[i], distances[i], bearings0[i])
+            self.assertAlmostEqual(lngs[i], expected[0], places=7)
+            self.assertAlmostEqual(lats[i], expected[1], places=7)
+            if i > 1:
+                self.assertAlmostEqual(lats[i], lat1[i], places=6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# Copyright 2011 University of California at Berkeley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "Aaron Steele and John Wieczorek"
+
+"""This module provides unit testing for the geohash module."""
+
+import sys
+import unittest
+
+sys.path.insert(0, '../')
+
+from geomancer import geohash
+from geomancer.bb import *
+
+class GeohashTest(unittest.TestCase):
+    def test_encode(self):
+        self.assertEqual(geohash.encode(-5.6, 42.6, 5), 'ezs42')
+        self.assertEqual(geohash.encode(10.40744, 57.64911, 11), 'u4pruydqqvj')
+        self.assertEqual(Point(-5.6, 42.6).to_geohash(5), 'ezs42')
+        self.assertEqual(geohash.encode(-180, -90, 2), '00')
+        self.assertEqual(geohash.encode(180, 90, 2), 'zz')
+        self.assertRaises(ValueError, geohash.encode, 0, 0, 13)
+
+    def test_decode(self):
+        w, n, e, s = geohash.decode_bb('ezs42')
+        self.assertTrue(w <= -5.6 <= e and s <= 42.6 <= n)
+        self.assertAlmostEqual(e - w, 360.0 / 2 ** 13)
+        self.assertAlmostEqual(n - s, 180.0 / 2 ** 12)
+        self.assertEqual(geohash.decode_bb('EZS42'), (w, n, e, s))
+        self.assertEqual(BoundingBox.from_geohash('ezs42'), BoundingBox.create(w, n, e, s))
+        self.assertEqual(Point.from_geohash('ezs42').to_geohash(5), 'ezs42')
+        self.assertRaises(ValueError, geohash.decode_bb, 'ezs4a')
+
+    def test_cover(self):
+        bb = BoundingBox.create(-122.3, 37.9, -122.2, 37.8)
+        cover = bb.geohash_cover()
+        self.assertTrue(len(cover) <= geohash.MAX_CELLS)
+        self.assertEqual(cover, sorted(cover))
+        precision = len(cover[0])
+        self.assertTrue(geohash.cover_count(-122.3, 37.9, -122.2, 37.8, precision + 1) > geohash.MAX_CELLS)
+        # Every corner of the box is in a cell of the cover.
+        for lng, lat in [(-122.3, 37.9), (-122.2, 37.9), (-122.2, 37.8), (-122.3, 37.8)]:
+            self.assertTrue(geohash.encode(lng, lat, precision) in cover)
+
+    def test_cover_antimeridian(self):
+        bb = BoundingBox.create(179.5, 1, -179.5, -1)
+        self.assertEqual(bb.geohash_cover(2), ['2p', '80', 'rz', 'xb'])
+        # A box reaching around to the column of its west edge covers every column.
+        cover = geohash.cover(170, 10, 169, -10, 1)
+        self.assertEqual(cover, sorted(geohash.encode(lng, lat, 1) for lng in range(-180, 180, 45) 
+                                       for lat in [-10, 10]))
+
+    def test_cover_meridian(self):
+        # The same west and east edges are a single column, not the whole circle.
+        self.assertEqual(geohash.cover(10, 5, 10, 5), [geohash.encode(10, 5, geohash.MAX_PRECISION)])
+        self.assertEqual(geohash.cover(10, 5, 10, -5, 1), ['k', 's'])
+        self.assertEqual(geohash.cover(190, 5, -170, 5, 2), [geohash.encode(-170, 5, 2)])
+        # A box from -180 to 180 is the whole circle.
+        self.assertEqual(len(geohash.cover(-180, 5, 180, 5, 1)), 8)
+        self.assertEqual(len(BoundingBox.create(-180, 90, 180, -90).geohash_cover(1)), 32)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+# Copyright 2011 The Regents of the University of California
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "John Wieczorek (gtuco.btuco@gmail.com)"
+__copyright__ = "Copyright 2011 The Regents of the University of California"
+__contributors__ = ["Aaron Steele (eightysteele@gmail.com)"]
+
+"""This module benchmarks the locality parsers over the locality type training corpus.
+
+Usage: python parsebench.py [corpus.csv]"""
+
+import setup_env
+setup_env.fix_sys_path()
+
+from geomancer.core import parse_loc
+
+import csv
+import os
+import sys
+import time
+
+CORPUS = os.path.join(setup_env.DIR_PATH, 'tools', 'predict', 'CALocsForPrediction.csv')
+
+def main(argv):
+    filename = CORPUS
+    if len(argv) > 1:
+        filename = argv[1]
+    locs = {}
+    for row in csv.reader(open(filename, 'r')):
+        if len(row) == 2:
+            locs.setdefault(row[0], []).append(row[1])
+    print '%-6s %8s %10s %12s' % ('type', 'rows', 'complete', 'rows/sec')
+    total_rows = 0
+    total_time = 0.0
+    for loctype in sorted(locs.keys(), key=lambda x: -len(locs[x])):
+        start = time.time()
+        parts = [parse_loc(loc, loctype) for loc in locs[loctype]]
+        elapsed = time.time() - start
+        complete = len([x for x in parts if x.get('status') == 'complete'])
+        print '%-6s %8d %10d %12.0f' % (loctype, len(parts), complete, len(parts) / max(elapsed, 1e-9))
+        total_rows += len(parts)
+        total_time += elapsed
+    print '%-6s %8d %10s %12.0f' % ('all', total_rows, '', total_rows / max(total_time, 1e-9))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+# Copyright 2011 University of California at Berkeley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "Aaron Steele and John Wieczorek"
+
+"""This module benchmarks rounding coordinates to DEGREE_DIGITS with round_degrees against
+formatting and parsing them back with truncate.
+
+Usage: python roundbench.py [n]"""
+
+import setup_env
+setup_env.fix_sys_path()
+
+from geomancer.bb import bb_from_pr
+from geomancer.point import DEGREE_DIGITS, Point, round_degrees, truncate
+
+import random
+import sys
+import time
+
+def _time(fn, args):
+    start = time.time()
+    for x in args:
+        fn(x)
+    return time.time() - start
+
+def main(argv):
+    n = 200000
+    if len(argv) > 1:
+        n = int(argv[1])
+    r = random.Random(1)
+    values = [r.uniform(-180, 180) for i in range(n)]
+    points = [Point(r.uniform(-180, 180), r.uniform(-80, 80)) for i in range(n / 10)]
+    print '%-28s %12s' % ('operation', 'ops/sec')
+    for name, fn, args in [
+        ('float(truncate(x))', lambda x: float(truncate(x, DEGREE_DIGITS)), values),
+        ('round_degrees(x)', round_degrees, values),
+        ('bb_from_pr(point, 1000)', lambda p: bb_from_pr(p, 1000), points)]:
+        elapsed = _time(fn, args)
+        print '%-28s %12.0f' % (name, len(args) / max(elapsed, 1e-9))
+    try:
+        import numpy as np
+        from geomancer import vgeo
+    except ImportError:
+        return
+    array = np.array(values)
+    start = time.time()
+    vgeo.round_degrees(array)
+    print '%-28s %12.0f' % ('vgeo.round_degrees(array)', n / max(time.time() - start, 1e-9))
+
+if __name__ == '__main__':
+    main(sys.argv)
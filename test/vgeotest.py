@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# Copyright 2011 University of California at Berkeley
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+__author__ = "Aaron Steele and John Wieczorek"
+
+"""This module provides unit testing for the array geodesy of the vgeo module."""
+
+import random
+import sys
+import unittest
+
+sys.path.insert(0, '../')
+
+import numpy as np
+
+from geomancer import geohash
+from geomancer import vgeo
+from geomancer.bb import great_circle_midpoint
+from geomancer.constants import Datums
+from geomancer.point import *
+
+def _points(n, seed=1):
+    r = random.Random(seed)
+    return [Point(r.uniform(-180, 180), r.uniform(-89, 89)) for i in range(n)]
+
+class VGeoTest(unittest.TestCase):
+    def assertClose(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        for e, a in zip(expected, actual):
+            self.assertAlmostEqual(e, a, places=DEGREE_DIGITS)
+
+    def test_point_from_distance_at_bearing(self):
+        points = _points(500)
+        r = random.Random(2)
+        distances = [r.uniform(0, 500000) for p in points]
+        bearings = [r.choice([0, 90, 180, 270, r.uniform(0, 360)]) for p in points]
+        lngs, lats = vgeo.point_from_distance_at_bearing(
+            [p.lng for p in points], [p.lat for p in points], distances, bearings)
+        expected = [p.get_point_from_distance_at_bearing(d, b) 
+                    for p, d, b in zip(points, distances, bearings)]
+        self.assertClose([x.lng for x in expected], lngs)
+        self.assertClose([x.lat for x in expected], lats)
+        lng, lat = vgeo.point_from_distance_at_bearing(0, 0, 0, 0)
+        self.assertEqual((lng, lat), (0, 0))
+
+    def test_nan_rows(self):
+        import warnings
+        nan = float('nan')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            lng, lat = vgeo.point_from_distance_at_bearing([0, 0], [0, 0], [1000, nan], [0, nan])
+            edges = vgeo.bbs_from_pr([0, nan], [0, nan], [1000, nan])
+        self.assertEqual(caught, [])
+        self.assertTrue(np.isnan(lng[1]) and np.isnan(lat[1]))
+        self.assertFalse(np.isnan(lat[0]))
+        self.assertTrue(all(np.isnan(x[1]) and not np.isnan(x[0]) for x in edges))
+
+    def test_haversine_distance(self):
+        p0 = _points(500, 3)
+        p1 = _points(500, 4)
+        p1[0] = Point(-p0[0].lng + 180, -p0[0].lat)
+        distances = vgeo.haversine_distance(
+            [p.lng for p in p0], [p.lat for p in p0], [p.lng for p in p1], [p.lat for p in p1])
+        self.assertClose([a.haversine_distance(b) for a, b in zip(p0, p1)], distances)
+
+    def test_great_circle_midpoint(self):
+        p0 = _points(500, 5)
+        p1 = _points(500, 6)
+        lngs, lats = vgeo.great_circle_midpoint(
+            [p.lng for p in p0], [p.lat for p in p0], [p.lng for p in p1], [p.lat for p in p1])
+        expected = [great_circle_midpoint(a, b) for a, b in zip(p0, p1)]
+        self.assertClose([x.lng for x in expected], lngs)
+        self.assertClose([x.lat for x in expected], lats)
+
+    def test_point2wgs84(self):
+        points = _points(500, 7)
+        for code in ['NAD27_CONUS_MEAN', 'EUROPEAN_1950_EUROPE_MEAN', 'WGS84']:
+            datum = getattr(Datums, code)
+            lngs, lats = vgeo.point2wgs84([p.lng for p in points], [p.lat for p in points], datum)
+            expected = [p.point2wgs84(datum) for p in points]
+            self.assertClose([x.lng for x in expected], lngs)
+            self.assertClose([x.lat for x in expected], lats)
+
+    def test_columns2wgs84(self):
+        points = _points(300, 8)
+        codes = ['NAD27', 'EPSG:4326', 'North American Datum 1983', 'martian', 'ARC_1950_MEAN']
+        datums = [Datums.find(codes[i % len(codes)]) for i in range(len(points))]
+        self.assertEqual(datums[:4], [Datums.NAD27_CONUS_MEAN, Datums.WGS84, Datums.NAD83_MEAN, None])
+        lngs, lats = vgeo.columns2wgs84([p.lng for p in points], [p.lat for p in points], datums)
+        for p, datum, lng, lat in zip(points, datums, lngs, lats):
+            if datum is None:
+                self.assertTrue(np.isnan(lng) and np.isnan(lat))
+                continue
+            expected = p.point2wgs84(datum)
+            self.assertAlmostEqual(expected.lng, lng, places=DEGREE_DIGITS)
+            self.assertAlmostEqual(expected.lat, lat, places=DEGREE_DIGITS)
+        self.assertTrue(vgeo.get_datum_transform(Datums.WGS84) is vgeo.get_datum_transform(Datums.WGS84))
+
+    def test_find_datum(self):
+        for value in ['WGS 84', 'wgs-84', 'World Geodetic System 1984', 'EPSG 4326']:
+            self.assertEqual(Datums.find(value), Datums.WGS84)
+        for value in ['NAD 27', 'North American Datum 1927', 'EPSG:4267']:
+            self.assertEqual(Datums.find(value), Datums.NAD27_CONUS_MEAN)
+        self.assertEqual(Datums.find('NAD 83'), Datums.NAD83_MEAN)
+        self.assertEqual(Datums.find('Indian 1954'), Datums.INDIAN_1954)
+        # Datums without ellipsoid parameters can't be transformed.
+        self.assertEqual(Datums.find('EVEREST_INDIA_1856_ELLIPSOID'), None)
+        self.assertEqual(Datums.find(''), None)
+        for value in ['not recorded', 'NOT_RECORDED', 'not recorded (forced WGS84)', 'EPSG:6030']:
+            self.assertEqual(Datums.find(value), None)
+        datums = [Datums.EVEREST_INDIA_1856_ELLIPSOID, Datums.WGS84]
+        lngs, lats = vgeo.columns2wgs84([10, 10], [20, 20], datums)
+        self.assertTrue(np.isnan(lngs[0]) and np.isnan(lats[0]))
+        self.assertClose([10, 20], [lngs[1], lats[1]])
+
+    def test_round_degrees(self):
+        r = random.Random(9)
+        values = [r.uniform(-180, 180) for i in range(2000)] + [0.00390625, -0.00390625, 0.0, 180.0]
+        rounded = vgeo.round_degrees(np.array(values))
+        for x, y in zip(values, rounded):
+            self.assertEqual(round_degrees(x), y)
+            self.assertAlmostEqual(round_degrees(x), float(truncate(x, DEGREE_DIGITS)), places=DEGREE_DIGITS)
+        self.assertEqual(round_degrees(0.00390625), 0.0039062)
+        self.assertEqual(round_degrees(1.25, 1), 1.2)
+        self.assertEqual(round_degrees(1.35, 1), 1.4)
+
+    def test_lng180(self):
+        self.assertEqual(list(vgeo.lng180(np.array([-190, -180, 0, 180, 190]))), 
+                         [lng180(x) for x in [-190, -180, 0, 180, 190]])
+
+    def test_geohash(self):
+        points = _points(1000)
+        lng = [p.lng for p in points]
+        lat = [p.lat for p in points]
+        for precision in [1, 5, 12]:
+            hashes = vgeo.geohash_encode(lng, lat, precision)
+            self.assertEqual(hashes.tolist(), [p.to_geohash(precision) for p in points])
+        mixed = ['ezs42', 'u4pruydqqvj', 'U', 'ezs42']
+        w, n, e, s = vgeo.geohash_decode_bb(mixed)
+        self.assertEqual(zip(w, n, e, s), [geohash.decode_bb(x) for x in mixed])
+        self.assertRaises(ValueError, vgeo.geohash_decode_bb, ['ezs42', 'ezsa2'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,19 +22,27 @@ global verbosity
 verbosity = 1
 
 # Geomancer modules
+from geomancer.cache import Cache
+from geomancer.constants import Datums
 from geomancer.core import Geomancer, Locality
 from geomancer.exporting import GoogleFusionTablesApi
 from geomancer.geocoding import GoogleGeocodingApi
+from geomancer.metrics import METRICS
+from geomancer.point import DEGREE_DIGITS, truncate
+from geomancer.tracing import TRACE
 from geomancer.prediction import GooglePredictionApi
 from geomancer.utils import UnicodeDictReader, UnicodeDictWriter
 
 # Standard Python modules
 import httplib2
+import itertools
 import logging
+from multiprocessing.pool import ThreadPool
 import optparse
 import simplejson
 import sys
 import tempfile
+import time
 import urllib
 import yaml
 
@@ -55,6 +63,10 @@ def _GeoreferenceOptions(self, parser):
                       metavar='FILE', help='YAML config file.')
     parser.add_option('--filename', type='string', dest='filename',
                       metavar='FILE', help='CSV file with data to bulkload.')                      
+    parser.add_option('--output_filename', type='string', dest='output_filename',
+                      metavar='FILE', help='CSV file to write georeferenced records to.')                      
+    parser.add_option('--locality_field', type='string', dest='locality_field', 
+                      default='locality', help='CSV column holding the locality.')                      
     parser.add_option('--url', type='string', dest='url',
                       help='URL endpoint to /remote_api to bulkload to.')                          
     parser.add_option('--host', type='string', dest='host',
@@ -63,11 +75,54 @@ def _GeoreferenceOptions(self, parser):
                       help='Number of threads to transfer records with.')                          
     parser.add_option('--batch_size', type='int', dest='batch_size', default=1,
                       help='Number of records to pst in each request.')                          
+    parser.add_option('--max_in_flight', type='int', dest='max_in_flight', default=5,
+                      help='Number of cache lookups, predictions and geocodes to run concurrently.')                          
+    parser.add_option('--geocode_timeout', type='float', dest='geocode_timeout', default=None,
+                      help='Seconds to wait on each geocode request.')                          
+    parser.add_option('--metrics_interval', type='float', dest='metrics_interval', default=60,
+                      help='Seconds between pipeline metrics summaries while georeferencing a file.')                          
+    parser.add_option('--trace_sample_rate', type='float', dest='trace_sample_rate', default=1.0,
+                      help='Fraction of pipeline trace events to log when verbose.')                          
+    parser.add_option('--write_behind', dest='write_behind', action='store_true', 
+                      help='Write remote cache updates from a background thread in batches.')                          
     parser.add_option('-l', '--localhost', dest='localhost', action='store_true', 
                       help='Shortcut for bulkloading to http://localhost:8080/_ah/remote_api')                          
     parser.add_option('-e', '--export', dest='export', action='store_true', 
                       help='Export georeferences to Google Fusion Tables')                          
 
+def _DatumOptions(self, parser):
+    parser.add_option('--filename', type='string', dest='filename',
+                      metavar='FILE', help='CSV file with coordinates to transform.')                      
+    parser.add_option('--output_filename', type='string', dest='output_filename',
+                      metavar='FILE', help='CSV file to write transformed records to.')                      
+    parser.add_option('--latitude_field', type='string', dest='latitude_field', 
+                      default='decimalLatitude', help='CSV column holding the latitude.')                      
+    parser.add_option('--longitude_field', type='string', dest='longitude_field', 
+                      default='decimalLongitude', help='CSV column holding the longitude.')                      
+    parser.add_option('--datum_field', type='string', dest='datum_field', 
+                      default='geodeticDatum', help='CSV column holding the datum.')                      
+    parser.add_option('--chunk_size', type='int', dest='chunk_size', default=10000,
+                      help='Number of records to transform at a time.')                          
+
+def _UncertaintyOptions(self, parser):
+    parser.add_option('--filename', type='string', dest='filename',
+                      metavar='FILE', help='CSV file with records to score.')                      
+    parser.add_option('--output_filename', type='string', dest='output_filename',
+                      metavar='FILE', help='CSV file to write scored records to.')                      
+    parser.add_option('--extent_field', type='string', dest='extent_field', 
+                      default='extent', help='CSV column holding the feature extent in meters.')                      
+    parser.add_option('--offset_field', type='string', dest='offset_field', 
+                      default='offset', help='CSV column holding the offset distance.')                      
+    parser.add_option('--unit_field', type='string', dest='unit_field', 
+                      default='offsetUnit', help='CSV column holding the offset distance unit.')                      
+    parser.add_option('--heading_field', type='string', dest='heading_field', 
+                      default='heading', help='CSV column holding the heading.')                      
+    parser.add_option('--uncertainty_field', type='string', dest='uncertainty_field', 
+                      default='coordinateUncertaintyInMeters', 
+                      help='CSV column to write the uncertainty in meters to.')                      
+    parser.add_option('--chunk_size', type='int', dest='chunk_size', default=10000,
+                      help='Number of records to transform at a time.')                          
+
 class Action(object):
     """Contains information about a command line action."""
 
@@ -104,7 +159,30 @@ class Gm(object):
             usage='%prog [options] georef <file>',
             options=_GeoreferenceOptions,
             short_desc='Georeference.',
-            long_desc="""TODO"""))
+            long_desc="""TODO"""),
+        datum=Action(
+            function='Datum',
+            usage='%prog [options] datum --filename <file>',
+            options=_DatumOptions,
+            short_desc='Transform coordinates to WGS84.',
+            long_desc="""
+Transforms the coordinates of every record of a CSV file from the datum named in
+its --datum_field column to WGS84 and writes the records with two more columns,
+the --latitude_field and --longitude_field names followed by WGS84. Datums may
+be given as codes, EPSG codes or names. Records with an unknown or unrecorded datum
+or without coordinates get empty WGS84 columns."""),
+        uncertainty=Action(
+            function='Uncertainty',
+            usage='%prog [options] uncertainty --filename <file>',
+            options=_UncertaintyOptions,
+            short_desc='Calculate Feature Offset Heading uncertainties.',
+            long_desc="""
+Calculates the uncertainty in meters of every Feature Offset Heading record of a
+CSV file with the MaNIS georeferencing calculator, from the feature extent in 
+meters and the offset, offset unit and heading in the --extent_field, 
+--offset_field, --unit_field and --heading_field columns. Writes the records with
+the uncertainty in the --uncertainty_field column, which is replaced if present.
+Records with an invalid extent, offset, unit or heading get an empty uncertainty."""))
 
     def __init__(self, argv, parser_class=optparse.OptionParser):
         self.parser_class = parser_class
@@ -155,6 +233,7 @@ class Gm(object):
         self._PrintHelpAndExit(exit_code=0)
 
     def Georef(self):
+        TRACE.configure(sample_rate=self.options.trace_sample_rate)
         if self.options.localhost:
             host = 'localhost:8080'
         else:
@@ -164,7 +243,13 @@ class Gm(object):
         client_id = config['client_id']
         client_secret = config['client_secret']
         predictor = GooglePredictionApi(config['model'], client_id, client_secret)        
-        geomancer = Geomancer(predictor, GoogleGeocodingApi, creds=creds, cache_remote_host=host)
+        geomancer = Geomancer(predictor, GoogleGeocodingApi, creds=creds, cache_remote_host=host,
+                              max_in_flight=self.options.max_in_flight,
+                              geocode_timeout=self.options.geocode_timeout)
+        if self.options.write_behind:
+            Cache.config(write_behind=True)
+        if self.options.filename:
+            return self.GeorefFile(geomancer)
         locality = self.options.address
         localities, georefs = geomancer.georef(locality)
         if georefs is not None:
@@ -178,6 +263,183 @@ class Gm(object):
                 logging.info('No georefs to export')
         return localities
 
+    def GeorefFile(self, geomancer):
+        """Georeferences every row of the --filename CSV file.
+
+        Rows are streamed through a pool of --num_threads workers one window
+        at a time and written out in --batch_size chunks, so only a window of
+        rows is ever held in memory regardless of the size of the file."""
+        filename = self.options.filename
+        outfile = self.options.output_filename
+        if not outfile:
+            outfile = '%s.georefs.csv' % filename.rsplit('.csv', 1)[0]
+        field = self.options.locality_field
+        num_threads = max(1, self.options.num_threads)
+        batch_size = max(1, self.options.batch_size)
+        reader = UnicodeDictReader(filename)
+        if field not in reader.fieldnames:
+            raise ValueError('No "%s" column in %s' % (field, filename))
+        writer = UnicodeDictWriter(outfile, reader.fieldnames + ['georefs'])
+        writer.writeheader()
+
+        def georef_row(row):
+            try:
+                localities, georefs = geomancer.georef(row[field])
+            except Exception as e:
+                logging.error('Unable to georeference "%s": %s' % (row[field], e))
+                georefs = []
+            row['georefs'] = u''.join([x.to_kml() for x in georefs or []])
+            return row
+
+        pool = ThreadPool(num_threads)
+        window = num_threads * batch_size
+        count = 0
+        METRICS.reset()
+        reported = time.time()
+        try:
+            while True:
+                rows = list(itertools.islice(reader, window))
+                if not rows:
+                    break
+                batch = []
+                for row in pool.imap(georef_row, rows):
+                    batch.append(row)
+                    if len(batch) == batch_size:
+                        writer.writerows(batch)
+                        batch = []
+                if batch:
+                    writer.writerows(batch)
+                count += len(rows)
+                StatusUpdate('Georeferenced %s records' % count)
+                if self.options.metrics_interval and \
+                        time.time() - reported >= self.options.metrics_interval:
+                    StatusUpdate(str(METRICS.snapshot()))
+                    reported = time.time()
+        finally:
+            pool.close()
+            pool.join()
+            writer.stream.close()
+        Cache.flush()
+        StatusUpdate(str(METRICS.snapshot()))
+        logging.info('Wrote %s georeferenced records to %s' % (count, outfile))
+        return outfile
+
+    def Datum(self):
+        """Transforms the coordinates of every row of the --filename CSV file to WGS84.
+
+        Rows are read --chunk_size at a time and the coordinates of each chunk are 
+        transformed in one vectorized batch per datum."""
+        from geomancer import vgeo
+        filename = self.options.filename
+        outfile = self.options.output_filename
+        if not outfile:
+            outfile = '%s.wgs84.csv' % filename.rsplit('.csv', 1)[0]
+        lat_field = self.options.latitude_field
+        lng_field = self.options.longitude_field
+        datum_field = self.options.datum_field
+        reader = UnicodeDictReader(filename)
+        for field in [lat_field, lng_field, datum_field]:
+            if field not in reader.fieldnames:
+                raise ValueError('No "%s" column in %s' % (field, filename))
+        wgs84_lat_field = '%sWGS84' % lat_field
+        wgs84_lng_field = '%sWGS84' % lng_field
+        writer = UnicodeDictWriter(outfile, reader.fieldnames + [wgs84_lat_field, wgs84_lng_field])
+        writer.writeheader()
+        datums = {}
+        count = 0
+        unknown = 0
+        try:
+            while True:
+                rows = list(itertools.islice(reader, max(1, self.options.chunk_size)))
+                if not rows:
+                    break
+                lats, lngs, row_datums = [], [], []
+                for row in rows:
+                    value = row[datum_field]
+                    if not datums.has_key(value):
+                        datums[value] = Datums.find(value)
+                    datum = datums[value]
+                    try:
+                        lat, lng = float(row[lat_field]), float(row[lng_field])
+                    except (TypeError, ValueError):
+                        lat, lng, datum = 0.0, 0.0, None
+                    if datum is None:
+                        unknown += 1
+                    lats.append(lat)
+                    lngs.append(lng)
+                    row_datums.append(datum)
+                wgs84_lngs, wgs84_lats = vgeo.columns2wgs84(lngs, lats, row_datums)
+                for row, datum, lat, lng in zip(rows, row_datums, wgs84_lats.tolist(), wgs84_lngs.tolist()):
+                    if datum is None:
+                        row[wgs84_lat_field] = row[wgs84_lng_field] = u''
+                    else:
+                        row[wgs84_lat_field] = unicode(truncate(lat, DEGREE_DIGITS))
+                        row[wgs84_lng_field] = unicode(truncate(lng, DEGREE_DIGITS))
+                writer.writerows(rows)
+                count += len(rows)
+                StatusUpdate('Transformed %s records' % count)
+        finally:
+            writer.stream.close()
+        if unknown:
+            logging.warning('%s records had no coordinates or an unknown datum' % unknown)
+        logging.info('Wrote %s transformed records to %s' % (count, outfile))
+        return outfile
+
+    def Uncertainty(self):
+        """Calculates the uncertainty of every row of the --filename CSV file.
+
+        Rows are read --chunk_size at a time and the uncertainties of each chunk are 
+        calculated in one vectorized batch."""
+        from geomancer.core import foh_errors
+        filename = self.options.filename
+        outfile = self.options.output_filename
+        if not outfile:
+            outfile = '%s.uncertainty.csv' % filename.rsplit('.csv', 1)[0]
+        fields = [self.options.extent_field, self.options.offset_field, 
+                  self.options.unit_field, self.options.heading_field]
+        uncertainty_field = self.options.uncertainty_field
+        reader = UnicodeDictReader(filename)
+        for field in fields:
+            if field not in reader.fieldnames:
+                raise ValueError('No "%s" column in %s' % (field, filename))
+        fieldnames = list(reader.fieldnames)
+        if uncertainty_field not in fieldnames:
+            fieldnames.append(uncertainty_field)
+        writer = UnicodeDictWriter(outfile, fieldnames)
+        writer.writeheader()
+        count = 0
+        invalid = 0
+        try:
+            while True:
+                rows = list(itertools.islice(reader, max(1, self.options.chunk_size)))
+                if not rows:
+                    break
+                extents = []
+                for row in rows:
+                    try:
+                        extents.append(float(row[fields[0]]))
+                    except (TypeError, ValueError):
+                        extents.append(float('nan'))
+                errors = foh_errors(extents, [row[fields[1]] for row in rows],
+                                    [row[fields[2]] for row in rows], 
+                                    [row[fields[3]] for row in rows])
+                for row, error in zip(rows, errors.tolist()):
+                    if error != error:
+                        # NaN, the extent, offset, unit or heading is not valid.
+                        row[uncertainty_field] = u''
+                        invalid += 1
+                    else:
+                        row[uncertainty_field] = unicode(round(error, 3))
+                writer.writerows(rows)
+                count += len(rows)
+                StatusUpdate('Scored %s records' % count)
+        finally:
+            writer.stream.close()
+        if invalid:
+            logging.warning('%s records had an invalid extent, offset, unit or heading' % invalid)
+        logging.info('Wrote %s scored records to %s' % (count, outfile))
+        return outfile
+
     def Export(self, locality, georefs, localities, client_id, client_secret):
         logging.info('Exporting georefs to Fusion Table')
         temp_file = tempfile.NamedTemporaryFile()